@@ -17,22 +17,48 @@ import asyncio
 import time
 import requests
 from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import json
 import os
 import time
 import asyncio
 import uuid
+import threading
+import sys
+import bisect
+import sqlite3
+import functools
+import contextlib
+import traceback
+import cProfile
+import pstats
+import io
+import hashlib
+import secrets
+import base64
+import socket
+import multiprocessing
+import queue
+import tracemalloc
+import types
+import csv
+import gzip
+import tempfile
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping, MutableMapping, MutableSet
 from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
 import nest_asyncio
 from rapidfuzz import fuzz, process
-import nest_asyncio nest_asyncio.apply()
 
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto,
+    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, InputFile,
+    InlineQueryResultArticle, InputTextMessageContent,
 )
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, CallbackQueryHandler,
-    MessageHandler, filters, ContextTypes
+    ApplicationBuilder, CommandHandler, CallbackQueryHandler, InlineQueryHandler,
+    MessageHandler, TypeHandler, ApplicationHandlerStop, filters, ContextTypes
 )
 from telegram.error import RetryAfter, Conflict, TelegramError
 
@@ -55,6 +81,13 @@ USER_HISTORY_FILE = "user_history.json"
 WITHDRAW_REQUESTS_FILE = "withdraw_requests.json"
 USER_WITHDRAW_RECORDS_FILE = "user_withdraw_records.json"
 REDEEM_CODES_FILE = "redeem_codes.json"
+ALIASES_FILE = "search_aliases.json"
+SESSIONS_DB_FILE = "search_sessions.db"
+EARN_LEDGER_FILE = "user_earn_ledger.json"
+COIN_LEDGER_FILE = "coin_ledger.jsonl"
+WALLET_TOTALS_FILE = "wallet_totals.json"
+ACCESS_ARCHIVE_FILE = "access_archive.jsonl"
+SCHEDULER_STATE_FILE = "scheduler_state.json"
 
 # Behavior constants
 USER_COOLDOWN = 20          # seconds
@@ -62,6 +95,100 @@ DELETE_DELAY = 10 * 60     # 10 minutes (seconds) - per your request
 FREE_ACCESS_DURATION = 24 * 3600  # 24 hours in seconds
 FREE_ACCESS_URL = "https://vplink.in/qWUKsG"  # replace with your free access URL
 
+# Channel ingestion (see CHANNEL INGESTION QUEUE)
+INGEST_WORKERS = 4           # concurrent title normalizers
+INGEST_BATCH_SIZE = 50       # apply + persist once this many titles are ready
+INGEST_FLUSH_INTERVAL = 2.0  # seconds; flush a partial batch after this long
+
+# Earn history retention (see EARN LEDGER)
+HISTORY_RETENTION_DAYS = 14  # raw earn rows are kept this long, older ones become daily rollups
+
+# Scheduled jobs (see SCHEDULER); hours are IST
+LEADERBOARD_REWARD_HOUR_IST = 21
+COMPACTION_HOUR_IST = 4
+DIGEST_HOUR_IST = 22
+DIGEST_MINUTE_IST = 30
+
+# Access expiry (see ACCESS EXPIRY INDEX)
+EXPIRY_REMINDER_HOURS = 6       # remind users this long before their access runs out
+ACCESS_ARCHIVE_AFTER_DAYS = 30  # entries expired longer than this move to ACCESS_ARCHIVE_FILE
+ACCESS_CHECK_INTERVAL = 600     # seconds between reminder / purge passes
+
+# Instrumentation (see METRICS); Prometheus text on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108  # 0 disables the endpoint
+
+# Event loop watchdog (see LOOP LAG WATCHDOG)
+LOOP_LAG_INTERVAL = 0.25        # seconds between loop heartbeats
+LOOP_LAG_THRESHOLD = 0.5        # a heartbeat this late counts as a stall (stack captured + logged)
+LOOP_LAG_ALERT_COOLDOWN = 600   # seconds between admin alerts
+LOOP_LAG_WINDOW = 1200          # recent lag samples kept for percentiles (~5 minutes)
+
+# Memory accounting (see MEMORY STATS); tracemalloc is off unless started with /memstats trace on
+MEMSTATS_TOP_N = 10          # allocation sites listed while tracing
+TRACEMALLOC_FRAMES = 1       # stack frames recorded per allocation (more = slower, more memory)
+
+# Multi-process mode (see WORKER PROCESSES): with WEBHOOK_URL set and WORKER_PROCESSES > 1
+# the bot runs a webhook dispatcher plus worker processes instead of long polling.
+WEBHOOK_URL = ""                # public https URL Telegram posts updates to ("" = polling, one process)
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_SECRET = ""             # X-Telegram-Bot-Api-Secret-Token; random per start when empty
+WEBHOOK_MAX_CONNECTIONS = 40
+WEBHOOK_MAX_BODY = 1024 * 1024  # bytes; larger webhook requests are refused with 413
+WORKER_PROCESSES = 4            # worker 0 is the primary; searches are spread over all of them
+DISPATCH_QUEUE_SIZE = 1000      # updates buffered per worker before the webhook answers 503
+SHARED_STATE_DB = "shared_state.db"
+SHARED_POLL_INTERVAL = 1.0      # seconds between shared store polls (ops inbox, catalog feed)
+CATALOG_FEED_RETENTION = 24 * 3600
+
+# Hot ephemeral state (see STATE BACKEND): "local" keeps cooldowns, search sessions,
+# the daily leaderboard and the membership cache in this process (plus the sessions
+# SQLite file); "resp" keeps them in a Redis-protocol server shared by every process.
+STATE_BACKEND = "local"
+REDIS_HOST = "127.0.0.1"
+REDIS_PORT = 6379
+REDIS_PASSWORD = ""
+REDIS_DB = 0
+REDIS_KEY_PREFIX = "moviebot:"
+REDIS_TIMEOUT = 0.5             # seconds per connect / reply
+REDIS_BREAKER_SECONDS = 30      # after a connection failure, skip the server for this long
+MEMBERSHIP_CACHE_TTL = 600      # seconds a confirmed channel membership is trusted
+MEMBERSHIP_CACHE_SIZE = 50000   # entries kept by the local backend
+
+# Withdrawals (see WITHDRAWAL QUEUE)
+PENDING_PAGE_SIZE = 10      # requests per /pending page
+NOTIFY_RATE_PER_SEC = 20    # user notifications per second (Telegram allows ~30 msg/s per bot)
+
+# Admin analytics (see ANALYTICS SNAPSHOTS)
+ANALYTICS_SNAPSHOT_INTERVAL = 60   # seconds between snapshot rebuilds
+ANALYTICS_MAX_AGE = 180            # reports rebuild on demand when the snapshot is older than this
+
+# Exports (see EXPORTS)
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024  # compressed export kept in memory up to this, then spilled to a temp file
+MESSAGE_TEXT_LIMIT = 4000             # listings longer than this are sent as an export file instead
+
+# Rate limiting (see RATE LIMITING)
+# action -> (burst, tokens refilled per minute); the admin is never limited
+RATE_LIMITS = {
+    "search": (6, 6),         # plain text messages (USER_COOLDOWN still spaces out the searches themselves)
+    "page": (20, 30),         # result pages and facet filters
+    "confirm": (8, 10),       # picks that deliver a file
+    "refer": (3, 2),
+    "dashboard": (3, 4),
+    "leaderboard": (3, 4),
+    "history": (3, 4),
+    "verify": (4, 2),
+    "start": (5, 5),
+    "redeem": (5, 2),
+    "inline": (30, 60),
+}
+RATE_LIMIT_MAX_KEYS = 200_000  # per action; the least recently seen users are forgotten first
+# Overload shedding on the number of updates waiting in the application queue
+OVERLOAD_QUEUE_DEPTH = 200     # above this, drop the RATE_LIMIT_SHED actions
+OVERLOAD_HARD_DEPTH = 1000     # above this, drop every limited action
+RATE_LIMIT_SHED = ("dashboard", "leaderboard", "history", "refer", "inline")
+
 # Premium plan definitions (text, code, days)
 PREMIUM_PLANS = [
     ("Basic 1 Month - â¹25", "plan_1m", 30,),
@@ -86,9 +213,244 @@ PREMIUM_PLAN_QR = {
 # Personalized start image (use a URL Telegram can access)
 DEFAULT_START_IMAGE = "https://blogger.googleusercontent.com/img/b/R29vZ2xl/AVvXsEjHoOiFbGOJgoZamEQXRSorCan1ma_oVouEb354CJ7mF1O9NbCUKyZzCwenWYGPPmrheFX82lsqWJkjNe7TFNDI7f8Ir83U5SH5P3HIplaRe-9_U5FQNnzlyysg_SOX3uRjBmanOrj-vsdIAhe5v2PPICRHuQYkcIKcbtDyeQD5zaQTthwAbGE-z33Ov0VR/s1536/file_0000000011d061f8b586307360cbd095.png"
 
+# ------------------ METRICS ------------------
+# Handler latency histograms (fed by instrument_handlers()), event counters
+# (inc()) and gauges, exported in Prometheus text format by the local
+# /metrics endpoint and summarized by /perf.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+MAX_HANDLER_LABELS = 200  # callback-prefix labels beyond this are folded into "button:other"
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # last slot: above the top bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, capped at the largest value seen."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[i], self.max) if i < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+handler_latency = {}  # handler label -> Histogram
+counters = dict.fromkeys((
+    "searches", "exact_hits", "alias_hits", "facet_hits", "fuzzy_hits", "not_found",
+    "deliveries", "deletions", "gemini_calls", "gemini_failures", "persistence_flushes",
+    "handler_errors", "loop_stalls", "throttled", "shed",
+), 0)
+# (name, help, fn() -> number); the functions read state defined further down
+metric_gauges = [
+    ("users", "Known users.", lambda: len(users)),
+    ("titles", "Indexed titles.", lambda: len(movie_titles)),
+    ("access_active", "Users with unexpired access.", lambda: len(access_index) - _access_pos(time.time())),
+    ("withdrawals_pending", "Pending withdrawal requests.", lambda: len(withdraw_index["pending"])),
+    ("notify_queue", "Queued user notifications.", lambda: notify_queue.qsize() if notify_queue else 0),
+    ("ingest_queue", "Channel posts waiting to be ingested.", lambda: ingest_queue.qsize() if ingest_queue else 0),
+    ("rate_limit_keys", "Users tracked by the rate limiter.", lambda: len(rate_limiter)),
+]
+
+def inc(name: str, n: int = 1):
+    counters[name] = counters.get(name, 0) + n
+
+def observe_latency(label: str, seconds: float):
+    hist = handler_latency.get(label)
+    if hist is None:
+        hist = handler_latency[label] = Histogram()
+    hist.observe(seconds)
+
+def timed_handler(callback, label):
+    """Wrap a PTB callback so each call feeds handler_latency[label]; label may be a callable(update)."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        name = label(update) if callable(label) else label
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            inc("handler_errors")
+            raise
+        finally:
+            observe_latency(name, time.perf_counter() - started)
+    wrapper.timed = True
+    return wrapper
+
+def _callback_label(update) -> str:
+    data = (update.callback_query.data or "") if update and update.callback_query else ""
+    label = "button:" + (data.split(":", 1)[0] or "empty")
+    if label not in handler_latency and len(handler_latency) >= MAX_HANDLER_LABELS:
+        return "button:other"
+    return label
+
+def instrument_handlers(app):
+    """Time every handler registered on app (commands by name, buttons by callback prefix)."""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            if getattr(handler.callback, "timed", False):
+                continue
+            if isinstance(handler, CommandHandler):
+                label = "/" + sorted(handler.commands)[0]
+            elif isinstance(handler, CallbackQueryHandler):
+                label = _callback_label
+            else:
+                label = handler.callback.__name__
+            handler.callback = timed_handler(handler.callback, label)
+
+def _prom_escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def render_prometheus() -> str:
+    out = [
+        "# HELP bot_handler_latency_seconds Telegram handler latency.",
+        "# TYPE bot_handler_latency_seconds histogram",
+    ]
+    for label, hist in sorted(handler_latency.items()):
+        name = _prom_escape(label)
+        cumulative = 0
+        for bound, c in zip(LATENCY_BUCKETS, hist.counts):
+            cumulative += c
+            out.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="{bound}"}} {cumulative}')
+        out.append(f'bot_handler_latency_seconds_bucket{{handler="{name}",le="+Inf"}} {hist.count}')
+        out.append(f'bot_handler_latency_seconds_sum{{handler="{name}"}} {hist.sum:.6f}')
+        out.append(f'bot_handler_latency_seconds_count{{handler="{name}"}} {hist.count}')
+    out += ["# HELP bot_events_total Bot events.", "# TYPE bot_events_total counter"]
+    for event, value in sorted(counters.items()):
+        out.append(f'bot_events_total{{event="{_prom_escape(event)}"}} {value}')
+    for name, help_text, fn in metric_gauges:
+        try:
+            value = fn()
+        except Exception:
+            continue
+        out += [f"# HELP bot_{name} {help_text}", f"# TYPE bot_{name} gauge", f"bot_{name} {value}"]
+    return "\n".join(out) + "\n"
+
+_metrics_server = None
+
+async def _serve_metrics(reader, writer):
+    try:
+        request_line = (await asyncio.wait_for(reader.readline(), 5)).decode("latin-1")
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split(" ")[1] if request_line.count(" ") >= 2 else ""
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", render_prometheus().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        print("metrics request failed:", e)
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT once per process."""
+    global _metrics_server
+    if _metrics_server is not None or not METRICS_PORT:
+        return
+    try:
+        _metrics_server = await asyncio.start_server(_serve_metrics, METRICS_HOST, METRICS_PORT)
+        print(f"â Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print(f"â ï¸ Metrics endpoint not started: {e}")
+
+# ------------------ LOOP LAG WATCHDOG ------------------
+# loop_lag_monitor() wakes every LOOP_LAG_INTERVAL on the event loop and records
+# how late it woke up. A daemon thread watches the same deadline: if the loop
+# misses it by LOOP_LAG_THRESHOLD the thread grabs the loop thread's stack while
+# the blocking code is still running. The monitor logs that stack when the loop
+# recovers and alerts the admin (throttled).
+loop_lags = deque(maxlen=LOOP_LAG_WINDOW)  # recent lag samples (seconds)
+loop_stalls = deque(maxlen=20)             # recent stalls: {"ts", "lag", "site", "stack"}
+stall_sites = {}                           # innermost bot.py frame -> stall count
+_lag_state = {"task": None, "thread": None, "loop_thread": None, "due": 0.0,
+              "stack": None, "last_alert": 0.0, "bot": None, "max": 0.0}
+
+def loop_lag_percentile(q: float) -> float:
+    if not loop_lags:
+        return 0.0
+    ordered = sorted(loop_lags)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def _lag_watchdog():
+    while True:
+        time.sleep(LOOP_LAG_INTERVAL / 2)
+        due = _lag_state["due"]
+        if due and _lag_state["stack"] is None and time.monotonic() - due > LOOP_LAG_THRESHOLD:
+            frame = sys._current_frames().get(_lag_state["loop_thread"])
+            if frame is not None:
+                _lag_state["stack"] = traceback.extract_stack(frame)
+
+def _stall_site(stack) -> str:
+    """Innermost frame in this file (the code to fix), else the innermost frame."""
+    this_file = os.path.basename(__file__)
+    for fs in reversed(stack):
+        if os.path.basename(fs.filename) == this_file and fs.name not in ("_lag_watchdog",):
+            return f"{fs.name} (line {fs.lineno})"
+    fs = stack[-1]
+    return f"{fs.name} ({os.path.basename(fs.filename)}:{fs.lineno})"
+
+def report_stall(lag: float, stack):
+    site = _stall_site(stack) if stack else "unknown (stack not captured)"
+    stall_sites[site] = stall_sites.get(site, 0) + 1
+    inc("loop_stalls")
+    frames = [fs for fs in stack or () if "asyncio" not in fs.filename]  # drop event loop plumbing
+    text_stack = "".join(traceback.format_list(frames[-12:]))
+    loop_stalls.append({"ts": time.time(), "lag": lag, "site": site, "stack": text_stack})
+    print(f"â ï¸ Event loop blocked for {lag:.2f}s in {site}\n{text_stack}")
+    now = time.time()
+    if _lag_state["bot"] is not None and now - _lag_state["last_alert"] >= LOOP_LAG_ALERT_COOLDOWN:
+        _lag_state["last_alert"] = now
+        enqueue_notification(_lag_state["bot"], ADMIN_USER_ID,
+                             f"â ï¸ Event loop blocked for {lag:.2f}s\nat {site}\n\n{text_stack[-3000:]}")
+
+async def loop_lag_monitor():
+    while True:
+        _lag_state["due"] = time.monotonic() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, time.monotonic() - _lag_state["due"])
+        stack, _lag_state["stack"] = _lag_state["stack"], None
+        loop_lags.append(lag)
+        _lag_state["max"] = max(_lag_state["max"], lag)
+        if lag >= LOOP_LAG_THRESHOLD:
+            report_stall(lag, stack)
+
+def start_loop_monitor(bot=None):
+    """Start the lag monitor task and watchdog thread once per process."""
+    _lag_state["bot"] = bot
+    task = _lag_state["task"]
+    if task is not None and not task.done():
+        return
+    _lag_state["loop_thread"] = threading.get_ident()
+    _lag_state["task"] = asyncio.create_task(loop_lag_monitor())
+    if _lag_state["thread"] is None:
+        _lag_state["thread"] = threading.Thread(target=_lag_watchdog, name="loop-lag-watchdog", daemon=True)
+        _lag_state["thread"].start()
+
+metric_gauges.append(("loop_lag_p99_seconds", "p99 event loop lag over the recent window.", lambda: loop_lag_percentile(0.99)))
+
 # ===== Gemini AI Direct Call (Termux compatible) =====
 GEMINI_KEY = "GEMINI_KEY"
-_executor = ThreadPoolExecutor(max_workers=2)
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS)
 _AI_CACHE = {}
 AI_CACHE_TTL = 60 * 60
 
@@ -97,6 +459,7 @@ def call_gemini_direct(prompt_text: str) -> str:
     if not GEMINI_KEY:
         print("â ï¸ Gemini key missing")
         return ""
+    inc("gemini_calls")
     try:
         url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_KEY}"
         headers = {"Content-Type": "application/json"}
@@ -106,9 +469,11 @@ def call_gemini_direct(prompt_text: str) -> str:
             data = res.json()
             return data["candidates"][0]["content"]["parts"][0]["text"].strip()
         else:
+            inc("gemini_failures")
             print("â Gemini API Error:", res.status_code, res.text)
             return ""
     except Exception as e:
+        inc("gemini_failures")
         print("â ï¸ Gemini call failed:", e)
         return ""
 
@@ -174,44 +539,864 @@ def load_json(path, default):
     return default
 
 def save_json(path, data):
+    if WORKER_ID:
+        # search workers never write state files; the primary is their only writer
+        return
+    if isinstance(data, Mapping) and not isinstance(data, dict):
+        # UserState field views serialize as the plain dicts they replace
+        data = dict(data)
+    # write to a temp file and swap it in, so a save running in a worker
+    # thread never leaves a half-written file behind for the next load
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
     try:
-        with open(path, "w", encoding="utf-8") as f:
+        with open(tmp_path, "w", encoding="utf-8") as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
     except Exception as e:
         print(f"â ï¸ Failed to save {path}: {e}")
 
-# persistent data
+# ------------------ SHARED STATE STORE ------------------
+# Multi-process mode only (see WORKER PROCESSES). Worker 0, the primary, keeps
+# the in-memory state and JSON files exactly as in single-process mode and is
+# their only writer. It publishes what the search workers read - user access
+# and verification, catalog and alias changes - to SHARED_STATE_DB (SQLite in
+# WAL mode, so readers never block it), and search workers send their writes
+# back as ops that the primary applies in order.
+WORKER_ID = int(os.environ.get("BOT_WORKER_ID", "0"))        # 0 = primary (or the only process)
+WORKER_COUNT = int(os.environ.get("BOT_WORKER_COUNT", "1"))
+shared_store = None  # SharedStore, opened by run_worker() / the dispatcher
+
+class SharedStore:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "uid INTEGER PRIMARY KEY, access_until REAL DEFAULT 0, verified INTEGER DEFAULT 0, conversation INTEGER DEFAULT 0)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS catalog (seq INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, op TEXT, key TEXT, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS ops (seq INTEGER PRIMARY KEY AUTOINCREMENT, worker INTEGER, op TEXT, args TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS users_conversation ON users (uid) WHERE conversation != 0")
+
+    # user access (primary writes, search workers and the dispatcher read)
+    def publish_users(self, rows):
+        """rows: (uid, access_until, verified)"""
+        self.conn.execute("BEGIN")
+        self.conn.executemany(
+            "INSERT INTO users (uid, access_until, verified) VALUES (?, ?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET access_until = excluded.access_until, verified = excluded.verified",
+            rows,
+        )
+        self.conn.execute("COMMIT")
+
+    def read_user(self, uid: int):
+        return self.conn.execute("SELECT access_until, verified FROM users WHERE uid = ?", (uid,)).fetchone()
+
+    def set_conversation(self, uid: int, active: bool):
+        self.conn.execute(
+            "INSERT INTO users (uid, conversation) VALUES (?, ?) ON CONFLICT(uid) DO UPDATE SET conversation = excluded.conversation",
+            (uid, int(active)),
+        )
+
+    def clear_conversations(self):
+        self.conn.execute("UPDATE users SET conversation = 0 WHERE conversation != 0")
+
+    def conversation_users(self) -> set:
+        return {uid for (uid,) in self.conn.execute("SELECT uid FROM users WHERE conversation != 0")}
+
+    # catalog feed (primary appends, search workers follow)
+    def publish_catalog(self, op: str, key: str, value=None):
+        self.conn.execute("INSERT INTO catalog (ts, op, key, value) VALUES (?, ?, ?, ?)",
+                          (time.time(), op, key, json.dumps(value)))
+
+    def catalog_since(self, seq: int, limit: int = 1000) -> list:
+        rows = self.conn.execute("SELECT seq, op, key, value FROM catalog WHERE seq > ? ORDER BY seq LIMIT ?",
+                                 (seq, limit)).fetchall()
+        return [(s, op, key, json.loads(value)) for s, op, key, value in rows]
+
+    def prune_catalog(self, before_ts: float):
+        self.conn.execute("DELETE FROM catalog WHERE ts < ?", (before_ts,))
+
+    # ops inbox (search workers append, the primary consumes)
+    def send_op(self, op: str, args: list):
+        self.conn.execute("INSERT INTO ops (worker, op, args) VALUES (?, ?, ?)", (WORKER_ID, op, json.dumps(args)))
+
+    def take_ops(self, limit: int = 500) -> list:
+        rows = self.conn.execute("SELECT seq, op, args FROM ops ORDER BY seq LIMIT ?", (limit,)).fetchall()
+        if rows:
+            self.conn.execute("DELETE FROM ops WHERE seq <= ?", (rows[-1][0],))
+        return [(op, json.loads(args)) for _, op, args in rows]
+
+def publish_user_state(user_id):
+    """Primary: push one user's access and verification to the search workers."""
+    if shared_store is None or WORKER_ID:
+        return
+    st = get_user_state(user_id)
+    if st is not None:
+        shared_store.publish_users([(int(user_id), st.access_until, int(st.verified))])
+
+def publish_catalog_change(op: str, key: str, value=None):
+    """Primary: append a catalog/alias change to the feed the search workers follow."""
+    if shared_store is None or WORKER_ID:
+        return
+    shared_store.publish_catalog(op, key, value)
+
+def send_to_primary(op: str, *args) -> bool:
+    """Search workers: queue a write for the primary. False on the primary itself (apply it locally)."""
+    if not WORKER_ID or shared_store is None:
+        return False
+    shared_store.send_op(op, list(args))
+    return True
+
+# ------------------ USER STATE ------------------
+# All per-user data lives in one slotted UserState per user, keyed by integer
+# id in `users`. The old per-field dicts (user_access, verified_users,
+# user_wallet, user_streak, user_history,
+# active_user_messages) are kept as views over the registry: they still take
+# and return string ids and the same value shapes, and save to the same files.
+class UserState:
+    __slots__ = ("access_until", "verified", "wallet", "streak", "last_search_day",
+                 "history", "messages", "earn",
+                 "lifetime_earned", "lifetime_withdrawn", "withdrawn_rupees",
+                 "jackpot_day", "leaderboard_day", "reminded_for")
+
+    def __init__(self):
+        self.access_until = 0.0    # access expiry timestamp
+        self.verified = False      # joined the channel
+        self.wallet = None         # coins (None until the user has a wallet)
+        self.streak = 0            # consecutive search days
+        self.last_search_day = ""  # "YYYY-MM-DD" (interned, shared between users)
+        self.history = None        # {"premium": [], "withdraw": []}
+        self.messages = None       # set of message ids awaiting auto-delete
+        self.earn = None           # EarnLedger (None until the user earns a coin)
+        self.lifetime_earned = 0       # coins, from the coin ledger
+        self.lifetime_withdrawn = 0    # coins, from the coin ledger
+        self.withdrawn_rupees = 0.0    # sum of history["withdraw"] amounts
+        self.jackpot_day = 0           # ist_day_number of the last streak jackpot (0 = never)
+        self.leaderboard_day = 0       # ist_day_number of the last leaderboard reward (0 = never)
+        self.reminded_for = 0.0        # access expiry we already sent a reminder for (runtime only)
+
+users = {}  # int user id -> UserState
+
+def get_user_state(user_id, create: bool = False):
+    """UserState for a (string or int) user id; None if unknown and not create."""
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        if create:
+            raise
+        return None
+    st = users.get(uid)
+    if st is None and create:
+        st = users[uid] = UserState()
+    return st
+
+class UserFieldView(MutableMapping):
+    """str user id -> one UserState field; a user is "in" the view while the field differs from `empty`."""
+
+    def __init__(self, field: str, empty):
+        self.field = field
+        self.empty = empty
+
+    def _get(self, st):
+        return getattr(st, self.field)
+
+    def _set(self, st, value):
+        setattr(st, self.field, value)
+
+    def _present(self, st):
+        return self._get(st) != self.empty
+
+    def __getitem__(self, user_id):
+        st = get_user_state(user_id)
+        if st is None or not self._present(st):
+            raise KeyError(user_id)
+        return self._get(st)
+
+    def __setitem__(self, user_id, value):
+        self._set(get_user_state(user_id, create=True), value)
+
+    def __delitem__(self, user_id):
+        st = get_user_state(user_id)
+        if st is None or not self._present(st):
+            raise KeyError(user_id)
+        setattr(st, self.field, self.empty)
+
+    def __iter__(self):
+        for uid, st in list(users.items()):
+            if self._present(st):
+                yield str(uid)
+
+    def __len__(self):
+        return sum(1 for st in users.values() if self._present(st))
+
+class UserStreakView(UserFieldView):
+    """user_streak view: {"last_search_day": str, "streak": int} built from two slots.
+
+    The reward idempotency markers ride along as "jackpot_day" / "leaderboard_day"
+    when set, so they persist in USER_STREAK_FILE; assigning a dict without them
+    leaves them untouched.
+    """
+
+    def __init__(self):
+        super().__init__("last_search_day", "")
+
+    def _get(self, st):
+        value = {"last_search_day": st.last_search_day, "streak": st.streak}
+        if st.jackpot_day:
+            value["jackpot_day"] = st.jackpot_day
+        if st.leaderboard_day:
+            value["leaderboard_day"] = st.leaderboard_day
+        return value
+
+    def _set(self, st, value):
+        st.last_search_day = sys.intern(value.get("last_search_day", "") or "")
+        st.streak = int(value.get("streak", 0))
+        if "jackpot_day" in value:
+            st.jackpot_day = int(value["jackpot_day"])
+        if "leaderboard_day" in value:
+            st.leaderboard_day = int(value["leaderboard_day"])
+
+    def _present(self, st):
+        return st.last_search_day != ""
+
+    def __delitem__(self, user_id):
+        super().__delitem__(user_id)
+        get_user_state(user_id).streak = 0
+
+class AccessView(UserFieldView):
+    """user_access view that keeps access_index in step with every write."""
+
+    def __init__(self):
+        super().__init__("access_until", 0.0)
+
+    def __setitem__(self, user_id, value):
+        st = get_user_state(user_id, create=True)
+        unindex_access(int(user_id), st.access_until)
+        st.access_until = float(value)
+        index_access(int(user_id), st.access_until)
+        publish_user_state(user_id)
+
+    def __delitem__(self, user_id):
+        st = get_user_state(user_id)
+        if st is not None:
+            unindex_access(int(user_id), st.access_until)
+        super().__delitem__(user_id)
+        publish_user_state(user_id)
+
+class VerifiedUsersView(MutableSet):
+    """verified_users view: set of str user ids with UserState.verified."""
+
+    def __contains__(self, user_id):
+        st = get_user_state(user_id)
+        return st is not None and st.verified
+
+    def __iter__(self):
+        for uid, st in list(users.items()):
+            if st.verified:
+                yield str(uid)
+
+    def __len__(self):
+        return sum(1 for st in users.values() if st.verified)
+
+    def add(self, user_id):
+        get_user_state(user_id, create=True).verified = True
+        publish_user_state(user_id)
+
+    def discard(self, user_id):
+        st = get_user_state(user_id)
+        if st is not None:
+            st.verified = False
+            publish_user_state(user_id)
+
 # Ensure verified_users stored/compared as strings everywhere (consistent)
-verified_users = set(str(x) for x in load_json(VERIFIED_USERS_FILE, []))
-movies_db = load_json(MOVIES_DB_FILE, {})  # normalized -> message_id
-user_access = load_json(USER_ACCESS_FILE, {})  # user_id (str) -> expiry (float timestamp)
+verified_users = VerifiedUsersView()
+user_access = AccessView()                            # user_id (str) -> expiry (float timestamp)
+user_wallet = UserFieldView("wallet", None)           # user_id (str) -> coins
+user_streak = UserStreakView()                        # user_id (str) -> {"last_search_day", "streak"}
+user_history = UserFieldView("history", None)         # user_id (str) -> {"premium", "withdraw"}
+# Track messages that were delivered while user had access
+# Mapping: user_id(str) -> set of message_id(int) (runtime only)
+active_user_messages = UserFieldView("messages", None)
+
+def load_users():
+    def each(path, default):
+        for uid, value in load_json(path, default).items():
+            try:
+                yield get_user_state(uid, create=True), value
+            except ValueError:
+                print(f"â ï¸ Skipping non-numeric user id {uid!r} in {path}")
+    for uid in load_json(VERIFIED_USERS_FILE, []):
+        try:
+            verified_users.add(uid)
+        except ValueError:
+            print(f"â ï¸ Skipping non-numeric user id {uid!r} in {VERIFIED_USERS_FILE}")
+    for st, expiry in each(USER_ACCESS_FILE, {}):
+        st.access_until = float(expiry)
+    for st, coins in each(USER_WALLET_FILE, {}):
+        st.wallet = coins
+    for st, info in each(USER_STREAK_FILE, {}):
+        user_streak._set(st, info)
+    for st, hist in each(USER_HISTORY_FILE, {}):
+        legacy_earn = hist.pop("earn", None) if isinstance(hist, dict) else None
+        st.history = hist
+        if isinstance(hist, dict):
+            st.withdrawn_rupees = sum(float(r.get("amount", 0)) for r in hist.get("withdraw", []))
+        if legacy_earn:
+            migrate_earn_history(st, legacy_earn)
+
+# ------------------ EARN LEDGER ------------------
+# Earn history is stored per user as parallel typed arrays (timestamp, amount,
+# reason code, payload offset) instead of a list of dicts. Reasons are small
+# integer codes; the variable part (search query, referred user id, streak day)
+# is interned once in `ledger_payloads` and referenced by offset. The readable
+# text is only rebuilt for /history. Rows older than HISTORY_RETENTION_DAYS are
+# folded into per-day rollups (event count + coins per reason code) by
+# compact_earn_history().
+EARN_OTHER, EARN_SEARCH, EARN_DAILY, EARN_JACKPOT, EARN_LEADERBOARD, EARN_REFERRAL = range(6)
+EARN_REASONS = {
+    EARN_OTHER: "{}",
+    EARN_SEARCH: "Movie search coin for '{}'",
+    EARN_DAILY: "Daily search bonus",
+    EARN_JACKPOT: "7-day streak jackpot reward (Day {})",
+    EARN_LEADERBOARD: "Leaderboard daily top reward",
+    EARN_REFERRAL: "Referral bonus to {}",
+}
+EARN_CATEGORY_NAMES = {
+    EARN_OTHER: "other",
+    EARN_SEARCH: "search",
+    EARN_DAILY: "daily",
+    EARN_JACKPOT: "jackpot",
+    EARN_LEADERBOARD: "leaderboard",
+    EARN_REFERRAL: "referral",
+}
+EARN_CATEGORIES = len(EARN_REASONS)  # width of one rollup row in roll_coins
+IST_OFFSET = 5 * 3600 + 30 * 60
+
+def ist_day_number(ts: float) -> int:
+    """Days since the epoch in IST (one number per calendar day)."""
+    return int((ts + IST_OFFSET) // 86400)
+
+def ist_day_number_start(day: int) -> float:
+    return day * 86400 - IST_OFFSET
+# Legacy reason text -> (code, payload) when migrating old user_history "earn" lists
+_EARN_REASON_PATTERNS = [
+    (code, re.compile("^" + "(.*)".join(re.escape(part) for part in tpl.split("{}")) + "$", re.S))
+    for code, tpl in EARN_REASONS.items() if code != EARN_OTHER
+]
+
+ledger_payloads = []   # payload offset -> text
+_payload_offsets = {}  # text -> payload offset
+
+def intern_payload(text: str) -> int:
+    off = _payload_offsets.get(text)
+    if off is None:
+        off = _payload_offsets[text] = len(ledger_payloads)
+        ledger_payloads.append(text)
+    return off
+
+def earn_reason_text(code: int, payload: int) -> str:
+    tpl = EARN_REASONS.get(code, "{}")
+    if "{}" not in tpl:
+        return tpl
+    return tpl.format(ledger_payloads[payload] if 0 <= payload < len(ledger_payloads) else "")
+
+class EarnLedger:
+    """One user's earn history; rows are appended in time order so day scans can bisect."""
+    __slots__ = ("ts", "amounts", "codes", "payloads", "roll_days", "roll_counts", "roll_coins")
+    ROW_COLUMNS = ("ts", "amounts", "codes", "payloads")
+
+    def __init__(self):
+        self.ts = array("I")        # unix seconds
+        self.amounts = array("i")   # coins
+        self.codes = array("B")     # EARN_* reason code
+        self.payloads = array("i")  # offset into ledger_payloads, -1 = none
+        # daily rollups of compacted rows, oldest first
+        self.roll_days = array("I")    # ist_day_number
+        self.roll_counts = array("I")  # rows folded into that day
+        self.roll_coins = array("i")   # EARN_CATEGORIES coin totals per day, by reason code
+
+    def __len__(self):
+        """Number of earn events, raw and rolled up."""
+        return len(self.ts) + sum(self.roll_counts)
+
+    def __bool__(self):
+        return bool(self.ts) or bool(self.roll_days)
+
+    def append(self, ts: float, amount: int, code: int, payload: int = -1):
+        self.ts.append(int(ts))
+        self.amounts.append(int(amount))
+        self.codes.append(code)
+        self.payloads.append(payload)
+
+    def _start(self, since_ts: float) -> int:
+        return bisect.bisect_left(self.ts, int(since_ts))
+
+    def total_since(self, since_ts: float, code=None) -> int:
+        start = self._start(since_ts)
+        if code is None:
+            total = sum(self.amounts[start:])
+        else:
+            codes = self.codes
+            total = sum(amount for i, amount in enumerate(self.amounts[start:], start) if codes[i] == code)
+        if self.roll_days:
+            # rollup days that start at or after since_ts
+            first_day = -(-(int(since_ts) + IST_OFFSET) // 86400)
+            for r in range(bisect.bisect_left(self.roll_days, first_day), len(self.roll_days)):
+                row = self.roll_coins[r * EARN_CATEGORIES:(r + 1) * EARN_CATEGORIES]
+                total += sum(row) if code is None else row[code]
+        return total
+
+    def rows_since(self, since_ts: float):
+        """(amounts, codes) of the raw rows at or after since_ts, as array copies."""
+        start = self._start(since_ts)
+        return self.amounts[start:], self.codes[start:]
+
+    def last_day(self, code: int) -> int:
+        """ist_day_number of the newest raw row with this code (0 if none)."""
+        for i in range(len(self.codes) - 1, -1, -1):
+            if self.codes[i] == code:
+                return ist_day_number(self.ts[i])
+        return 0
+
+    def has_payload(self, code: int, text: str) -> bool:
+        off = _payload_offsets.get(text)
+        if off is None:
+            return False
+        return any(c == code and p == off for c, p in zip(self.codes, self.payloads))
+
+    def recent(self, n: int):
+        """Last n rows as (timestamp, amount, reason text), oldest first; topped up with daily rollups."""
+        start = max(0, len(self.ts) - n)
+        rows = [(self.ts[i], self.amounts[i], earn_reason_text(self.codes[i], self.payloads[i]))
+                for i in range(start, len(self.ts))]
+        missing = n - len(rows)
+        if missing > 0 and self.roll_days:
+            rolled = []
+            for r in range(max(0, len(self.roll_days) - missing), len(self.roll_days)):
+                row = self.roll_coins[r * EARN_CATEGORIES:(r + 1) * EARN_CATEGORIES]
+                parts = ", ".join(f"{EARN_CATEGORY_NAMES.get(code, code)} +{coins}"
+                                  for code, coins in enumerate(row) if coins)
+                rolled.append((int(ist_day_number_start(self.roll_days[r])), sum(row),
+                               f"{self.roll_counts[r]} events that day: {parts}"))
+            rows = rolled + rows
+        return rows
+
+    def compact(self, cutoff_ts: float) -> int:
+        """Fold raw rows older than cutoff_ts into daily rollups; returns rows folded."""
+        n = self._start(cutoff_ts)
+        if not n:
+            return 0
+        for i in range(n):
+            day = ist_day_number(self.ts[i])
+            if not self.roll_days or self.roll_days[-1] < day:
+                self.roll_days.append(day)
+                self.roll_counts.append(0)
+                self.roll_coins.extend([0] * EARN_CATEGORIES)
+            code = self.codes[i] if self.codes[i] < EARN_CATEGORIES else EARN_OTHER
+            self.roll_counts[-1] += 1
+            self.roll_coins[len(self.roll_coins) - EARN_CATEGORIES + code] += self.amounts[i]
+        for name in self.ROW_COLUMNS:
+            del getattr(self, name)[:n]
+        return n
+
+def get_earn_ledger(user_id, create: bool = False):
+    st = get_user_state(user_id, create=create)
+    if st is None:
+        return None
+    if st.earn is None and create:
+        st.earn = EarnLedger()
+    return st.earn
+
+def parse_earn_reason(reason: str):
+    """Legacy reason text -> (code, payload offset)."""
+    for code, pattern in _EARN_REASON_PATTERNS:
+        m = pattern.match(reason)
+        if m:
+            return code, (intern_payload(m.group(1)) if m.groups() else -1)
+    return EARN_OTHER, intern_payload(reason)
+
+def migrate_earn_history(st, records):
+    """Move an old [{"timestamp", "amount", "reason"}, ...] list into st.earn."""
+    if st.earn is None:
+        st.earn = EarnLedger()
+    for rec in sorted(records, key=lambda r: r.get("timestamp", 0)):
+        code, payload = parse_earn_reason(str(rec.get("reason", "")))
+        st.earn.append(rec.get("timestamp", 0), rec.get("amount", 0), code, payload)
+
+def compact_earn_history(retention_days: int = HISTORY_RETENTION_DAYS):
+    """Roll up earn rows older than retention_days and drop payload texts nothing points at.
+
+    Returns (users compacted, rows folded, payloads dropped).
+    """
+    cutoff = ist_day_start() - max(1, retention_days) * 86400
+    compacted = folded = 0
+    for st in users.values():
+        if st.earn:
+            n = st.earn.compact(cutoff)
+            if n:
+                compacted += 1
+                folded += n
+    if not folded:
+        return 0, 0, 0
+    # Rebuild the payload table with only the offsets still referenced
+    remap = {}
+    for st in users.values():
+        if st.earn:
+            for p in st.earn.payloads:
+                if p >= 0 and p not in remap:
+                    remap[p] = len(remap)
+    old = list(ledger_payloads)
+    ledger_payloads[:] = [None] * len(remap)
+    for p, q in remap.items():
+        ledger_payloads[q] = old[p]
+    _payload_offsets.clear()
+    _payload_offsets.update((text, q) for q, text in enumerate(ledger_payloads))
+    for st in users.values():
+        if st.earn and st.earn.payloads:
+            st.earn.payloads = array("i", (remap[p] if p >= 0 else p for p in st.earn.payloads))
+    return compacted, folded, len(old) - len(ledger_payloads)
+
+def earn_ledger_snapshot():
+    def enc(arr):
+        return base64.b64encode(arr.tobytes()).decode("ascii")
+    return {
+        "version": 2,
+        "byteorder": sys.byteorder,
+        "payloads": ledger_payloads,
+        "users": {str(uid): [enc(getattr(st.earn, name)) for name in EarnLedger.__slots__]
+                  for uid, st in users.items() if st.earn},
+    }
+
+def load_earn_ledger():
+    data = load_json(EARN_LEDGER_FILE, {})
+    if not data:
+        return
+    offset = len(ledger_payloads)  # payloads interned by a legacy migration come first
+    for text in data.get("payloads", []):
+        ledger_payloads.append(text)
+        _payload_offsets.setdefault(text, len(ledger_payloads) - 1)
+    swap = data.get("byteorder", sys.byteorder) != sys.byteorder
+    for uid, cols in data.get("users", {}).items():
+        try:
+            st = get_user_state(uid, create=True)
+        except ValueError:
+            print(f"â ï¸ Skipping non-numeric user id {uid!r} in {EARN_LEDGER_FILE}")
+            continue
+        ledger = EarnLedger()
+        for arr, blob in zip((getattr(ledger, name) for name in EarnLedger.__slots__), cols):
+            arr.frombytes(base64.b64decode(blob))
+            if swap:
+                arr.byteswap()
+        if offset:
+            ledger.payloads = array("i", (p + offset if p >= 0 else p for p in ledger.payloads))
+        if st.earn:  # rows migrated from user_history this run are older than the ledger file
+            migrated, st.earn = st.earn, ledger
+            for i in range(len(migrated)):
+                ledger.append(migrated.ts[i], migrated.amounts[i], migrated.codes[i], migrated.payloads[i])
+            order = sorted(range(len(ledger.ts)), key=ledger.ts.__getitem__)
+            for name in EarnLedger.ROW_COLUMNS:
+                col = getattr(ledger, name)
+                setattr(ledger, name, array(col.typecode, (col[i] for i in order)))
+        else:
+            st.earn = ledger
+
+# ------------------ COIN LEDGER ------------------
+# Every wallet change is one append-only double-entry row in COIN_LEDGER_FILE
+# (JSON lines): [seq, ts, kind, debit_account, credit_account, amount, memo].
+# User accounts are "u:<id>", the other side is a system account per kind, so
+# all account balances always sum to zero. The wallet balance, lifetime earned
+# and lifetime withdrawn are materialized on UserState as entries are posted
+# and saved with save_all(); verify_coin_ledger() replays the file to check them.
+LEDGER_EARN, LEDGER_SPEND, LEDGER_WITHDRAW, LEDGER_ADJUST = "earn", "spend", "withdraw", "adjust"
+LEDGER_SYSTEM_ACCOUNTS = {
+    LEDGER_EARN: "sys:rewards",
+    LEDGER_SPEND: "sys:premium",
+    LEDGER_WITHDRAW: "sys:payouts",
+    LEDGER_ADJUST: "sys:adjustments",
+}
+coin_ledger_state = {"next_seq": 1}
+system_balances = {}  # system account -> balance (mirror image of all user balances)
+
+def user_account(user_id) -> str:
+    return f"u:{int(user_id)}"
+
+def _apply_ledger_entry(entry, balances: dict, earned: dict, withdrawn: dict):
+    """Apply one entry to plain per-account dicts (used by replay)."""
+    _, _, kind, debit, credit, amount, _ = entry
+    balances[debit] = balances.get(debit, 0) - amount
+    balances[credit] = balances.get(credit, 0) + amount
+    for acct, delta in ((debit, -amount), (credit, amount)):
+        if acct.startswith("u:"):
+            if kind == LEDGER_EARN:
+                earned[acct] = earned.get(acct, 0) + delta
+            elif kind == LEDGER_WITHDRAW:
+                withdrawn[acct] = withdrawn.get(acct, 0) - delta
+
+def post_ledger_entry(kind: str, user_id, amount: int, memo: str = ""):
+    """Move coins between a user and the system account for kind.
+
+    amount > 0 credits the user, amount < 0 debits them. Appends the entry to
+    COIN_LEDGER_FILE and updates the materialized counters; returns the entry.
+    The ledger is the source of truth: if the append fails, OSError is raised
+    and nothing in memory changes.
+    """
+    amount = int(amount)
+    if not amount:
+        return None
+    st = get_user_state(user_id, create=True)
+    sys_acct, user_acct = LEDGER_SYSTEM_ACCOUNTS[kind], user_account(user_id)
+    debit, credit = (sys_acct, user_acct) if amount > 0 else (user_acct, sys_acct)
+    entry = [coin_ledger_state["next_seq"], int(time.time()), kind, debit, credit, abs(amount), memo]
+    try:
+        with open(COIN_LEDGER_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"â ï¸ Failed to append to {COIN_LEDGER_FILE}: {e}")
+        raise
+    coin_ledger_state["next_seq"] += 1
+    st.wallet = (st.wallet or 0) + amount
+    if kind == LEDGER_EARN:
+        st.lifetime_earned += amount
+    elif kind == LEDGER_WITHDRAW:
+        st.lifetime_withdrawn -= amount
+    system_balances[sys_acct] = system_balances.get(sys_acct, 0) - amount
+    return entry
+
+def replay_coin_ledger(path: str = COIN_LEDGER_FILE, size: int = None):
+    """Rebuild (balances, earned, withdrawn, entries) by account from the ledger file (its first size bytes if given)."""
+    balances, earned, withdrawn, entries = {}, {}, {}, 0
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            for line in f:
+                if size is not None and f.tell() > size:
+                    break
+                if line.strip():
+                    _apply_ledger_entry(json.loads(line), balances, earned, withdrawn)
+                    entries += 1
+    return balances, earned, withdrawn, entries
+
+def coin_ledger_checkpoint():
+    """(ledger size, {user account: (wallet, earned, withdrawn)}, system balances), copied together.
+
+    Entries are appended synchronously with the counter updates, so taken on
+    the loop the copy matches exactly the first `size` bytes of the ledger.
+    """
+    try:
+        size = os.path.getsize(COIN_LEDGER_FILE)
+    except OSError:
+        size = 0
+    counters = {user_account(uid): (st.wallet or 0, st.lifetime_earned, st.lifetime_withdrawn)
+                for uid, st in users.items() if st.wallet or st.lifetime_earned or st.lifetime_withdrawn}
+    return size, counters, dict(system_balances)
+
+def verify_coin_ledger(checkpoint=None):
+    """Replay the ledger and compare it with the materialized counters; returns a report dict.
+
+    Pass a coin_ledger_checkpoint() taken on the loop to run this off it.
+    """
+    size, counters, system = checkpoint or coin_ledger_checkpoint()
+    balances, earned, withdrawn, entries = replay_coin_ledger(size=size)
+    mismatches = []
+    for acct in sorted(set(balances) | set(counters)):
+        if acct.startswith("u:"):
+            have = counters.get(acct, (0, 0, 0))
+            want = (balances.get(acct, 0), earned.get(acct, 0), withdrawn.get(acct, 0))
+        else:
+            have, want = system.get(acct, 0), balances.get(acct, 0)
+        if have != want:
+            mismatches.append((acct, have, want))
+    return {
+        "entries": entries,
+        "accounts": len(balances),
+        "trial_balance": sum(balances.values()),
+        "mismatches": mismatches,
+    }
+
+def coin_totals_snapshot():
+    return {
+        "next_seq": coin_ledger_state["next_seq"],
+        "system": system_balances,
+        "users": {str(uid): [st.lifetime_earned, st.lifetime_withdrawn]
+                  for uid, st in users.items() if st.lifetime_earned or st.lifetime_withdrawn},
+    }
+
+def rebuild_from_coin_ledger():
+    """Reset wallets and counters to what the ledger file says."""
+    balances, earned, withdrawn, entries = replay_coin_ledger()
+    for st in users.values():
+        st.lifetime_earned = st.lifetime_withdrawn = 0
+        st.wallet = None
+    system_balances.clear()
+    for acct, bal in balances.items():
+        if acct.startswith("u:"):
+            st = get_user_state(acct[2:], create=True)
+            st.wallet = bal
+            st.lifetime_earned = earned.get(acct, 0)
+            st.lifetime_withdrawn = withdrawn.get(acct, 0)
+        else:
+            system_balances[acct] = bal
+    coin_ledger_state["next_seq"] = entries + 1
+
+def load_coin_ledger():
+    if not os.path.exists(COIN_LEDGER_FILE):
+        # First run on the ledger: open every existing wallet with its earn history
+        # and an adjustment for whatever the wallet holds beyond that.
+        opened = 0
+        for uid, st in list(users.items()):
+            if st.wallet is None:
+                continue
+            balance, st.wallet = st.wallet, 0
+            post_ledger_entry(LEDGER_EARN, uid, st.earn.total_since(0) if st.earn else 0, "opening: earned before ledger")
+            post_ledger_entry(LEDGER_ADJUST, uid, balance - st.wallet, "opening balance")
+            opened += 1
+        if opened:
+            print(f"â Coin ledger opened for {opened} wallets.")
+            save_json(WALLET_TOTALS_FILE, coin_totals_snapshot())
+        return
+    totals = load_json(WALLET_TOTALS_FILE, {})
+    with open(COIN_LEDGER_FILE, "r", encoding="utf-8") as f:
+        entries = sum(1 for line in f if line.strip())
+    if totals.get("next_seq") != entries + 1:
+        # Crashed between a ledger append and save_all(): the ledger wins
+        print(f"â ï¸ {WALLET_TOTALS_FILE} is behind {COIN_LEDGER_FILE}; rebuilding wallets from the ledger.")
+        rebuild_from_coin_ledger()
+        return
+    coin_ledger_state["next_seq"] = totals["next_seq"]
+    system_balances.update(totals.get("system", {}))
+    for uid, (earned, withdrawn) in totals.get("users", {}).items():
+        st = get_user_state(uid, create=True)
+        st.lifetime_earned, st.lifetime_withdrawn = earned, withdrawn
+
+def init_reward_markers():
+    """Fill jackpot/leaderboard markers missing from USER_STREAK_FILE from the earn ledger (one-off upgrade)."""
+    today = ist_day_number(time.time())
+    for st in users.values():
+        if st.earn and st.earn.ts and ist_day_number(st.earn.ts[-1]) == today:
+            if not st.jackpot_day:
+                st.jackpot_day = st.earn.last_day(EARN_JACKPOT)
+            if not st.leaderboard_day:
+                st.leaderboard_day = st.earn.last_day(EARN_LEADERBOARD)
+
+# ------------------ ACCESS EXPIRY INDEX ------------------
+# Every user with an access expiry is also in access_index, a sorted list of
+# (expiry, int user id) maintained by the user_access view. Reminders, purging
+# and "active users" are bisect ranges over it instead of scans of user_access.
+access_index = []  # sorted [(expiry timestamp, int user id)]
+
+def index_access(uid: int, expiry: float):
+    if expiry:
+        bisect.insort(access_index, (expiry, uid))
+
+def unindex_access(uid: int, expiry: float):
+    if not expiry:
+        return
+    i = bisect.bisect_left(access_index, (expiry, uid))
+    if i < len(access_index) and access_index[i] == (expiry, uid):
+        del access_index[i]
+
+def rebuild_access_index():
+    access_index[:] = sorted((st.access_until, uid) for uid, st in users.items() if st.access_until)
+
+def _access_pos(ts: float) -> int:
+    """Index of the first entry expiring after ts."""
+    return bisect.bisect_right(access_index, (ts, float("inf")))
+
+def active_access_users(now: float = None):
+    """str ids of users whose access has not expired yet."""
+    return [str(uid) for _, uid in access_index[_access_pos(time.time() if now is None else now):]]
+
+def due_expiry_reminders(now: float = None):
+    """[(int user id, expiry)] expiring within EXPIRY_REMINDER_HOURS that were not reminded yet."""
+    now = time.time() if now is None else now
+    due = []
+    for expiry, uid in access_index[_access_pos(now):_access_pos(now + EXPIRY_REMINDER_HOURS * 3600)]:
+        st = users.get(uid)
+        if st is not None and st.reminded_for != expiry:
+            st.reminded_for = expiry
+            due.append((uid, expiry))
+    return due
+
+def purge_expired_access(now: float = None) -> int:
+    """Move entries expired more than ACCESS_ARCHIVE_AFTER_DAYS ago to ACCESS_ARCHIVE_FILE."""
+    now = time.time() if now is None else now
+    n = _access_pos(now - ACCESS_ARCHIVE_AFTER_DAYS * 86400)
+    if not n:
+        return 0
+    stale = access_index[:n]
+    del access_index[:n]
+    try:
+        with open(ACCESS_ARCHIVE_FILE, "a", encoding="utf-8") as f:
+            for expiry, uid in stale:
+                f.write(json.dumps([uid, expiry, int(now)]) + "\n")
+    except Exception as e:
+        print(f"â ï¸ Failed to append to {ACCESS_ARCHIVE_FILE}: {e}")
+    for expiry, uid in stale:
+        st = users.get(uid)
+        if st is not None and st.access_until == expiry:
+            st.access_until = 0.0
+            st.reminded_for = 0.0
+    save_json(USER_ACCESS_FILE, user_access)
+    return n
+
+# persistent data
+load_users()
+rebuild_access_index()
+load_earn_ledger()
+load_coin_ledger()
+init_reward_markers()
+movies_db = {}       # normalized title -> title id (see MOVIE RECORDS)
+movie_titles = {}    # title id -> normalized title
+movie_variants = {}  # title id -> [[message_id, quality, size, language, season, episode], ...]
+facet_index = {}     # facet key ("s:2", "l:hindi", "y:2020", ...) -> set of message_ids
+post_title = {}      # message_id -> title id
+title_popularity = {}  # title id -> number of deliveries (ranks inline suggestions)
 referrals = load_json(REFERRALS_FILE, {})  # token -> {"owner": user_id_str, "used_by": [user_id_strs]}
-user_wallet = load_json(USER_WALLET_FILE, {})
-user_streak = load_json(USER_STREAK_FILE, {})
-user_history = load_json(USER_HISTORY_FILE, {})
 withdraw_requests = load_json(WITHDRAW_REQUESTS_FILE, {})
 user_withdraw_records = load_json(USER_WITHDRAW_RECORDS_FILE, {})
-redeem_codes = load_json(REDEEM_CODES_FILE, {})
+redeem_codes = {}  # sha256(code) -> entry (see REDEEM CODES); filled by load_redeem_codes()
 
 # runtime / ephemeral
-last_request_time = {}   # user_id (str) -> timestamp
 # Tokenized search sessions to avoid race conditions. Long expiry (24h) so buttons remain usable.
-search_sessions = {}     # token -> {"user_id": str, "suggestions": [titles], "ts": float}
+# Bounded LRU of SearchSession (most recent last), backed by SESSIONS_DB_FILE so
+# buttons keep working after a restart or an LRU eviction.
+search_sessions = OrderedDict()  # token -> SearchSession
 SUGGESTION_EXPIRY = 24 * 3600  # 24 hours - sessions persist for a day
+SESSION_CACHE_SIZE = 5000      # sessions kept in memory
+SESSION_PRUNE_INTERVAL = 600   # seconds between expired-session sweeps
+SUGGESTIONS_PER_PAGE = 8
 
-# Track messages that were delivered while user had access
-# Mapping: user_id(str) -> set of message_id(int)
-active_user_messages = {}
+_save_batch = {"depth": 0, "pending": False}
+
+@contextlib.contextmanager
+def batched_saves():
+    """Fold every save_all() inside the block (and anything awaited in it) into one at the end."""
+    _save_batch["depth"] += 1
+    try:
+        yield
+    finally:
+        _save_batch["depth"] -= 1
+        if not _save_batch["depth"] and _save_batch["pending"]:
+            _save_batch["pending"] = False
+            save_all()
 
 def save_all():
-    save_json(MOVIES_DB_FILE, movies_db)
+    if _save_batch["depth"]:
+        _save_batch["pending"] = True
+        return
+    inc("persistence_flushes")
+    save_json(MOVIES_DB_FILE, movie_records_snapshot())
     save_json(VERIFIED_USERS_FILE, list(verified_users))
     save_json(USER_ACCESS_FILE, user_access)
     save_json(REFERRALS_FILE, referrals)
     save_json(USER_WALLET_FILE, user_wallet)
+    save_json(WALLET_TOTALS_FILE, coin_totals_snapshot())
     save_json(USER_STREAK_FILE, user_streak)
     save_json(USER_HISTORY_FILE, user_history)
+    save_json(EARN_LEDGER_FILE, earn_ledger_snapshot())
     save_json(WITHDRAW_REQUESTS_FILE, withdraw_requests)
+    save_json(ALIASES_FILE, aliases_snapshot())
 
 def normalize_title(s: str) -> str:
     return (s or "").strip().lower()
@@ -219,35 +1404,921 @@ def normalize_title(s: str) -> str:
 def make_search_token():
     return uuid.uuid4().hex[:18]
 
+# ------------------ SEARCH SESSIONS ------------------
+class SearchSession:
+    """One suggestion list: title ids (not title strings) in an unsigned int array."""
+    __slots__ = ("user_id", "ts", "query", "facets", "ids", "voted")
+
+    def __init__(self, user_id: int, ts: float, query: str, facets: tuple, ids: array, voted: bool = False):
+        self.user_id = user_id
+        self.ts = ts
+        self.query = query
+        self.facets = facets
+        self.ids = ids
+        self.voted = voted
+
+_sessions_db = None
+_last_session_prune = 0.0
+
+def sessions_db():
+    global _sessions_db
+    if _sessions_db is None:
+        _sessions_db = sqlite3.connect(SESSIONS_DB_FILE)
+        _sessions_db.execute("PRAGMA journal_mode=WAL")
+        _sessions_db.execute("PRAGMA synchronous=NORMAL")
+        _sessions_db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "token TEXT PRIMARY KEY, user_id INTEGER, ts REAL, query TEXT, facets TEXT, ids BLOB, voted INTEGER DEFAULT 0)"
+        )
+        _sessions_db.execute("CREATE INDEX IF NOT EXISTS sessions_ts ON sessions (ts)")
+    return _sessions_db
+
+# ------------------ RATE LIMITING ------------------
+# Every user update passes rate_limit_gate() (handler group -1) first. It maps
+# the update to an action (RATE_LIMITS), sheds it when the application's
+# update queue is backed up, and otherwise spends a token from the user's
+# bucket for that action. A throttled user is told once per episode; further
+# updates are dropped silently so a flooding client costs no API calls.
+# Buckets live in one OrderedDict per action, ordered by last use; an entry
+# that has had time to refill completely carries no information and is
+# dropped as new ones come in, so the store only holds recently active users.
+CALLBACK_ACTIONS = {
+    "page": "page", "facet": "page",
+    "confirm": "confirm", "variant": "confirm", "get": "confirm",
+    "refer": "refer", "dashboard": "dashboard", "leaderboard": "leaderboard", "verify": "verify",
+}
+COMMAND_ACTIONS = {
+    "refer": "refer", "dashboard": "dashboard", "dash": "dashboard", "leaderboard": "leaderboard",
+    "history": "history", "start": "start", "redeem": "redeem",
+}
+
+class RateLimiter:
+    def __init__(self, limits: dict):
+        self.limits = {}   # action -> (burst, tokens per second)
+        self.buckets = {}  # action -> OrderedDict user id -> (tokens, last update, warned)
+        self.cooldowns = OrderedDict()  # user id -> start of the running search cooldown
+        self.cooldown_span = 0.0
+        self.throttled = {}  # action -> count
+        self.shed = {}       # action -> count
+        for action, (burst, per_minute) in limits.items():
+            self.limits[action] = (float(burst), per_minute / 60.0)
+            self.buckets[action] = OrderedDict()
+            self.throttled[action] = self.shed[action] = 0
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets.values()) + len(self.cooldowns)
+
+    def take(self, action: str, user_id: int, now: float = None):
+        """Spend one token. Returns (seconds until the next token, warn); (0, False) means go ahead.
+
+        warn is True only for the first refusal since the user was last allowed through.
+        """
+        limit = self.limits.get(action)
+        if limit is None:
+            return 0.0, False
+        burst, rate = limit
+        now = time.time() if now is None else now
+        store = self.buckets[action]
+        entry = store.pop(user_id, None)
+        tokens, warned = (burst, False) if entry is None else (min(burst, entry[0] + (now - entry[1]) * rate), entry[2])
+        if tokens >= 1:
+            store[user_id] = (tokens - 1, now, False)
+            wait = 0.0
+        else:
+            store[user_id] = (tokens, now, True)
+            wait = (1 - tokens) / rate
+            self.throttled[action] += 1
+        self._expire(store, now - burst / rate)
+        return wait, bool(wait) and not warned
+
+    def take_cooldown(self, user_id: int, seconds: float, now: float = None) -> float:
+        now = time.time() if now is None else now
+        started = self.cooldowns.get(user_id)
+        if started is not None and now - started < seconds:
+            return seconds - (now - started)
+        self.cooldowns.pop(user_id, None)
+        self.cooldowns[user_id] = now
+        self.cooldown_span = max(self.cooldown_span, seconds)
+        self._expire(self.cooldowns, now - self.cooldown_span)
+        return 0.0
+
+    @staticmethod
+    def _expire(store: OrderedDict, before: float):
+        """Drop up to two entries last touched before `before` (or over the size cap) from the old end."""
+        for _ in range(2):
+            if not store:
+                return
+            last = next(iter(store.values()))
+            if (last[1] if isinstance(last, tuple) else last) > before and len(store) <= RATE_LIMIT_MAX_KEYS:
+                return
+            store.popitem(last=False)
+
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+def update_action(update: Update, context) -> str:
+    """RATE_LIMITS action for a user update, or None if it is not limited."""
+    if update.inline_query is not None:
+        return "inline"
+    if update.callback_query is not None:
+        return CALLBACK_ACTIONS.get((update.callback_query.data or "").split(":", 1)[0])
+    msg = update.message
+    if msg is None or not msg.text:
+        return None
+    if msg.text.startswith("/"):
+        command = msg.text[1:].split("@", 1)[0].split(None, 1)
+        return COMMAND_ACTIONS.get(command[0].lower()) if command else None
+    if context.user_data and context.user_data.get("withdraw"):
+        return None  # amount / UPI replies in the withdraw flow
+    return "search"
+
+async def rate_limit_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if user is None or user.id == ADMIN_USER_ID:
+        return
+    action = update_action(update, context)
+    if action is None:
+        return
+    app = getattr(context, "application", None)
+    depth = app.update_queue.qsize() if app is not None else 0
+    if depth >= OVERLOAD_HARD_DEPTH or (depth >= OVERLOAD_QUEUE_DEPTH and action in RATE_LIMIT_SHED):
+        rate_limiter.shed[action] += 1
+        inc("shed")
+        raise ApplicationHandlerStop
+    wait, warn = rate_limiter.take(action, user.id)
+    if not wait:
+        return
+    inc("throttled")
+    if warn:
+        text = f"â³ Too many requests. Please wait {int(wait) + 1}s."
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(text)
+            elif update.message is not None:
+                await update.message.reply_text(text)
+        except TelegramError:
+            pass
+    raise ApplicationHandlerStop
+
+# ------------------ STATE BACKEND ------------------
+# Hot, short-lived state behind one interface so several bot processes can
+# share it. LocalStateBackend is the single-process behavior: cooldowns in
+# the rate limiter, sessions in SESSIONS_DB_FILE, the leaderboard computed from the
+# earn ledgers. RespStateBackend talks to a Redis-protocol server with atomic
+# commands only: SET NX PX for cooldowns, hashes with EXPIRE for sessions,
+# ZINCRBY/ZREVRANGE for the leaderboard, INCRBY for coins issued per day and
+# SET EX for the membership cache. Those leaderboard writes are fire-and-forget,
+# so it is for display only; the daily reward is paid from the earn ledgers.
+class LocalStateBackend:
+    name = "local"
+    blocking = False  # in-process: call directly on the loop
+
+    def __init__(self):
+        self._members = OrderedDict()  # user id -> (status, expires)
+
+    def take_cooldown(self, user_id: str, seconds: float) -> float:
+        """Start the user's search cooldown; seconds still to wait (0 = go ahead) if one is running."""
+        return rate_limiter.take_cooldown(int(user_id), seconds)
+
+    def save_session(self, token: str, session: SearchSession):
+        db = sessions_db()
+        db.execute(
+            "INSERT OR REPLACE INTO sessions (token, user_id, ts, query, facets, ids) VALUES (?, ?, ?, ?, ?, ?)",
+            (token, session.user_id, session.ts, session.query, ",".join(session.facets), session.ids.tobytes()),
+        )
+        db.commit()
+
+    def load_session(self, token: str):
+        row = sessions_db().execute(
+            "SELECT user_id, ts, query, facets, ids, voted FROM sessions WHERE token = ?", (token,)
+        ).fetchone()
+        if row is None:
+            return None
+        ids = array("I")
+        ids.frombytes(row[4])
+        return SearchSession(row[0], row[1], row[2], tuple(k for k in row[3].split(",") if k), ids, bool(row[5]))
+
+    def mark_session_voted(self, token: str):
+        db = sessions_db()
+        db.execute("UPDATE sessions SET voted = 1 WHERE token = ?", (token,))
+        db.commit()
+
+    def prune_sessions(self, before_ts: float):
+        db = sessions_db()
+        db.execute("DELETE FROM sessions WHERE ts < ?", (before_ts,))
+        db.commit()
+
+    def record_earn(self, user_id: str, amount: int, reason: int):
+        pass  # the earn ledgers already hold everything the local reads need
+
+    def daily_leaderboard(self, n: int = 10) -> list:
+        return ledger_leaderboard(n)
+
+    def coins_issued_today(self) -> int:
+        day_start = ist_day_start()
+        return sum(st.earn.total_since(day_start) for st in users.values()
+                   if st.earn and st.earn.ts and st.earn.ts[-1] >= day_start)
+
+    def cached_membership(self, user_id: str):
+        entry = self._members.get(user_id)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry[0]
+
+    def cache_membership(self, user_id: str, status: str):
+        self._members[user_id] = (status, time.time() + MEMBERSHIP_CACHE_TTL)
+        self._members.move_to_end(user_id)
+        while len(self._members) > MEMBERSHIP_CACHE_SIZE:
+            self._members.popitem(last=False)
+
+class RespError(Exception):
+    """Error reply from the server."""
+
+class RespClient:
+    """Minimal blocking Redis protocol (RESP2) client over one connection.
+
+    A connection failure opens a circuit breaker: for REDIS_BREAKER_SECONDS
+    every command fails at once with ConnectionError instead of waiting on
+    the network again.
+    """
+
+    def __init__(self, host: str, port: int, password: str = "", db: int = 0, timeout: float = REDIS_TIMEOUT):
+        self.host, self.port, self.password, self.db, self.timeout = host, port, password, db, timeout
+        self.sock = None
+        self.rfile = None
+        self.down_until = 0.0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        if self.password:
+            self._roundtrip(("AUTH", self.password))
+        if self.db:
+            self._roundtrip(("SELECT", self.db))
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = self.rfile = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif not isinstance(arg, bytes):
+                arg = str(arg).encode("ascii")
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RespError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            return None if n < 0 else self.rfile.read(n + 2)[:-2]
+        if kind == b"*":
+            n = int(rest)
+            return None if n < 0 else [self._read() for _ in range(n)]
+        raise RespError(f"unexpected reply type {kind!r}")
+
+    def _roundtrip(self, args):
+        self.sock.sendall(self._encode(args))
+        return self._read()
+
+    def execute(self, *args):
+        with self._lock:
+            if time.time() < self.down_until:
+                raise ConnectionError(f"{self.host}:{self.port} unavailable (circuit open)")
+            try:
+                return self._execute(args)
+            except OSError:
+                self.down_until = time.time() + REDIS_BREAKER_SECONDS
+                raise
+
+    def _execute(self, args):
+        if self.sock is None:
+            self._connect()
+        try:
+            self.sock.sendall(self._encode(args))
+        except OSError:
+            # stale connection (server restart): reconnect once; nothing was sent
+            self.close()
+            self._connect()
+            self.sock.sendall(self._encode(args))
+        try:
+            return self._read()
+        except (OSError, ValueError):
+            self.close()
+            raise
+
+class RespStateBackend:
+    """Same interface as LocalStateBackend, stored in a Redis-protocol server.
+
+    Reads go through backend_call() (the executor). Writes nobody waits for
+    are queued on one background thread, so they stay in order and never
+    hold up the caller.
+    """
+    name = "resp"
+    blocking = True
+
+    def __init__(self, client: RespClient, prefix: str):
+        self.client = client
+        self.prefix = prefix
+        self._writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resp-writes")
+
+    def _background(self, fn, *args):
+        def run():
+            try:
+                fn(*args)
+            except (OSError, RespError) as e:
+                print(f"â ï¸ State backend write failed ({fn.__name__}):", e)
+        self._writes.submit(run)
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ":".join(str(p) for p in parts)
+
+    def take_cooldown(self, user_id: str, seconds: float) -> float:
+        if seconds <= 0:
+            return 0.0
+        key = self._key("cooldown", user_id)
+        try:
+            if self.client.execute("SET", key, "1", "NX", "PX", int(seconds * 1000)) is not None:
+                return 0.0
+            return max(self.client.execute("PTTL", key), 0) / 1000.0
+        except (OSError, RespError) as e:
+            # fail open: a missing cooldown is better than refusing every search
+            print("â ï¸ Cooldown backend error:", e)
+            return 0.0
+
+    def save_session(self, token: str, session: SearchSession):
+        self._background(self._save_session, token, session)
+
+    def _save_session(self, token: str, session: SearchSession):
+        key = self._key("session", token)
+        self.client.execute(
+            "HSET", key, "user_id", session.user_id, "ts", repr(session.ts), "query", session.query,
+            "facets", ",".join(session.facets), "ids", session.ids.tobytes(), "voted", int(session.voted),
+        )
+        self.client.execute("EXPIRE", key, SUGGESTION_EXPIRY)
+
+    def load_session(self, token: str):
+        flat = self.client.execute("HGETALL", self._key("session", token))
+        if not flat:
+            return None
+        fields = dict(zip(flat[::2], flat[1::2]))
+        ids = array("I")
+        ids.frombytes(fields[b"ids"])
+        facets = fields[b"facets"].decode("utf-8")
+        return SearchSession(int(fields[b"user_id"]), float(fields[b"ts"]), fields[b"query"].decode("utf-8"),
+                             tuple(k for k in facets.split(",") if k), ids, fields.get(b"voted") == b"1")
+
+    def mark_session_voted(self, token: str):
+        self._background(self._mark_session_voted, token)
+
+    def _mark_session_voted(self, token: str):
+        key = self._key("session", token)
+        if self.client.execute("EXISTS", key):
+            self.client.execute("HSET", key, "voted", 1)
+
+    def prune_sessions(self, before_ts: float):
+        pass  # session keys expire on their own
+
+    def record_earn(self, user_id: str, amount: int, reason: int):
+        self._background(self._record_earn, user_id, amount, reason, ist_day_number(time.time()))
+
+    def _record_earn(self, user_id: str, amount: int, reason: int, day: int):
+        issued = self._key("issued", day)
+        self.client.execute("INCRBY", issued, int(amount))
+        self.client.execute("EXPIRE", issued, 2 * 86400)
+        if reason == EARN_SEARCH:
+            board = self._key("leaderboard", day)
+            self.client.execute("ZINCRBY", board, int(amount), user_id)
+            self.client.execute("EXPIRE", board, 2 * 86400)
+
+    def daily_leaderboard(self, n: int = 10) -> list:
+        try:
+            flat = self.client.execute("ZREVRANGE", self._key("leaderboard", ist_day_number(time.time())),
+                                       0, n - 1, "WITHSCORES")
+        except (OSError, RespError) as e:
+            print("â ï¸ Leaderboard backend error, using the ledgers:", e)
+            return ledger_leaderboard(n)
+        return [(uid.decode("ascii"), int(float(score))) for uid, score in zip(flat[::2], flat[1::2])]
+
+    def coins_issued_today(self) -> int:
+        try:
+            return int(self.client.execute("GET", self._key("issued", ist_day_number(time.time()))) or 0)
+        except (OSError, RespError) as e:
+            print("â ï¸ Coins issued backend error, using the ledgers:", e)
+            return LocalStateBackend.coins_issued_today(self)
+
+    def daily_totals(self, n: int = 10):
+        """(coins issued, coins from searches, searchers, top n) for today across all processes; None on error."""
+        day = ist_day_number(time.time())
+        try:
+            issued = self.client.execute("GET", self._key("issued", day))
+            flat = self.client.execute("ZREVRANGE", self._key("leaderboard", day), 0, -1, "WITHSCORES")
+        except (OSError, RespError) as e:
+            print("â ï¸ Daily totals backend error, using the ledgers:", e)
+            return None
+        board = [(uid.decode("ascii"), int(float(score))) for uid, score in zip(flat[::2], flat[1::2])]
+        return int(issued or 0), sum(score for _, score in board), len(board), board[:n]
+
+    def cached_membership(self, user_id: str):
+        try:
+            status = self.client.execute("GET", self._key("member", user_id))
+        except (OSError, RespError):
+            return None
+        return status.decode("ascii") if status else None
+
+    def cache_membership(self, user_id: str, status: str):
+        self._background(self.client.execute, "SET", self._key("member", user_id), status, "EX", MEMBERSHIP_CACHE_TTL)
+
+def make_state_backend():
+    if STATE_BACKEND == "resp":
+        # connects lazily on the first command
+        return RespStateBackend(RespClient(REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_DB), REDIS_KEY_PREFIX)
+    return LocalStateBackend()
+
+state_backend = make_state_backend()
+
+async def backend_call(fn, *args):
+    """Call a state_backend method from a handler; network backends run in the executor so the loop never waits on them."""
+    if state_backend.blocking:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    return fn(*args)
+
+def _cache_session(token: str, session: SearchSession):
+    search_sessions[token] = session
+    search_sessions.move_to_end(token)
+    while len(search_sessions) > SESSION_CACHE_SIZE:
+        search_sessions.popitem(last=False)
+
+def create_search_session(user_id: str, query: str, facets, tids) -> str:
+    token = make_search_token()
+    session = SearchSession(int(user_id), time.time(), query, tuple(facets), array("I", tids))
+    _cache_session(token, session)
+    try:
+        state_backend.save_session(token, session)
+    except Exception as e:
+        print("â ï¸ Failed to persist search session:", e)
+    return token
+
+async def get_search_session(token: str):
+    """Session for token from the LRU, falling back to the state backend; None if unknown or expired."""
+    session = search_sessions.get(token)
+    if session is None:
+        try:
+            session = await backend_call(state_backend.load_session, token)
+        except Exception as e:
+            print("â ï¸ Failed to load search session:", e)
+            session = None
+        if session is None:
+            return None
+    if time.time() - session.ts > SUGGESTION_EXPIRY:
+        search_sessions.pop(token, None)
+        return None
+    _cache_session(token, session)
+    return session
+
+def mark_session_voted(token: str, session: SearchSession):
+    session.voted = True
+    try:
+        state_backend.mark_session_voted(token)
+    except Exception as e:
+        print("â ï¸ Failed to update search session:", e)
+
 def cleanup_search_sessions():
+    global _last_session_prune
     now = time.time()
-    tokens_to_remove = [t for t,info in search_sessions.items() if now - info.get("ts", 0) > SUGGESTION_EXPIRY]
+    if now - _last_session_prune < SESSION_PRUNE_INTERVAL:
+        return
+    _last_session_prune = now
+    tokens_to_remove = [t for t, s in search_sessions.items() if now - s.ts > SUGGESTION_EXPIRY]
     for t in tokens_to_remove:
         search_sessions.pop(t, None)
+    try:
+        state_backend.prune_sessions(now - SUGGESTION_EXPIRY)
+    except Exception as e:
+        print("â ï¸ Failed to prune search sessions:", e)
+
+def build_suggestion_page(token: str, session: SearchSession, page: int):
+    """Text and keyboard for one page of a session's suggestions."""
+    total = len(session.ids)
+    pages = max(1, (total + SUGGESTIONS_PER_PAGE - 1) // SUGGESTIONS_PER_PAGE)
+    page = max(0, min(page, pages - 1))
+    kb = []
+    # compress displayed text (shorten if too long)
+    for i in range(page * SUGGESTIONS_PER_PAGE, min(total, (page + 1) * SUGGESTIONS_PER_PAGE)):
+        suggested = movie_titles.get(session.ids[i], "(removed)")
+        text_display = suggested if len(suggested) < 60 else suggested[:57] + "..."
+        kb.append([InlineKeyboardButton(text_display, callback_data=f"confirm:{token}:{i}")])
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("< Prev", callback_data=f"page:{token}:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next >", callback_data=f"page:{token}:{page + 1}"))
+    if nav:
+        kb.append(nav)
+    kb.append([InlineKeyboardButton("ð Try Again", callback_data="try_again")])
+    text = "ð Similar movies found:\n\nSelect one from below or try again:"
+    if pages > 1:
+        text += f"\n\nPage {page + 1}/{pages} ({total} results)"
+    return text, InlineKeyboardMarkup(kb)
 
 def today_str():
     return datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=5, minutes=30))).strftime("%Y-%m-%d")
 
+def ist_day_start(ts: float = None) -> float:
+    """Unix timestamp of IST midnight for the day containing ts (default: now)."""
+    now = datetime.fromtimestamp(time.time() if ts is None else ts, timezone(timedelta(hours=5, minutes=30)))
+    return now.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
 def coins_to_rupees(coins):
     return coins / 100.0
 
 def rupees_to_coins(rupees):
     return int(rupees * 100)
 
+# ------------------ MOVIE RECORDS ------------------
+# One record per title, holding every uploaded version of it. On disk
+# (MOVIES_DB_FILE): {"version": 2, "next_id": int, "records": [[title_id, title, [variant, ...]], ...]}.
+# A variant is a compact list indexed by the V_* constants below. The old
+# format ({title: message_id}) is migrated on load.
+V_MSG, V_QUALITY, V_SIZE, V_LANG, V_SEASON, V_EPISODE = range(6)
+MAX_PICKER_BUTTONS = 24
+MAX_FILTER_BUTTONS = 8   # per facet kind in the picker
+_next_title_id = 1
+catalog_version = 0  # bumped on every catalog change so snapshots only recopy it when needed
+
+_QUALITY_RE = re.compile(r"\b(2160p|1080p|720p|480p|360p|4k)\b", re.IGNORECASE)
+_LANGUAGE_RE = re.compile(r"\b(hindi|english|tamil|telugu|malayalam|kannada|bengali|marathi|punjabi|dual|multi)\b", re.IGNORECASE)
+# Season/episode markers: "season 2", "episode 5", "ep 5", "S02E05", "S2 E5", "S2",
+# "E05". A bare s/e is a marker only when a number follows directly and no
+# apostrophe (straight or curly) precedes it, so possessives ("Ocean's 11") and
+# a lone "s 1" stay part of the title.
+_SEASON_EPISODE_RE = re.compile(r"(?<!['\u2019])\bs(\d{1,2})\s?e(\d{1,3})\b", re.IGNORECASE)
+_SEASON_RE = re.compile(r"(?<!['\u2019])\b(?:season\s?|s(?=\d))(\d{1,2})\b", re.IGNORECASE)
+_EPISODE_RE = re.compile(r"(?<!['\u2019])\b(?:episode\s?|ep\s?|e(?=\d))(\d{1,3})\b", re.IGNORECASE)
+_EXTENSION_RE = re.compile(r"\b(mkv|mp4|avi|webm|m4v)\b", re.IGNORECASE)
+_QUALITY_RANK = {"2160p": 4, "4k": 4, "1080p": 3, "720p": 2, "480p": 1, "360p": 0}
+
+def parse_media_facets(text: str) -> dict:
+    """Pull quality / language / season / episode out of a caption or title."""
+    t = re.sub(r"[._]", " ", text or "")
+    facets = {"quality": "", "language": "", "season": 0, "episode": 0}
+    m = _QUALITY_RE.search(t)
+    if m:
+        facets["quality"] = m.group(1).lower()
+    m = _LANGUAGE_RE.search(t)
+    if m:
+        facets["language"] = m.group(1).lower()
+    m = _SEASON_EPISODE_RE.search(t)
+    if m:
+        facets["season"], facets["episode"] = int(m.group(1)), int(m.group(2))
+    else:
+        m = _SEASON_RE.search(t)
+        if m:
+            facets["season"] = int(m.group(1))
+        m = _EPISODE_RE.search(t)
+        if m:
+            facets["episode"] = int(m.group(1))
+    return facets
+
+def title_group_key(title: str) -> str:
+    """Normalized title with quality/language/season/episode markers removed, so every version shares one key."""
+    return strip_facet_markers(title) or normalize_title(title)
+
+def strip_facet_markers(title: str) -> str:
+    t = normalize_title(title)
+    for rx in (_SEASON_EPISODE_RE, _SEASON_RE, _EPISODE_RE, _QUALITY_RE, _LANGUAGE_RE, _EXTENSION_RE):
+        t = rx.sub(" ", t)
+    if re.search(r"\((19|20)\d{2}\)", t):
+        # regex-cleaned titles often carry the year twice ("kgf 2022 (2022)")
+        t = re.sub(r"(?<!\()\b(19|20)\d{2}\b(?!\))", " ", t)
+    t = re.sub(r"\(\s*\)", " ", t)
+    t = re.sub(r"\s+", " ", t).strip(" -|:")
+    return t
+
+def make_variant(message_id: int, facets: dict, size: int = 0) -> list:
+    return [int(message_id), facets.get("quality", ""), int(size or 0), facets.get("language", ""),
+            int(facets.get("season", 0)), int(facets.get("episode", 0))]
+
+def add_movie_variant(title: str, variant: list) -> int:
+    """Attach a variant to the record for title (creating it if needed). Returns the title id."""
+    global _next_title_id, catalog_version
+    publish_catalog_change("add", title, variant)
+    catalog_version += 1
+    key = title_group_key(title)
+    tid = movies_db.get(key)
+    if tid is None:
+        tid = _next_title_id
+        _next_title_id += 1
+        movies_db[key] = tid
+        movie_titles[tid] = key
+        movie_variants[tid] = []
+        inline_index_title(tid)
+    variants = movie_variants[tid]
+    for i, v in enumerate(variants):
+        # same post re-indexed, or an identical re-upload: replace in place
+        if v[V_MSG] == variant[V_MSG] or (v[V_QUALITY:] == variant[V_QUALITY:] and v[V_SIZE]):
+            unindex_variant(v)
+            variants[i] = variant
+            index_variant(tid, variant)
+            return tid
+    variants.append(variant)
+    index_variant(tid, variant)
+    return tid
+
+def remove_movie_title(key: str) -> bool:
+    global _inline_dirty, catalog_version
+    tid = movies_db.pop(key, None)
+    if tid is None:
+        return False
+    publish_catalog_change("remove", key)
+    catalog_version += 1
+    movie_titles.pop(tid, None)
+    title_popularity.pop(tid, None)
+    for v in movie_variants.pop(tid, []):
+        unindex_variant(v)
+    # removals are rare; rebuild the autocomplete index lazily on the next inline query
+    _inline_dirty = True
+    return True
+
+# ------------------ FACET INDEX ------------------
+# facet_index maps each facet value to the set of posts (message_ids) carrying
+# it, so "mirzapur s02 hindi" or a filter button is a set intersection rather
+# than another fuzzy search. Keys are "<kind>:<value>" with kinds
+# y(ear), l(anguage), s(eason), e(pisode), q(uality).
+FACET_LABELS = {"s": "Season {}", "e": "Ep {}", "l": "{}", "q": "{}", "y": "{}"}
+_YEAR_RE = re.compile(r"\b((?:19|20)\d{2})\b")
+
+def title_year(title: str) -> int:
+    m = _YEAR_RE.search(title or "")
+    return int(m.group(1)) if m else 0
+
+def variant_facet_keys(tid: int, v) -> list:
+    keys = []
+    year = title_year(movie_titles.get(tid, ""))
+    if year:
+        keys.append(f"y:{year}")
+    if v[V_LANG]:
+        keys.append(f"l:{v[V_LANG]}")
+    if v[V_SEASON]:
+        keys.append(f"s:{v[V_SEASON]}")
+    if v[V_EPISODE]:
+        keys.append(f"e:{v[V_EPISODE]}")
+    if v[V_QUALITY]:
+        keys.append(f"q:{v[V_QUALITY]}")
+    return keys
+
+def index_variant(tid: int, v):
+    post_title[v[V_MSG]] = tid
+    for key in variant_facet_keys(tid, v):
+        facet_index.setdefault(key, set()).add(v[V_MSG])
+
+def unindex_variant(v):
+    tid = post_title.pop(v[V_MSG], None)
+    if tid is None:
+        return
+    for key in variant_facet_keys(tid, v):
+        posts = facet_index.get(key)
+        if posts is not None:
+            posts.discard(v[V_MSG])
+            if not posts:
+                facet_index.pop(key, None)
+
+def facet_postings(keys):
+    """Posts carrying every facet in keys (smallest posting set first)."""
+    sets = sorted((facet_index.get(k, set()) for k in keys), key=len)
+    if not sets:
+        return set()
+    result = set(sets[0])
+    for s in sets[1:]:
+        result &= s
+        if not result:
+            break
+    return result
+
+def title_posts(tid: int) -> set:
+    return {v[V_MSG] for v in movie_variants.get(tid, [])}
+
+def query_facet_keys(query: str):
+    """Split a search query into (title text, [facet keys]): "mirzapur s02 hindi" -> ("mirzapur", ["l:hindi", "s:2"])."""
+    facets = parse_media_facets(query)
+    keys = []
+    year = title_year(query)
+    if year:
+        keys.append(f"y:{year}")
+    if facets["language"]:
+        keys.append(f"l:{facets['language']}")
+    if facets["season"]:
+        keys.append(f"s:{facets['season']}")
+    if facets["episode"]:
+        keys.append(f"e:{facets['episode']}")
+    if facets["quality"]:
+        keys.append(f"q:{facets['quality']}")
+    text = strip_facet_markers(query) if keys else normalize_title(query)
+    if year:
+        text = re.sub(r"\(?\b%d\b\)?" % year, " ", text)
+        text = re.sub(r"\s+", " ", text).strip()
+    return text, keys
+
+def faceted_title_hits(text: str, keys, limit: int = 25) -> list:
+    """Title ids that have at least one post matching every facet in keys, best match first."""
+    posts = facet_postings(keys)
+    if not posts:
+        return []
+    if text:
+        tid = movies_db.get(text)
+        if tid is not None:
+            candidates = [tid]
+        else:
+            candidates = [movies_db[t] for t in find_advanced_matches(text, movies_db.keys(), limit=limit, score_cutoff=60)]
+    else:
+        candidates = sorted({post_title[p] for p in posts if p in post_title})
+    return [tid for tid in candidates if title_posts(tid) & posts][:limit]
+
+def format_facet_label(key: str) -> str:
+    kind, _, value = key.partition(":")
+    return FACET_LABELS.get(kind, "{}").format(value.capitalize() if kind == "l" else value)
+
+def movie_records_snapshot() -> dict:
+    records = [[tid, title, [list(v) for v in movie_variants.get(tid, [])], title_popularity.get(tid, 0)]
+               for tid, title in movie_titles.items()]
+    return {"version": 2, "next_id": _next_title_id, "records": records}
+
+def load_movie_records():
+    global _next_title_id
+    data = load_json(MOVIES_DB_FILE, {})
+    if isinstance(data, dict) and "records" in data:
+        for record in data["records"]:
+            tid, title, variants = record[:3]
+            movies_db[title] = tid
+            movie_titles[tid] = title
+            movie_variants[tid] = variants
+            if len(record) > 3 and record[3]:
+                title_popularity[tid] = record[3]
+            for v in variants:
+                index_variant(tid, v)
+        _next_title_id = max([data.get("next_id", 1)] + [tid + 1 for tid in movie_titles])
+        rebuild_inline_index()
+        return
+    # legacy: {normalized title: message_id}
+    for title, message_id in (data or {}).items():
+        add_movie_variant(title, make_variant(message_id, parse_media_facets(title)))
+    if data:
+        print(f"â Migrated {len(data)} legacy movie entries into {len(movies_db)} title records.")
+
+def variant_sort_key(v):
+    return (v[V_SEASON], v[V_EPISODE], -_QUALITY_RANK.get(v[V_QUALITY], -1), v[V_LANG])
+
+def format_size(size: int) -> str:
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.1f} GB"
+    if size >= 1024 ** 2:
+        return f"{size / 1024 ** 2:.0f} MB"
+    return ""
+
+def format_variant_label(v, idx: int) -> str:
+    parts = []
+    if v[V_SEASON] or v[V_EPISODE]:
+        parts.append(f"S{v[V_SEASON]:02d}E{v[V_EPISODE]:02d}" if v[V_EPISODE] else f"Season {v[V_SEASON]}")
+    if v[V_QUALITY]:
+        parts.append(v[V_QUALITY])
+    if v[V_LANG]:
+        parts.append(v[V_LANG].capitalize())
+    size = format_size(v[V_SIZE])
+    if size:
+        parts.append(size)
+    return " | ".join(parts) or f"File {idx + 1}"
+
+# ------------------ INLINE AUTOCOMPLETE INDEX ------------------
+# Serves inline-mode suggestions without touching rapidfuzz. Every title is
+# indexed under each of its word-start suffixes ("kgf chapter 2" is also
+# "chapter 2" and "2"):
+#  * _inline_nodes: prefix (up to INLINE_NODE_DEPTH chars) -> top INLINE_TOP_N
+#    title ids by popularity, so short prefixes are a single dict lookup;
+#  * _inline_keys: sorted (suffix, title id) array, bisected for longer prefixes.
+INLINE_TOP_N = 10
+INLINE_NODE_DEPTH = 8
+INLINE_SCAN_LIMIT = 500     # max sorted-array entries scanned for a long prefix
+INLINE_CACHE_TIME = 300     # seconds Telegram may cache an inline answer
+_inline_nodes = {}
+_inline_keys = []
+_inline_dirty = False
+
+def _title_suffixes(title: str) -> list:
+    words = title.split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+def _title_prefixes(title: str) -> set:
+    prefixes = set()
+    for suffix in _title_suffixes(title):
+        for n in range(min(len(suffix), INLINE_NODE_DEPTH) + 1):
+            prefixes.add(suffix[:n])
+    return prefixes
+
+def _popularity_key(tid: int):
+    return (-title_popularity.get(tid, 0), tid)
+
+def _offer_to_node(prefix: str, tid: int):
+    top = _inline_nodes.setdefault(prefix, [])
+    if tid not in top:
+        if len(top) >= INLINE_TOP_N and _popularity_key(tid) >= _popularity_key(top[-1]):
+            return
+        top.append(tid)
+    top.sort(key=_popularity_key)
+    del top[INLINE_TOP_N:]
+
+def inline_index_title(tid: int):
+    title = movie_titles[tid]
+    for suffix in _title_suffixes(title):
+        bisect.insort(_inline_keys, (suffix, tid))
+    for prefix in _title_prefixes(title):
+        _offer_to_node(prefix, tid)
+
+def rebuild_inline_index():
+    global _inline_dirty
+    keys = []
+    nodes = {}
+    for tid in sorted(movie_titles, key=_popularity_key):
+        title = movie_titles[tid]
+        keys.extend((suffix, tid) for suffix in _title_suffixes(title))
+        for prefix in _title_prefixes(title):
+            top = nodes.setdefault(prefix, [])
+            if len(top) < INLINE_TOP_N:
+                top.append(tid)
+    keys.sort()
+    _inline_keys[:] = keys
+    _inline_nodes.clear()
+    _inline_nodes.update(nodes)
+    _inline_dirty = False
+
+def bump_title_popularity(tid: int):
+    if tid not in movie_titles:
+        return
+    title_popularity[tid] = title_popularity.get(tid, 0) + 1
+    if not _inline_dirty:
+        for prefix in _title_prefixes(movie_titles[tid]):
+            _offer_to_node(prefix, tid)
+
+def inline_suggest(text: str) -> list:
+    """Top title ids for an as-you-type prefix, most delivered first."""
+    if _inline_dirty:
+        rebuild_inline_index()
+    q = re.sub(r"\s+", " ", normalize_title(text))
+    if len(q) <= INLINE_NODE_DEPTH:
+        return list(_inline_nodes.get(q, ()))
+    found = []
+    i = bisect.bisect_left(_inline_keys, (q,))
+    end = min(len(_inline_keys), i + INLINE_SCAN_LIMIT)
+    while i < end and _inline_keys[i][0].startswith(q):
+        tid = _inline_keys[i][1]
+        if tid not in found:
+            found.append(tid)
+        i += 1
+    found.sort(key=_popularity_key)
+    return found[:INLINE_TOP_N]
+
+load_movie_records()
+
 # ------------------ WALLET / HISTORY HELPERS ------------------
-def add_coins(user_id: str, amount: int, reason: str):
-    if user_id not in user_wallet:
-        user_wallet[user_id] = 0
-    user_wallet[user_id] += amount
-    if user_id not in user_history:
-        user_history[user_id] = {"premium": [], "withdraw": [], "earn": []}
-    user_history[user_id]["earn"].append({"timestamp": time.time(), "amount": amount, "reason": reason})
+def add_coins(user_id: str, amount: int, reason: int, payload=None) -> bool:
+    """Credit coins and log an earn row; reason is an EARN_* code, payload its variable text.
+
+    Returns False if the ledger append failed and nothing was credited.
+    """
+    try:
+        post_ledger_entry(LEDGER_EARN, user_id, amount, EARN_CATEGORY_NAMES.get(reason, ""))
+    except OSError:
+        return False  # not in the ledger, so not credited
+    get_earn_ledger(user_id, create=True).append(
+        time.time(), amount, reason, -1 if payload is None else intern_payload(str(payload)))
+    state_backend.record_earn(user_id, amount, reason)
     save_all()
+    return True
 
-def deduct_coins(user_id: str, amount: int) -> bool:
+def deduct_coins(user_id: str, amount: int, kind: str = LEDGER_SPEND, memo: str = "") -> bool:
     if user_id not in user_wallet or user_wallet[user_id] < amount:
         return False
-    user_wallet[user_id] -= amount
+    try:
+        post_ledger_entry(kind, user_id, -amount, memo)
+    except OSError:
+        return False
     save_all()
     return True
 
@@ -255,7 +2326,105 @@ def get_wallet_balance(user_id: str) -> int:
     return user_wallet.get(user_id, 0)
 
 def get_user_history(user_id: str):
-    return user_history.get(user_id, {"premium": [], "withdraw": [], "earn": []})
+    return user_history.get(user_id, {"premium": [], "withdraw": []})
+
+# ------------------ WITHDRAWAL QUEUE ------------------
+# withdraw_requests (rid -> request) stays the persisted store; withdraw_index
+# keeps every status bucket as a timestamp-ordered list of (timestamp, rid) so
+# /pending only walks pending requests. Decisions are applied in bulk with one
+# save_all(), and user notifications go through a rate-limited background sender.
+WITHDRAW_STATUSES = ("pending", "approved", "rejected")
+withdraw_index = {status: [] for status in WITHDRAW_STATUSES}  # status -> sorted [(timestamp, rid)]
+
+def rebuild_withdraw_index():
+    for bucket in withdraw_index.values():
+        bucket.clear()
+    for rid, req in withdraw_requests.items():
+        withdraw_index.setdefault(req.get("status", "pending"), []).append((req.get("timestamp", 0), rid))
+    for bucket in withdraw_index.values():
+        bucket.sort()
+
+def _index_withdraw(rid: str, req: dict):
+    bisect.insort(withdraw_index.setdefault(req["status"], []), (req.get("timestamp", 0), rid))
+
+def _unindex_withdraw(rid: str, req: dict):
+    bucket = withdraw_index.get(req.get("status"), [])
+    key = (req.get("timestamp", 0), rid)
+    i = bisect.bisect_left(bucket, key)
+    if i < len(bucket) and bucket[i] == key:
+        del bucket[i]
+
+def create_withdraw_request(rid: str, user_id: str, amount: float, coins: int, upi_id: str) -> dict:
+    req = {"user_id": user_id, "amount": amount, "coins": coins, "upi_id": upi_id,
+           "status": "pending", "timestamp": time.time()}
+    withdraw_requests[rid] = req
+    _index_withdraw(rid, req)
+    return req
+
+def pending_withdrawals(offset: int = 0, limit: int = PENDING_PAGE_SIZE):
+    """Oldest-first slice of pending requests as [(rid, request)]."""
+    return [(rid, withdraw_requests[rid]) for _, rid in withdraw_index["pending"][offset:offset + limit]]
+
+def decide_withdrawals(rids, status: str):
+    """Move pending requests to approved/rejected (rejections refund the coins).
+
+    Returns (decided [(rid, request)], skipped [rid]); the caller persists once.
+    """
+    decided, skipped = [], []
+    for rid in rids:
+        req = withdraw_requests.get(rid)
+        if not req or req.get("status") != "pending":
+            skipped.append(rid)
+            continue
+        if status == "rejected":
+            coins = req.get("coins") or rupees_to_coins(float(req["amount"]))
+            try:
+                post_ledger_entry(LEDGER_WITHDRAW, req["user_id"], coins, f"refund {rid}")
+            except OSError:
+                skipped.append(rid)  # stays pending until the refund can be written
+                continue
+        _unindex_withdraw(rid, req)
+        req["status"] = status
+        req["decided_at"] = time.time()
+        _index_withdraw(rid, req)
+        decided.append((rid, req))
+    return decided, skipped
+
+rebuild_withdraw_index()
+
+# Rate-limited notifications: (chat_id, text) sent at most NOTIFY_RATE_PER_SEC
+notify_queue = None  # asyncio.Queue; created by start_notification_sender()
+_notify_task = None
+notify_stats = {"sent": 0, "failed": 0}
+
+def start_notification_sender(bot):
+    global notify_queue, _notify_task
+    if _notify_task is not None and not _notify_task.done():
+        return
+    if notify_queue is None:
+        notify_queue = asyncio.Queue()
+    _notify_task = asyncio.create_task(notification_sender(bot))
+
+def enqueue_notification(bot, chat_id: int, text: str):
+    start_notification_sender(bot)
+    notify_queue.put_nowait((chat_id, text))
+
+async def notification_sender(bot):
+    interval = 1.0 / NOTIFY_RATE_PER_SEC
+    while True:
+        chat_id, text = await notify_queue.get()
+        while True:
+            try:
+                await bot.send_message(chat_id, text)
+                notify_stats["sent"] += 1
+            except RetryAfter as ra:
+                await asyncio.sleep(getattr(ra, "retry_after", 5))
+                continue
+            except Exception as e:
+                notify_stats["failed"] += 1
+                print(f"â ï¸ Notification to {chat_id} failed: {e}")
+            break
+        await asyncio.sleep(interval)
 
 # ------------------ DELETE AFTER (reliable scheduling) ------------------
 async def delete_after(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int, owner_user_id: str, delay: int = DELETE_DELAY):
@@ -270,6 +2439,7 @@ async def delete_after(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message
 
     try:
         await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+        inc("deletions")
         print(f"ðï¸ Deleted message {message_id} from chat {chat_id}")
     except Exception as e:
         print(f"â ï¸ delete_after: Failed to delete message {message_id} in chat {chat_id}: {e}")
@@ -288,6 +2458,105 @@ async def delete_after(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message
     except Exception:
         pass
 
+# ------------------ DELIVERY ------------------
+async def deliver_movie(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: str, message_id: int):
+    """
+    Copy one channel post to chat_id. If user_id currently has access the copy is
+    tracked and auto-deleted after DELETE_DELAY. Raises if the copy fails.
+    """
+    try:
+        await context.bot.send_chat_action(chat_id, "typing")
+    except Exception:
+        pass
+
+    sent = await context.bot.copy_message(chat_id=chat_id, from_chat_id=CHANNEL_ID, message_id=message_id)
+    inc("deliveries")
+    if message_id in post_title:
+        bump_title_popularity(post_title[message_id])
+        send_to_primary("popularity", message_id)
+
+    # Only schedule delete if user had access at the time of delivery
+    if user_access.get(user_id, 0) > time.time():
+        record_sent_message_for_deletion(user_id, sent)
+        try:
+            asyncio.create_task(delete_after(context, chat_id, sent.message_id, user_id, delay=DELETE_DELAY))
+        except Exception as e:
+            print("â ï¸ Failed to schedule delete task:", e)
+        await context.bot.send_message(chat_id, "â ï¸ Searched movie will be automatically deleted after 10 minutes. Please forward to saved messages .")
+    else:
+        await context.bot.send_message(chat_id, "â¹ï¸ You don't have active access. Ask admin or get free access to use the bot fully.")
+    return sent
+
+def matching_variant_indexes(tid: int, facets=()) -> list:
+    """Indexes into movie_variants[tid] whose post carries every facet, best first."""
+    variants = movie_variants.get(tid, [])
+    allowed = facet_postings(facets) if facets else None
+    order = [i for i, v in enumerate(variants) if allowed is None or v[V_MSG] in allowed]
+    order.sort(key=lambda i: variant_sort_key(variants[i]))
+    return order
+
+def build_variant_picker(tid: int, facets=()):
+    """
+    Inline keyboard with one button per matching variant of a title, plus filter
+    buttons for every facet that still splits the shown variants.
+    """
+    variants = movie_variants.get(tid, [])
+    order = matching_variant_indexes(tid, facets)
+    rows = []
+    for i in order[:MAX_PICKER_BUTTONS]:
+        rows.append([InlineKeyboardButton(format_variant_label(variants[i], i), callback_data=f"variant:{tid}:{i}")])
+
+    active = list(facets)
+    active_kinds = {k.split(":", 1)[0] for k in active}
+    for kind in ("s", "l", "q", "e"):
+        if kind in active_kinds:
+            continue
+        values = sorted({key for i in order for key in variant_facet_keys(tid, variants[i]) if key.startswith(kind + ":")},
+                        key=lambda k: (len(k), k))
+        if len(values) < 2:
+            continue
+        buttons = [InlineKeyboardButton(format_facet_label(key), callback_data=f"facet:{tid}:{','.join(active + [key])}")
+                   for key in values[:MAX_FILTER_BUTTONS]]
+        for j in range(0, len(buttons), 4):
+            rows.append(buttons[j:j + 4])
+    if active:
+        rows.append([InlineKeyboardButton("Clear filters", callback_data=f"facet:{tid}:")])
+    return InlineKeyboardMarkup(rows)
+
+def variant_picker_text(tid: int, facets=()) -> str:
+    count = len(matching_variant_indexes(tid, facets))
+    text = f"ð¬ {movie_titles.get(tid, '')}\n\n{count} versions available. Choose one:"
+    if facets:
+        text += "\nFilters: " + ", ".join(format_facet_label(k) for k in facets)
+    return text
+
+async def send_title_or_picker(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: str, tid: int, reply_to=None, facets=()):
+    """Deliver a title directly when only one variant matches, otherwise offer the quality/version picker."""
+    variants = movie_variants.get(tid, [])
+    order = matching_variant_indexes(tid, facets)
+    if facets and not order:
+        # the facets came from a stale session; fall back to every version
+        facets = ()
+        order = matching_variant_indexes(tid)
+    try:
+        if len(order) == 1:
+            await deliver_movie(context, chat_id, user_id, variants[order[0]][V_MSG])
+        elif order:
+            await context.bot.send_message(
+                chat_id,
+                variant_picker_text(tid, facets),
+                reply_markup=build_variant_picker(tid, facets),
+            )
+        else:
+            await context.bot.send_message(chat_id, "â Movie not found anymore (maybe removed).")
+    except Exception as e:
+        print("Error sending movie:", e)
+        if reply_to is not None:
+            try:
+                await reply_to.reply_text("â ï¸ Could not send file right now.")
+            except Exception:
+                pass
+
 # ------------------ HYBRID SEARCH (advanced hybrid) ------------------
 def find_advanced_matches(query: str, choices, limit: int = 25, score_cutoff: int = 60):
     """
@@ -328,6 +2597,90 @@ def find_advanced_matches(query: str, choices, limit: int = 25, score_cutoff: in
 
     return merged[:limit]
 
+# ------------------ LEARNED ALIASES ------------------
+# When a searcher picks a suggestion, (normalized query -> chosen title) is
+# counted. Once a query has ALIAS_PROMOTE_THRESHOLD votes and one title holds
+# at least ALIAS_MIN_SHARE of them, it is promoted into alias_index and served
+# on the exact-match path instead of going through fuzzy search again.
+ALIAS_PROMOTE_THRESHOLD = 3
+ALIAS_MIN_SHARE = 0.6
+MAX_ALIAS_CANDIDATES = 50000   # unpromoted queries are dropped beyond this, least recently voted first
+ALIAS_CANDIDATES_LOW_WATER = int(MAX_ALIAS_CANDIDATES * 0.9)  # eviction goes down to this in one pass
+alias_votes = {}   # query -> {title id: votes}
+alias_index = {}   # query -> title id (promoted)
+alias_hits = {}    # query -> times served from alias_index
+
+def load_aliases():
+    data = load_json(ALIASES_FILE, {})
+    for q, votes in data.get("votes", {}).items():
+        alias_votes[q] = {int(tid): n for tid, n in votes.items()}
+    for q, tid in data.get("aliases", {}).items():
+        alias_index[q] = int(tid)
+    alias_hits.update(data.get("hits", {}))
+
+def aliases_snapshot() -> dict:
+    return {"votes": alias_votes, "aliases": alias_index, "hits": alias_hits}
+
+def record_alias_vote(query: str, tid: int):
+    if not query or movies_db.get(query) == tid:
+        return
+    # re-insert so alias_votes stays ordered by last vote
+    votes = alias_votes.pop(query, None) or {}
+    alias_votes[query] = votes
+    votes[tid] = votes.get(tid, 0) + 1
+    total = sum(votes.values())
+    best = max(votes, key=votes.get)
+    if total >= ALIAS_PROMOTE_THRESHOLD and votes[best] >= ALIAS_MIN_SHARE * total:
+        if alias_index.get(query) != best:
+            alias_index[query] = best
+            publish_catalog_change("alias", query, movie_titles.get(best))
+            print(f"Alias promoted: '{query}' -> '{movie_titles.get(best)}' ({votes[best]}/{total} votes)")
+    elif query in alias_index and alias_index[query] != best:
+        # votes drifted away from the promoted title
+        alias_index.pop(query, None)
+        publish_catalog_change("unalias", query)
+    if len(alias_votes) > MAX_ALIAS_CANDIDATES:
+        evict_alias_candidates(keep=query)
+
+def evict_alias_candidates(keep: str = None):
+    """Drop unpromoted candidates down to the low-water mark: single votes first, then the rest, oldest first.
+
+    Evicting 10% of the cap at once keeps this O(1) amortized per vote.
+    """
+    excess = len(alias_votes) - ALIAS_CANDIDATES_LOW_WATER
+    for single_only in (True, False):
+        if excess <= 0:
+            return
+        stale = []
+        for q, v in alias_votes.items():
+            if q not in alias_index and q != keep and (not single_only or sum(v.values()) <= 1):
+                stale.append(q)
+                if len(stale) >= excess:
+                    break
+        for q in stale:
+            del alias_votes[q]
+        excess -= len(stale)
+
+def lookup_alias(query: str):
+    tid = alias_index.get(query)
+    if tid is None:
+        return None
+    if tid not in movie_titles:
+        # title was removed
+        alias_index.pop(query, None)
+        return None
+    alias_hits[query] = alias_hits.get(query, 0) + 1
+    return tid
+
+def remove_alias(query: str) -> bool:
+    alias_hits.pop(query, None)
+    alias_votes.pop(query, None)
+    if query in alias_index:
+        publish_catalog_change("unalias", query)
+    return alias_index.pop(query, None) is not None
+
+load_aliases()
+
 # ------------------ INDEX OLD CHANNEL MESSAGES ------------------
 async def index_old_channel_messages(app):
     print("ð Attempting to index channel history (bot must be admin and have rights)...")
@@ -378,69 +2731,65 @@ def check_and_give_daily_coins(user_id: str) -> bool:
     today = today_str()
     last_day = user_streak.get(user_id, {}).get("last_search_day", "")
     if last_day != today:
-        add_coins(user_id, 10, "Daily search bonus")
+        add_coins(user_id, 10, EARN_DAILY)
         return True
     return False
 
 def check_jackpot_streak(user_id: str, streak: int):
-    today = today_str()
     if streak > 0 and streak % 7 == 0:
         # â make sure reward is NOT already given today
-        hist = user_history.get(user_id, {}).get("earn", [])
-        for e in hist:
-            if "7-day streak jackpot" in e["reason"] and today in datetime.fromtimestamp(e["timestamp"]).strftime("%Y-%m-%d"):
-                return False  # â already rewarded today
-
-        add_coins(user_id, 50, f"7-day streak jackpot reward (Day {streak})")
+        st = get_user_state(user_id, create=True)
+        today = ist_day_number(time.time())
+        if st.jackpot_day == today:
+            return False  # â already rewarded today
+
+        # one save for the credit and the marker; the marker only once the credit is in the ledger
+        with batched_saves():
+            if not add_coins(user_id, 50, EARN_JACKPOT, streak):
+                return False
+            st.jackpot_day = today
         return True
     return False
 
 # ------------------ LEADERBOARD ------------------
-def get_daily_leaderboard():
-    today = today_str()
+def ledger_leaderboard(n: int = 10) -> list:
+    """Today's top n [(user_id, search coins)] from this process's earn ledgers (the source of truth for rewards)."""
+    day_start = ist_day_start()
     user_earn_today = {}
-    for uid, history in user_history.items():
-        earned = 0
-        for rec in history.get("earn", []):
-            ts = rec.get("timestamp", 0)
-            reason = rec.get("reason", "").lower()
-            dt = datetime.fromtimestamp(ts, tz=timezone(timedelta(hours=5, minutes=30)))
-            if dt.strftime("%Y-%m-%d") == today and "movie search" in reason:
-                earned += rec.get("amount", 0)
+    for uid, st in users.items():
+        ledger = st.earn
+        if not ledger or not ledger.ts or ledger.ts[-1] < day_start:
+            continue
+        earned = ledger.total_since(day_start, EARN_SEARCH)
         if earned > 0:
-            user_earn_today[uid] = earned
-    sorted_users = sorted(user_earn_today.items(), key=lambda x: -x[1])[:10]
-    return sorted_users
+            user_earn_today[str(uid)] = earned
+    return sorted(user_earn_today.items(), key=lambda x: -x[1])[:n]
 
-def get_user_rank(user_id: str):
-    ld = get_daily_leaderboard()
-    for i, (uid, _) in enumerate(ld):
+async def get_daily_leaderboard():
+    """Today's top 10 [(user_id, search coins)] from the state backend."""
+    return await backend_call(state_backend.daily_leaderboard, 10)
+
+def get_user_rank(user_id: str, leaderboard):
+    for i, (uid, _) in enumerate(leaderboard):
         if uid == user_id:
             return i + 1
     return None
 
 def reward_leaderboard_top(users):
-    today = today_str()
+    today = ist_day_number(time.time())
     rewarded = []
     for uid, _ in users:
-        if uid not in user_history:
-            user_history[uid] = {"premium": [], "withdraw": [], "earn": []}
-        already = False
-        for rec in user_history[uid]["earn"]:
-            ts = rec.get("timestamp", 0)
-            reason = rec.get("reason", "")
-            dt = datetime.fromtimestamp(ts, tz=timezone(timedelta(hours=5, minutes=30)))
-            if dt.strftime("%Y-%m-%d") == today and "leaderboard daily top reward" in reason.lower():
-                already = True
-                break
-        if not already:
-            add_coins(uid, 1000, "Leaderboard daily top reward")
+        st = get_user_state(uid, create=True)
+        # the marker only once the credit is in the ledger, so a failed append stays payable
+        if st.leaderboard_day != today and add_coins(uid, 1000, EARN_LEADERBOARD):
+            st.leaderboard_day = today
             rewarded.append(uid)
     save_all()
     return rewarded
 
 async def notify_and_reward_leaderboard(bot):
-    users = get_daily_leaderboard()
+    # the earn ledgers, not the backend's leaderboard: its writes are fire-and-forget and may have been dropped
+    users = ledger_leaderboard(10)
     if not users:
         try:
             await bot.send_message(ADMIN_USER_ID, "ð Leaderboard reward job: no data today.")
@@ -473,24 +2822,320 @@ async def notify_and_reward_leaderboard(bot):
     except Exception:
         pass
 
-async def schedule_daily_leaderboard_rewards(app):
+# ------------------ ANALYTICS SNAPSHOTS ------------------
+# Admin reports (/stats, /activity, /listmovies, the leaderboard views and the
+# daily digest) read an immutable AnalyticsSnapshot instead of the live dicts.
+# build_snapshot() copies the per-user fields it needs in one synchronous pass
+# on the loop (so the copy is consistent), and does the aggregation, sorting
+# and catalog formatting in the executor. The catalog is only recopied when
+# catalog_version moved. Counter samples are kept for an hour for the
+# searches/hour figures.
+class AnalyticsSnapshot:
+    __slots__ = ("built_at", "build_seconds", "day", "users_total", "dau", "with_access", "active_access",
+                 "verified", "wallet_total", "coins_today", "search_coins_today", "searchers_today",
+                 "earned_today", "leaderboard", "pending_count", "pending_rupees", "counters",
+                 "searches_hour", "hits_hour", "catalog", "catalog_version", "variants")
+
+    def age(self) -> float:
+        return time.time() - self.built_at
+
+_HIT_COUNTERS = ("exact_hits", "alias_hits", "facet_hits", "fuzzy_hits")
+analytics = {
+    "snapshot": None,
+    "samples": deque(maxlen=3600 // ANALYTICS_SNAPSHOT_INTERVAL + 2),  # (ts, searches, hits)
+    "lock": asyncio.Lock(),
+    "builds": 0,
+}
+
+def _aggregate_snapshot(snap: AnalyticsSnapshot, rows: list, now: float, day_start: float):
+    """Executor half of build_snapshot(); rows are (uid, access_until, verified, last_search_day, wallet, amounts, codes)."""
+    today = snap.day
+    dau = with_access = active = verified = wallet_total = coins = search_coins = searchers = 0
+    earned, searched = {}, {}
+    for uid, access_until, is_verified, last_day, wallet, amounts, codes in rows:
+        if last_day == today:
+            dau += 1
+        if access_until:
+            with_access += 1
+            if access_until > now:
+                active += 1
+        if is_verified:
+            verified += 1
+        wallet_total += wallet or 0
+        if amounts:
+            total = sum(amounts)
+            from_search = sum(a for a, c in zip(amounts, codes) if c == EARN_SEARCH)
+            earned[uid] = total
+            coins += total
+            if from_search > 0:
+                searched[uid] = from_search
+                search_coins += from_search
+                searchers += 1
+    snap.users_total = len(rows)
+    snap.dau, snap.with_access, snap.active_access, snap.verified = dau, with_access, active, verified
+    snap.wallet_total = wallet_total
+    snap.coins_today, snap.search_coins_today, snap.searchers_today = coins, search_coins, searchers
+    snap.earned_today = earned
+    snap.leaderboard = sorted(searched.items(), key=lambda x: -x[1])[:10]
+
+def _user_rows(day_start: float) -> list:
+    rows = []
+    for uid, st in users.items():
+        ledger = st.earn
+        if ledger and ledger.ts and ledger.ts[-1] >= day_start:
+            amounts, codes = ledger.rows_since(day_start)
+        else:
+            amounts = codes = None
+        rows.append((str(uid), st.access_until, st.verified, st.last_search_day, st.wallet, amounts, codes))
+    return rows
+
+async def build_snapshot() -> AnalyticsSnapshot:
+    async with analytics["lock"]:
+        started = time.time()
+        day_start = ist_day_start(started)
+        snap = AnalyticsSnapshot()
+        snap.day = today_str()
+        # --- synchronous copy: nothing below yields until the copies are taken ---
+        rows = _user_rows(day_start)
+        snap.counters = dict(counters)
+        pending = [withdraw_requests[rid] for _, rid in withdraw_index["pending"] if rid in withdraw_requests]
+        snap.pending_count = len(pending)
+        snap.pending_rupees = sum(float(req.get("amount", 0) or 0) for req in pending)
+        previous = analytics["snapshot"]
+        if previous is not None and previous.catalog_version == catalog_version:
+            snap.catalog, snap.variants = previous.catalog, previous.variants
+        else:
+            snap.catalog = tuple((name, tuple(v[V_MSG] for v in movie_variants.get(tid, ())))
+                                 for name, tid in movies_db.items())
+            snap.variants = sum(len(ids) for _, ids in snap.catalog)
+        snap.catalog_version = catalog_version
+        # --- aggregation off the loop ---
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_executor, _aggregate_snapshot, snap, rows, started, day_start)
+        if isinstance(state_backend, RespStateBackend):
+            # shared between worker processes, so it beats this process's ledgers; all of today's
+            # figures come from one source or the other, never a mix
+            totals = await loop.run_in_executor(_executor, state_backend.daily_totals, 10)
+            if totals is not None:
+                snap.coins_today, snap.search_coins_today, snap.searchers_today, snap.leaderboard = totals
+        samples = analytics["samples"]
+        hits = sum(snap.counters.get(k, 0) for k in _HIT_COUNTERS)
+        samples.append((started, snap.counters.get("searches", 0), hits))
+        base = next((s for s in samples if s[0] >= started - 3600), samples[0])
+        snap.searches_hour, snap.hits_hour = samples[-1][1] - base[1], samples[-1][2] - base[2]
+        snap.built_at = started
+        snap.build_seconds = time.time() - started
+        analytics["snapshot"] = snap
+        analytics["builds"] += 1
+        return snap
+
+async def current_snapshot(max_age: float = ANALYTICS_MAX_AGE) -> AnalyticsSnapshot:
+    """The latest snapshot, rebuilt first if it is missing, older than max_age or from another day."""
+    snap = analytics["snapshot"]
+    if snap is None or snap.age() > max_age or snap.day != today_str():
+        snap = await build_snapshot()
+    return snap
+
+async def snapshot_leaderboard() -> list:
+    """Today's top 10 from the latest snapshot; live if there is none yet (rewards use the earn ledgers)."""
+    snap = analytics["snapshot"]
+    if snap is None or snap.day != today_str():
+        return await get_daily_leaderboard()
+    return snap.leaderboard
+
+# ------------------ SCHEDULER ------------------
+# All periodic work runs as jobs in one scheduler task (start_scheduler() is
+# idempotent, so run_bot() retries never start a second copy). Job kinds:
+#   daily    - at hour:minute IST; a run missed while the bot was down is caught
+#              up at startup if it is at most `catch_up` seconds late
+#   interval - every `interval` seconds
+#   once     - a single run at `next_run`, then removed
+# Last-run times are persisted in SCHEDULER_STATE_FILE; /jobs shows per-job metrics.
+IST_TZ = timezone(timedelta(hours=5, minutes=30))
+SCHEDULER_MAX_SLEEP = 60  # seconds; re-check due jobs at least this often
+
+class Job:
+    __slots__ = ("name", "kind", "func", "hour", "minute", "interval", "catch_up",
+                 "next_run", "last_run", "running", "runs", "failures",
+                 "last_duration", "total_duration", "max_duration", "last_late", "last_error")
+
+    def __init__(self, name: str, kind: str, func, hour: int = 0, minute: int = 0,
+                 interval: float = 0, catch_up: float = 0):
+        self.name = name
+        self.kind = kind
+        self.func = func            # callable(app) -> None or awaitable
+        self.hour = hour
+        self.minute = minute
+        self.interval = interval
+        self.catch_up = catch_up
+        self.next_run = 0.0
+        self.last_run = 0.0
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.last_late = 0.0        # seconds between next_run and the actual start
+        self.last_error = ""
+
+jobs = {}  # name -> Job
+_scheduler_state = load_json(SCHEDULER_STATE_FILE, {})  # name -> {"last_run": ts}
+_scheduler = {"task": None, "app": None, "wakeup": None}
+
+def _daily_occurrence(ts: float, hour: int, minute: int, after: bool) -> float:
+    """Next (after=True) or latest (after=False) hour:minute IST relative to ts."""
+    target = datetime.fromtimestamp(ts, IST_TZ).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if after and target.timestamp() <= ts:
+        target += timedelta(days=1)
+    elif not after and target.timestamp() > ts:
+        target -= timedelta(days=1)
+    return target.timestamp()
+
+def _schedule_next(job: Job, now: float):
+    if job.kind == "daily":
+        job.next_run = _daily_occurrence(now, job.hour, job.minute, after=True)
+    elif job.kind == "interval":
+        job.next_run = max(now, (job.last_run or now) + job.interval)
+
+def _add_job(job: Job, first_run: float):
+    job.last_run = float(_scheduler_state.get(job.name, {}).get("last_run", 0))
+    job.next_run = first_run
+    jobs[job.name] = job
+    if _scheduler["wakeup"] is not None:
+        _scheduler["wakeup"].set()
+    return job
+
+def add_daily_job(name: str, func, hour: int, minute: int = 0, catch_up: float = 0):
+    job = Job(name, "daily", func, hour=hour, minute=minute, catch_up=catch_up)
+    now = time.time()
+    last_run = float(_scheduler_state.get(name, {}).get("last_run", 0))
+    missed = _daily_occurrence(now, hour, minute, after=False)
+    if last_run and last_run < missed and now - missed <= catch_up:
+        first = now  # missed while down: catch up once
+    else:
+        first = _daily_occurrence(now, hour, minute, after=True)
+    return _add_job(job, first)
+
+def add_interval_job(name: str, func, seconds: float, run_at_start: bool = False):
+    job = Job(name, "interval", func, interval=seconds)
+    now = time.time()
+    last_run = float(_scheduler_state.get(name, {}).get("last_run", 0))
+    if run_at_start or not last_run:
+        first = now if run_at_start else now + seconds
+    else:
+        first = max(now, last_run + seconds)
+    return _add_job(job, first)
+
+def add_one_shot_job(name: str, func, delay: float = 0):
+    return _add_job(Job(name, "once", func), time.time() + delay)
+
+async def _run_job(job: Job):
+    started = time.time()
+    job.last_late = max(0.0, started - job.next_run)
+    try:
+        result = job.func(_scheduler["app"])
+        if asyncio.iscoroutine(result):
+            await result
+        job.runs += 1
+        job.last_error = ""
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        job.failures += 1
+        job.last_error = f"{type(e).__name__}: {e}"
+        print(f"â ï¸ Job {job.name} failed: {job.last_error}")
+    finally:
+        job.last_duration = time.time() - started
+        job.total_duration += job.last_duration
+        job.max_duration = max(job.max_duration, job.last_duration)
+        job.last_run = started
+        job.running = False
+        if job.kind == "once":
+            jobs.pop(job.name, None)
+        else:
+            _schedule_next(job, time.time())
+            _scheduler_state[job.name] = {"last_run": started}
+            save_json(SCHEDULER_STATE_FILE, _scheduler_state)
+        if _scheduler["wakeup"] is not None:
+            _scheduler["wakeup"].set()
+
+async def scheduler_loop():
+    wakeup = _scheduler["wakeup"]
     while True:
+        now = time.time()
+        for job in list(jobs.values()):
+            if not job.running and job.next_run <= now:
+                job.running = True
+                asyncio.create_task(_run_job(job))
+        upcoming = min((j.next_run for j in jobs.values() if not j.running), default=now + SCHEDULER_MAX_SLEEP)
+        wakeup.clear()
         try:
-            now = datetime.now(timezone.utc).astimezone(timezone(timedelta(hours=5, minutes=30)))
-            target = now.replace(hour=21, minute=0, second=0, microsecond=0)
-            if now >= target:
-                target = target + timedelta(days=1)
-            wait_seconds = (target - now).total_seconds()
-            await asyncio.sleep(wait_seconds)
-            try:
-                await notify_and_reward_leaderboard(app.bot)
-            except Exception as e:
-                print("Error rewarding leaderboard:", e)
-        except asyncio.CancelledError:
-            break
-        except Exception as e:
-            print("schedule_daily_leaderboard_rewards error:", e)
-            await asyncio.sleep(60)
+            await asyncio.wait_for(wakeup.wait(), timeout=min(SCHEDULER_MAX_SLEEP, max(0.05, upcoming - time.time())))
+        except asyncio.TimeoutError:
+            pass
+
+def start_scheduler(app):
+    """Start the scheduler task once per process; later calls only swap in the new app."""
+    _scheduler["app"] = app
+    task = _scheduler["task"]
+    if task is not None and not task.done():
+        return False
+    _scheduler["wakeup"] = asyncio.Event()
+    _scheduler["task"] = asyncio.create_task(scheduler_loop())
+    return True
+
+def run_job_now(name: str) -> bool:
+    job = jobs.get(name)
+    if job is None:
+        return False
+    job.next_run = time.time()
+    if _scheduler["wakeup"] is not None:
+        _scheduler["wakeup"].set()
+    return True
+
+# --- jobs ---
+async def leaderboard_rewards_job(app):
+    await notify_and_reward_leaderboard(app.bot)
+
+def history_compaction_job(app):
+    compacted, folded, dropped = compact_earn_history()
+    if folded:
+        save_all()
+    print(f"ðï¸ History compaction: {folded} rows from {compacted} users rolled up, {dropped} payloads dropped")
+
+def access_maintenance_job(app):
+    for uid, expiry in due_expiry_reminders():
+        hours_left = max(1, round((expiry - time.time()) / 3600))
+        enqueue_notification(
+            app.bot, uid,
+            f"â³ Your access expires in about {hours_left} hour(s) ({time.ctime(expiry)}).\n"
+            "Use /redeem or get premium to keep searching.",
+        )
+    purged = purge_expired_access()
+    if purged:
+        print(f"ðï¸ Archived {purged} expired access entries to {ACCESS_ARCHIVE_FILE}")
+
+async def analytics_snapshot_job(app):
+    await build_snapshot()
+
+async def admin_digest_job(app):
+    snap = await build_snapshot()
+    text = (
+        f"ð Daily digest ({snap.day})\n\n"
+        f"Searches: {snap.search_coins_today} by {snap.searchers_today} users\n"
+        f"Coins earned today: {snap.coins_today}\n"
+        f"Active access users: {snap.active_access}\n"
+        f"Pending withdrawals: {snap.pending_count}\n"
+        f"Notifications sent/failed: {notify_stats['sent']}/{notify_stats['failed']}"
+    )
+    await app.bot.send_message(ADMIN_USER_ID, text)
+
+add_daily_job("leaderboard_rewards", leaderboard_rewards_job, LEADERBOARD_REWARD_HOUR_IST, catch_up=3 * 3600)
+add_daily_job("history_compaction", history_compaction_job, COMPACTION_HOUR_IST, catch_up=24 * 3600)
+add_daily_job("admin_digest", admin_digest_job, DIGEST_HOUR_IST, DIGEST_MINUTE_IST)
+add_interval_job("access_maintenance", access_maintenance_job, ACCESS_CHECK_INTERVAL, run_at_start=True)
+add_interval_job("analytics_snapshot", analytics_snapshot_job, ANALYTICS_SNAPSHOT_INTERVAL, run_at_start=True)
 
 # ------------------ HANDLERS ------------------
 def ist_now():
@@ -632,10 +3277,57 @@ async def plans(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.callback_query.edit_message_text("ð Premium Plans:", reply_markup=InlineKeyboardMarkup(rows))
 
 
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-mode autocomplete. Titles are public; access is checked when the file is requested."""
+    iq = update.inline_query
+    if iq is None:
+        return
+    results = []
+    for tid in inline_suggest(iq.query):
+        title = movie_titles.get(tid)
+        if not title:
+            continue
+        count = len(movie_variants.get(tid, []))
+        results.append(InlineQueryResultArticle(
+            id=str(tid),
+            title=title,
+            description=f"{count} version(s)" if count != 1 else "1 file",
+            input_message_content=InputTextMessageContent(title),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("ð¥ Get file", callback_data=f"get:{tid}")]]),
+        ))
+    try:
+        await iq.answer(results, cache_time=INLINE_CACHE_TIME)
+    except Exception as e:
+        print("inline_query answer failed:", e)
+
+async def inline_get(query, context: ContextTypes.DEFAULT_TYPE):
+    """Handle "get:<title_id>" from an inline result: deliver to the user's private chat if they may search."""
+    user_id = str(query.from_user.id)
+    if user_access.get(user_id, 0) < time.time():
+        await query.answer("â³ Your access expired. Open the bot to get free 24h access or buy premium.", show_alert=True)
+        return
+    if user_id not in verified_users:
+        await query.answer("ð Join the channel and Verify in the bot to continue.", show_alert=True)
+        return
+    try:
+        tid = int(query.data.split(":", 1)[1])
+    except Exception:
+        await query.answer()
+        return
+    if tid not in movie_variants:
+        await query.answer("â Movie not found anymore (maybe removed).", show_alert=True)
+        return
+    await query.answer("ð¥ Sending to your chat with the bot...")
+    await send_title_or_picker(context, int(user_id), user_id, tid)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     if query is None:
         return
+    if (query.data or "").startswith("get:"):
+        # answered inside inline_get (it may need an alert)
+        await inline_get(query, context)
+        return
     await query.answer()
     user_id = str(query.from_user.id)
     data = query.data or ""
@@ -651,8 +3343,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # verify membership
     if data == "verify":
         try:
-            member = await context.bot.get_chat_member(chat_id=f"@{CHANNEL_USERNAME}", user_id=int(user_id))
-            if member.status in ["member", "administrator", "creator"]:
+            status = await backend_call(state_backend.cached_membership, user_id)
+            if status is None:
+                member = await context.bot.get_chat_member(chat_id=f"@{CHANNEL_USERNAME}", user_id=int(user_id))
+                status = member.status
+                if status in ["member", "administrator", "creator"]:
+                    # only confirmed members are cached; a "left" user may join any second
+                    state_backend.cache_membership(user_id, status)
+            if status in ["member", "administrator", "creator"]:
                 # store as string consistently
                 verified_users.add(user_id)
                 save_json(VERIFIED_USERS_FILE, list(verified_users))
@@ -816,7 +3514,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if wallet_coins < cost_coins:
             await query.edit_message_text(f"â Not enough coins. Wallet: {format_coins_rupees(wallet_coins)}")
             return
-        if deduct_coins(user_id, cost_coins):
+        if deduct_coins(user_id, cost_coins, LEDGER_SPEND, code):
             expiry = time.time() + days * 24 * 3600
             prev = user_access.get(user_id, 0)
             if prev < time.time():
@@ -825,7 +3523,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 user_access[user_id] = prev + days * 24 * 3600
             save_all()
             if user_id not in user_history:
-                user_history[user_id] = {"premium": [], "withdraw": [], "earn": []}
+                user_history[user_id] = {"premium": [], "withdraw": []}
             user_history[user_id]["premium"].append({"timestamp": time.time(), "plan": plan_name, "paid_coins": cost_coins})
             save_all()
             await query.edit_message_text(f"â Bought {plan_name}. Premium till {time.ctime(user_access[user_id])}")
@@ -862,9 +3560,42 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data.pop("withdraw", None)
         return
 
-    # Confirm selection with tokenized sessions: callback_data format "confirm:<token>:<index>"
-    if data.startswith("confirm:"):
-        parts = data.split(":")
+    # Pending-withdrawal pages for the admin: "wdpage:<page>"
+    if data.startswith("wdpage:"):
+        if query.from_user.id != ADMIN_USER_ID:
+            return
+        try:
+            page = int(data.split(":", 1)[1])
+        except ValueError:
+            page = 0
+        text, kb = build_pending_page(page)
+        try:
+            await query.edit_message_text(text, reply_markup=kb)
+        except Exception as e:
+            print("pending page edit failed:", e)
+        return
+
+    # Suggestion pages: "page:<token>:<page>" re-renders from the cached result set
+    if data.startswith("page:"):
+        parts = data.split(":")
+        session = await get_search_session(parts[1]) if len(parts) == 3 else None
+        if not session:
+            await query.message.reply_text("â Selection expired or invalid. Please search again.")
+            return
+        try:
+            page = int(parts[2])
+        except Exception:
+            page = 0
+        text, kb = build_suggestion_page(parts[1], session, page)
+        try:
+            await query.edit_message_text(text, reply_markup=kb)
+        except Exception as e:
+            print("suggestion page edit failed:", e)
+        return
+
+    # Confirm selection with tokenized sessions: callback_data format "confirm:<token>:<index>"
+    if data.startswith("confirm:"):
+        parts = data.split(":")
         if len(parts) != 3:
             await query.message.reply_text("â ï¸ Invalid selection.")
             return
@@ -875,66 +3606,64 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.message.reply_text("â ï¸ Invalid selection index.")
             return
 
-        session = search_sessions.get(token)
+        session = await get_search_session(token)
         if not session:
             await query.message.reply_text("â Selection expired or invalid. Please search again.")
             return
 
         # Allow anyone to click a suggestion button (not only original searcher)
-        suggestions = session.get("suggestions", [])
-        if idx < 0 or idx >= len(suggestions):
+        if idx < 0 or idx >= len(session.ids):
             await query.message.reply_text("â Selection expired or invalid. Please search again.")
             return
 
-        movie_title = suggestions[idx]
-        # deliver movie if exists in movies_db
-        if movie_title in movies_db:
-            msg_id = movies_db[movie_title]
-            try:
-                # Send typing action
-                try:
-                    await context.bot.send_chat_action(query.message.chat.id, "typing")
-                except Exception:
-                    pass
+        tid = session.ids[idx]
+        if tid not in movie_titles:
+            await query.message.reply_text("â Movie not found anymore (maybe removed).")
+            return
+        # learn from the original searcher's first pick only
+        if query.from_user.id == session.user_id and not session.voted:
+            mark_session_voted(token, session)
+            if not send_to_primary("alias_vote", session.query, movie_titles[tid]):
+                record_alias_vote(session.query, tid)
+        # Do NOT remove the session token; sessions persist so buttons remain usable.
+        await send_title_or_picker(context, query.message.chat.id, str(query.from_user.id), tid,
+                                   reply_to=query.message, facets=session.facets)
+        return
 
-                # Copy message from channel to user chat
-                sent = await context.bot.copy_message(
-                    chat_id=query.message.chat.id,
-                    from_chat_id=CHANNEL_ID,
-                    message_id=msg_id,
-                )
-
-                # determine whether the clicking user currently has access
-                clicker_id_str = str(query.from_user.id)
-                expiry = user_access.get(clicker_id_str, 0)
-                now_ts = time.time()
-                if expiry > now_ts:
-                    # Only schedule delete if user had access at the time they clicked
-                    # Track the sent message for deletion tied to this user
-                    record_sent_message_for_deletion(clicker_id_str, sent)
-                    try:
-                        asyncio.create_task(delete_after(context, query.message.chat.id, sent.message_id, clicker_id_str, delay=DELETE_DELAY))
-                    except Exception as e:
-                        print("â ï¸ Failed to schedule delete task:", e)
-
-                    # Inform user
-                    await context.bot.send_message(
-                        query.message.chat.id,
-                        "â ï¸ Searched movie will be automatically deleted after 10 minutes. Please forward to saved messages ."
-                    )
-                else:
-                    # if user does not have access, send without scheduling deletion
-                    await context.bot.send_message(
-                        query.message.chat.id,
-                        "â¹ï¸ You don't have active access. Ask admin or get free access to use the bot fully."
-                    )
-
-                # Do NOT remove the session token; sessions persist so buttons remain usable.
-            except Exception as e:
-                print("Error sending suggested movie:", e)
-                await query.message.reply_text("â ï¸ Could not send file right now.")
-        else:
+    # Picker filter: "facet:<title_id>:<key>,<key>,..." narrows the picker in place
+    if data.startswith("facet:"):
+        parts = data.split(":", 2)
+        try:
+            tid = int(parts[1])
+        except Exception:
+            return
+        if tid not in movie_variants:
             await query.message.reply_text("â Movie not found anymore (maybe removed).")
+            return
+        facets = [k for k in parts[2].split(",") if k] if len(parts) > 2 else []
+        if facets and not matching_variant_indexes(tid, facets):
+            facets = []
+        try:
+            await query.edit_message_text(variant_picker_text(tid, facets), reply_markup=build_variant_picker(tid, facets))
+        except Exception as e:
+            print("facet filter edit failed:", e)
+        return
+
+    # Variant picker: "variant:<title_id>:<variant_index>"
+    if data.startswith("variant:"):
+        parts = data.split(":")
+        try:
+            tid = int(parts[1])
+            vidx = int(parts[2])
+            variant = movie_variants[tid][vidx]
+        except Exception:
+            await query.message.reply_text("â Movie not found anymore (maybe removed).")
+            return
+        try:
+            await deliver_movie(context, query.message.chat.id, str(query.from_user.id), variant[V_MSG])
+        except Exception as e:
+            print("Error sending picked variant:", e)
+            await query.message.reply_text("â ï¸ Could not send file right now.")
         return
 
     if data == "try_again":
@@ -997,9 +3726,9 @@ async def handle_withdraw_messages(update: Update, context: ContextTypes.DEFAULT
             await update.message.reply_text(f"â Not enough coins. Wallet: {format_coins_rupees(get_wallet_balance(user_id))}")
             context.user_data.pop("withdraw", None)
             return True
-        if deduct_coins(user_id, coins_needed):
-            rid = uuid.uuid4().hex[:12]
-            withdraw_requests[rid] = {"user_id": user_id, "amount": amount, "upi_id": upi_id, "status": "pending", "timestamp": time.time()}
+        rid = uuid.uuid4().hex[:12]
+        if deduct_coins(user_id, coins_needed, LEDGER_WITHDRAW, rid):
+            create_withdraw_request(rid, user_id, amount, coins_needed, upi_id)
             save_all()
             await update.message.reply_text(f"â Withdraw request submitted. Request ID: {rid} (â ï¸If Payment details is Incorrectð¤¦ Instant Notify to admin- @anshchaube852)")
             context.user_data.pop("withdraw", None)
@@ -1025,7 +3754,7 @@ async def send_user_dashboard(user_id: str, context: ContextTypes.DEFAULT_TYPE,
         name = chat.first_name or chat.username or "User"
     except Exception:
         pass
-    rank = get_user_rank(user_id)
+    rank = get_user_rank(user_id, await snapshot_leaderboard())
     rank_text = "Not ranked today" if rank is None else f"#{rank}"
     streak = user_streak.get(user_id, {}).get("streak", 0)
     total_refers = 0
@@ -1034,7 +3763,8 @@ async def send_user_dashboard(user_id: str, context: ContextTypes.DEFAULT_TYPE,
             total_refers = len(rec.get("used_by", []))
             break
     wallet = get_wallet_balance(user_id)
-    withdraws = sum(float(r["amount"]) for r in user_history.get(user_id, {}).get("withdraw", []))
+    st = get_user_state(user_id)
+    withdraws = st.withdrawn_rupees if st else 0.0
     text = (
         f"ð Dashboard for {name}\n\n"
         f"ð Rank: {rank_text}\n"
@@ -1050,7 +3780,7 @@ async def send_user_dashboard(user_id: str, context: ContextTypes.DEFAULT_TYPE,
         await context.bot.send_message(int(user_id), text, reply_markup=kb)
 
 async def send_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE, from_button=False):
-    leaderboard = get_daily_leaderboard()
+    leaderboard = (await current_snapshot()).leaderboard
     if not leaderboard:
         msg = "No leaderboard data available today."
     else:
@@ -1063,7 +3793,7 @@ async def send_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE, f
                 name = str(uid)
             lines.append(f"{i}. {name} - {score} coins")
         req_user_id = str(update.effective_user.id)
-        rank = get_user_rank(req_user_id)
+        rank = get_user_rank(req_user_id, leaderboard)
         user_line = "You are not ranked today." if rank is None else f"Your Rank: #{rank} | Coins: {get_wallet_balance(req_user_id)}"
         msg = "ð Top 10 Movie Searchers Today:\n\n" + "\n".join(lines) + "\n\n" + user_line
     if from_button and update.callback_query:
@@ -1094,9 +3824,34 @@ async def wallet_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await update.message.reply_text("â Amount integer.")
         return
-    user_wallet[uid] = amount
+    try:
+        entry = post_ledger_entry(LEDGER_ADJUST, uid, amount - get_wallet_balance(uid), f"admin set wallet to {amount}")
+    except ValueError:
+        await update.message.reply_text("â Invalid user id.")
+        return
+    except OSError:
+        await update.message.reply_text("â ï¸ Could not write the coin ledger; wallet unchanged.")
+        return
     save_all()
-    await update.message.reply_text(f"â Wallet {uid} set to {amount} coins.")
+    note = f" (adjustment #{entry[0]})" if entry else ""
+    await update.message.reply_text(f"â Wallet {uid} set to {amount} coins.{note}")
+
+async def verifyledger_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    report = await asyncio.get_running_loop().run_in_executor(_executor, verify_coin_ledger, coin_ledger_checkpoint())
+    lines = [
+        f"Coin ledger: {report['entries']} entries, {report['accounts']} accounts",
+        f"Trial balance: {report['trial_balance']} (should be 0)",
+    ]
+    if report["mismatches"]:
+        lines.append(f"â {len(report['mismatches'])} accounts differ from the replay:")
+        for acct, have, want in report["mismatches"][:20]:
+            lines.append(f"- {acct}: materialized {have}, ledger {want}")
+    else:
+        lines.append("â All balances and lifetime totals match the replay.")
+    await update.message.reply_text("\n".join(lines))
 
 async def activity_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
@@ -1106,10 +3861,333 @@ async def activity_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /activity <user_id>")
         return
     uid = context.args[0]
-    history = get_user_history(uid)
-    today = today_str()
-    coins_today = sum(rec["amount"] for rec in history.get("earn", []) if datetime.fromtimestamp(rec["timestamp"], timezone(timedelta(hours=5, minutes=30))).strftime("%Y-%m-%d") == today)
-    await update.message.reply_text(f"User {uid} earned {coins_today} coins today.")
+    snap = await current_snapshot()
+    coins_today = snap.earned_today.get(uid, 0)
+    await update.message.reply_text(f"User {uid} earned {coins_today} coins today (as of {int(snap.age())}s ago).")
+
+async def compact_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    days = HISTORY_RETENTION_DAYS
+    if context.args:
+        try:
+            days = max(1, int(context.args[0]))
+        except ValueError:
+            await update.message.reply_text("Usage: /compact [retention_days]")
+            return
+    compacted, folded, dropped = compact_earn_history(days)
+    if folded:
+        save_all()
+    await update.message.reply_text(
+        f"Compacted earn history older than {days} days:\n"
+        f"{folded} rows from {compacted} users rolled up, {dropped} payloads dropped."
+    )
+
+async def perf_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    lines = ["Handler latency (ms): calls | avg | p50 | p95 | p99 | max"]
+    for label, hist in sorted(handler_latency.items(), key=lambda kv: -kv[1].sum)[:25]:
+        lines.append(
+            f"{label}: {hist.count} | {hist.sum / hist.count * 1000:.0f} | {hist.quantile(0.5) * 1000:.0f} | "
+            f"{hist.quantile(0.95) * 1000:.0f} | {hist.quantile(0.99) * 1000:.0f} | {hist.max * 1000:.0f}"
+        )
+    if not handler_latency:
+        lines.append("(no handler calls yet)")
+    lines.append("\nCounters:")
+    lines.extend(f"{name}: {value}" for name, value in counters.items())
+    if METRICS_PORT:
+        lines.append(f"\nPrometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    await update.message.reply_text("\n".join(lines))
+
+async def ratelimits_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    app = getattr(context, "application", None)
+    depth = app.update_queue.qsize() if app is not None else 0
+    lines = [
+        f"Update queue: {depth} (shed optional at {OVERLOAD_QUEUE_DEPTH}, all at {OVERLOAD_HARD_DEPTH})",
+        f"Tracked: {len(rate_limiter)} buckets/cooldowns",
+        "",
+        "action: burst/refill per min | users | throttled | shed",
+    ]
+    for action, (burst, per_minute) in RATE_LIMITS.items():
+        lines.append(
+            f"{action}: {burst}/{per_minute} | {len(rate_limiter.buckets[action])} | "
+            f"{rate_limiter.throttled[action]} | {rate_limiter.shed[action]}"
+        )
+    await update.message.reply_text("\n".join(lines))
+
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_N = 25
+# functions worth calling out in every /profile report
+PROFILE_WATCH = ("save_all", "save_json", "find_advanced_matches", "get_daily_leaderboard", "handle_message")
+_profile_running = {"active": False, "task": None}
+
+async def profile_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile <seconds>: cProfile the event loop thread while the bot keeps serving.
+
+    The handler only acknowledges; the profile runs in a background task so
+    updates keep being processed during the window.
+    """
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    try:
+        seconds = float(context.args[0]) if context.args else 30.0
+    except ValueError:
+        await update.message.reply_text(f"Usage: /profile <seconds> (max {PROFILE_MAX_SECONDS})")
+        return
+    seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+    if _profile_running["active"]:
+        await update.message.reply_text("â ï¸ A profile is already running.")
+        return
+    _profile_running["active"] = True
+    await update.message.reply_text(f"Profiling for {seconds:g}s...")
+    _profile_running["task"] = asyncio.create_task(run_profile(update.message, seconds))
+
+async def run_profile(message, seconds: float):
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    finally:
+        _profile_running["active"] = False
+
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+    watched = []
+    for (filename, _, func), (_, ncalls, _, cumtime, _) in stats.stats.items():
+        if func in PROFILE_WATCH and filename.endswith(os.path.basename(__file__)):
+            watched.append(f"{func}: {ncalls} calls, {cumtime * 1000:.0f}ms cumulative")
+    rows = [line for line in out.getvalue().splitlines() if line.strip()]
+    # keep the header and table, shorten long file paths
+    table = "\n".join(re.sub(r"\S*/", "", line) for line in rows[-(PROFILE_TOP_N + 1):])
+    summary = f"Profile of {seconds:g}s ({stats.total_calls} calls, {stats.total_tt:.2f}s CPU on the loop thread)\n"
+    if watched:
+        summary += "\n" + "\n".join(sorted(watched)) + "\n"
+    try:
+        await message.reply_text((summary + f"\nTop {PROFILE_TOP_N} by cumulative time:\n" + table)[:4000])
+    except Exception as e:
+        print("profile report failed:", e)
+
+    name = f"profile_{int(time.time())}.prof"
+    fd, path = tempfile.mkstemp(suffix=".prof")
+    os.close(fd)
+    try:
+        stats.dump_stats(path)
+        with open(path, "rb") as f:
+            await message.reply_document(f, filename=name, caption="Raw stats: pstats.Stats('" + name + "')")
+    except Exception as e:
+        print("profile report failed:", e)
+    finally:
+        os.remove(path)
+
+async def lag_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    lines = [
+        f"Event loop lag over the last {len(loop_lags)} samples (ms):",
+        f"p50 {loop_lag_percentile(0.5) * 1000:.1f} | p95 {loop_lag_percentile(0.95) * 1000:.1f} | "
+        f"p99 {loop_lag_percentile(0.99) * 1000:.1f} | max since start {_lag_state['max'] * 1000:.0f}",
+        f"Stalls >= {LOOP_LAG_THRESHOLD * 1000:.0f}ms: {counters.get('loop_stalls', 0)}",
+    ]
+    if stall_sites:
+        lines.append("\nBlocking sites:")
+        for site, n in sorted(stall_sites.items(), key=lambda kv: -kv[1])[:10]:
+            lines.append(f"{n}x {site}")
+    if loop_stalls:
+        last = loop_stalls[-1]
+        when = datetime.fromtimestamp(last["ts"], IST_TZ).strftime("%m-%d %H:%M:%S")
+        lines.append(f"\nLast stall {when} IST, {last['lag']:.2f}s at {last['site']}:\n{last['stack'][-2500:]}")
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+# ------------------ MEMORY STATS ------------------
+# /memstats walks each runtime store and sums sys.getsizeof over everything it
+# references (each object counted once per store), so numbers are comparable
+# between runs. The per-user stores are views over `users`: their lines cover
+# only that field's values, and the `users` line is the whole registry. The
+# walk runs in the executor over shallow copies of each store's keys and values
+# taken on the loop, so a big registry never stalls update handling.
+_NOT_WALKED = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    """Bytes held by obj and everything reachable from it, skipping ids already in seen."""
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _NOT_WALKED):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset, deque)):
+            stack.extend(o)
+        elif not isinstance(o, (str, bytes, int, float, array)):
+            for cls in type(o).__mro__:
+                for name in getattr(cls, "__slots__", ()):
+                    if hasattr(o, name):
+                        stack.append(getattr(o, name))
+            if hasattr(o, "__dict__"):
+                stack.append(o.__dict__)
+    return total
+
+def _store_parts() -> list:
+    """(name, entries, container bytes, objects to walk) per store, taken on the loop.
+
+    Only shallow copies of the keys and values are made here; store_sizes()
+    walks them in the executor.
+    """
+    def keyed(name, store):
+        return (name, len(store), sys.getsizeof(store), [*store.keys(), *store.values()])
+
+    def values(name, store):
+        # views: the values live on UserState, the view object itself is a few bytes
+        return (name, len(store), 0, list(store.values()))
+
+    return [
+        keyed("users (all per-user state)", users),
+        values("user_history", user_history),
+        values("user_wallet", user_wallet),
+        values("active_user_messages", active_user_messages),
+        ("rate_limiter", len(rate_limiter), 0, [rate_limiter]),
+        keyed("movies_db", movies_db),
+        keyed("movie_variants", movie_variants),
+        keyed("facet_index", facet_index),
+        keyed("post_title", post_title),
+        keyed("search_sessions", search_sessions),
+        keyed("_AI_CACHE", _AI_CACHE),
+        keyed("alias_votes", alias_votes),
+        ("ledger_payloads", len(ledger_payloads), sys.getsizeof(ledger_payloads), list(ledger_payloads)),
+        keyed("redeem_codes", redeem_codes),
+        keyed("withdraw_requests", withdraw_requests),
+    ]
+
+def _measure_stores(parts: list) -> list:
+    rows = []
+    for name, entries, size, objects in parts:
+        seen = set()
+        try:
+            size += sum(deep_sizeof(o, seen) for o in objects)
+        except RuntimeError:
+            size = -1  # a nested container changed size while it was walked
+        rows.append((name, entries, size))
+    rows.sort(key=lambda r: -r[2])
+    return rows
+
+async def store_sizes() -> list:
+    """[(name, entries, bytes)] for the stores worth watching, biggest first; bytes is -1 if a store could not be measured."""
+    parts = _store_parts()
+    return await asyncio.get_running_loop().run_in_executor(_executor, _measure_stores, parts)
+
+def process_rss() -> tuple:
+    """(current, peak) resident set size in bytes from /proc; (0, 0) where unavailable."""
+    rss = peak = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return rss, peak
+
+def _fmt_bytes(n: int) -> str:
+    if n >= 1024 ** 2:
+        return f"{n / 1024 ** 2:.1f} MB"
+    return f"{n / 1024:.1f} KB"
+
+async def memstats_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/memstats [trace on|off]: deep size of the runtime stores, pending tasks, RSS and allocation sites."""
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    if context.args:
+        if len(context.args) == 2 and context.args[0] == "trace" and context.args[1] in ("on", "off"):
+            if context.args[1] == "on" and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            elif context.args[1] == "off" and tracemalloc.is_tracing():
+                tracemalloc.stop()
+            await update.message.reply_text(f"tracemalloc {'on' if tracemalloc.is_tracing() else 'off'}.")
+        else:
+            await update.message.reply_text("Usage: /memstats [trace on|off]")
+        return
+
+    started = time.perf_counter()
+    rows = await store_sizes()
+    took = time.perf_counter() - started
+
+    rss, peak = process_rss()
+    lines = [f"Process RSS: {_fmt_bytes(rss)} (peak {_fmt_bytes(peak)})" if rss else "Process RSS: n/a (no /proc)"]
+    lines.append(f"\nStores (entries | deep size), measured in {took:.2f}s:")
+    for name, entries, size in rows:
+        lines.append(f"{name}: {entries} | {_fmt_bytes(size) if size >= 0 else 'changed while measuring'}")
+
+    tasks = asyncio.all_tasks()
+    by_coro = {}
+    for task in tasks:
+        coro = task.get_coro()
+        name = getattr(coro, "__qualname__", type(coro).__name__)
+        by_coro[name] = by_coro.get(name, 0) + 1
+    lines.append(f"\nPending tasks: {len(tasks)}")
+    for name, n in sorted(by_coro.items(), key=lambda kv: -kv[1])[:MEMSTATS_TOP_N]:
+        lines.append(f"{n}x {name}")
+
+    if tracemalloc.is_tracing():
+        current, traced_peak = tracemalloc.get_traced_memory()
+        lines.append(f"\ntracemalloc: {_fmt_bytes(current)} traced (peak {_fmt_bytes(traced_peak)}). Top sites:")
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:MEMSTATS_TOP_N]:
+            frame = stat.traceback[0]
+            lines.append(f"{_fmt_bytes(stat.size)} in {stat.count} blocks: {os.path.basename(frame.filename)}:{frame.lineno}")
+    else:
+        lines.append("\ntracemalloc off (/memstats trace on to record allocation sites)")
+    await update.message.reply_text("\n".join(lines)[:4000])
+
+async def jobs_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    if len(context.args) == 2 and context.args[0] == "run":
+        if run_job_now(context.args[1]):
+            await update.message.reply_text(f"â Job {context.args[1]} queued to run now.")
+        else:
+            await update.message.reply_text("â Unknown job. See /jobs")
+        return
+    def fmt(ts):
+        return datetime.fromtimestamp(ts, IST_TZ).strftime("%m-%d %H:%M:%S") if ts else "never"
+    lines = ["Scheduled jobs (times IST):"]
+    for job in sorted(jobs.values(), key=lambda j: j.next_run):
+        if job.kind == "daily":
+            when = f"daily {job.hour:02d}:{job.minute:02d}"
+        elif job.kind == "interval":
+            when = f"every {job.interval:g}s"
+        else:
+            when = "once"
+        avg = job.total_duration / job.runs if job.runs else 0.0
+        lines.append(
+            f"\n{job.name} ({when}){' [running]' if job.running else ''}\n"
+            f"  next {fmt(job.next_run)} | last {fmt(job.last_run)} (late {job.last_late:.1f}s)\n"
+            f"  runs {job.runs}, failures {job.failures}, avg {avg * 1000:.0f}ms, max {job.max_duration * 1000:.0f}ms"
+        )
+        if job.last_error:
+            lines.append(f"  last error: {job.last_error}")
+    lines.append("\nUse /jobs run <name> to run a job now.")
+    await update.message.reply_text("\n".join(lines))
 
 async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
@@ -1122,11 +4200,12 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for p in hist["premium"][-10:]:
             dt = datetime.fromtimestamp(p["timestamp"]).strftime("%Y-%m-%d %H:%M")
             txt += f"- {dt}: {p['plan']} for {format_coins_rupees(p['paid_coins'])}\n"
-    if hist.get("earn"):
+    ledger = get_earn_ledger(uid)
+    if ledger:
         txt += "\nðª Earned:\n"
-        for e in hist["earn"][-10:]:
-            dt = datetime.fromtimestamp(e["timestamp"]).strftime("%Y-%m-%d %H:%M")
-            txt += f"- {dt}: +{e['amount']} ({e['reason']})\n"
+        for ts, amount, reason in ledger.recent(10):
+            dt = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M")
+            txt += f"- {dt}: +{amount} ({reason})\n"
     await update.message.reply_text(txt)
 
 async def withdraw_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1144,16 +4223,197 @@ async def withdraw_approve(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if req["status"] != "pending":
         await update.message.reply_text("â Already processed.")
         return
-    req["status"] = "approved"
+    decide_withdrawals([rid], "approved")
     save_all()
-    uid = req["user_id"]
-    amt = req["amount"]
-    try:
-        await context.bot.send_message(int(uid), f"â Your withdrawal of â¹{amt} approved.")
-    except Exception:
-        pass
+    enqueue_notification(context.bot, int(req["user_id"]), f"â Your withdrawal of â¹{req['amount']} approved.")
     await update.message.reply_text(f"â Withdrawal {rid} approved.")
 
+def build_pending_page(page: int):
+    total = len(withdraw_index["pending"])
+    pages = max(1, -(-total // PENDING_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    lines = [f"Pending withdrawals: {total} (page {page + 1}/{pages})"]
+    now = time.time()
+    for rid, req in pending_withdrawals(page * PENDING_PAGE_SIZE):
+        age_h = (now - req.get("timestamp", now)) / 3600
+        lines.append(f"\n{rid} | user {req['user_id']} | â¹{req['amount']} | {req.get('upi_id', '')} | {age_h:.1f}h ago")
+    if total:
+        lines.append("\nUse /approve <rid> [rid ...] or /reject <rid> [rid ...] (or 'all').")
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("< Prev", callback_data=f"wdpage:{page - 1}"))
+    if page < pages - 1:
+        nav.append(InlineKeyboardButton("Next >", callback_data=f"wdpage:{page + 1}"))
+    return "\n".join(lines), (InlineKeyboardMarkup([nav]) if nav else None)
+
+async def pending_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    try:
+        page = int(context.args[0]) - 1 if context.args else 0
+    except ValueError:
+        await update.message.reply_text("Usage: /pending [page]")
+        return
+    text, kb = build_pending_page(page)
+    await update.message.reply_text(text, reply_markup=kb)
+
+async def _bulk_decide(update: Update, context: ContextTypes.DEFAULT_TYPE, status: str):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    command = "approve" if status == "approved" else "reject"
+    if not context.args:
+        await update.message.reply_text(f"Usage: /{command} <rid> [rid ...] | /{command} all")
+        return
+    if context.args == ["all"]:
+        rids = [rid for _, rid in withdraw_index["pending"]]
+    else:
+        rids = list(dict.fromkeys(context.args))
+    decided, skipped = decide_withdrawals(rids, status)
+    if decided:
+        save_all()
+    for rid, req in decided:
+        if status == "approved":
+            text = f"â Your withdrawal of â¹{req['amount']} approved."
+        else:
+            text = f"â Your withdrawal of â¹{req['amount']} was rejected. The coins are back in your wallet."
+        enqueue_notification(context.bot, int(req["user_id"]), text)
+    msg = f"{status.capitalize()} {len(decided)} withdrawal(s)."
+    if skipped:
+        msg += f"\nSkipped (unknown or not pending): {', '.join(skipped[:20])}"
+        if len(skipped) > 20:
+            msg += f" and {len(skipped) - 20} more"
+    msg += f"\nPending now: {len(withdraw_index['pending'])}"
+    await update.message.reply_text(msg)
+
+async def approve_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _bulk_decide(update, context, "approved")
+
+async def reject_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _bulk_decide(update, context, "rejected")
+
+
+# ------------------ CHANNEL INGESTION QUEUE ------------------
+# handle_channel_post() only enqueues. INGEST_WORKERS workers normalize titles
+# concurrently and a single flusher applies finished titles to movies_db in
+# batches, persisting once per batch (off the event loop) instead of once per post.
+ingest_queue = None              # asyncio.Queue of (message_id, raw_caption, size, enqueued_ts); created by start_ingestion()
+ingest_pending = []              # normalized, not yet applied: (clean_title, variant, enqueued_ts)
+_ingest_enqueue_times = deque()  # enqueue timestamps of queued posts (FIFO, mirrors ingest_queue)
+_ingest_wakeup = None            # set when a full batch is ready
+_ingest_tasks = []
+ingest_stats = {
+    "enqueued": 0, "indexed": 0, "batches": 0, "failed": 0,
+    "last_batch_ts": 0.0, "last_lag": 0.0, "max_lag": 0.0,
+}
+
+def start_ingestion():
+    """Start the ingestion workers and flusher once per process (safe to call repeatedly)."""
+    global ingest_queue, _ingest_wakeup
+    if _ingest_tasks:
+        return
+    ingest_queue = asyncio.Queue()
+    _ingest_wakeup = asyncio.Event()
+    for i in range(INGEST_WORKERS):
+        _ingest_tasks.append(asyncio.create_task(ingest_worker(i)))
+    _ingest_tasks.append(asyncio.create_task(ingest_flusher()))
+    print(f"â Ingestion started ({INGEST_WORKERS} workers).")
+
+def enqueue_channel_post(message_id: int, raw_caption: str, size: int = 0):
+    if ingest_queue is None:
+        start_ingestion()
+    now = time.time()
+    _ingest_enqueue_times.append(now)
+    ingest_queue.put_nowait((message_id, raw_caption, size, now))
+    ingest_stats["enqueued"] += 1
+
+async def ingest_worker(worker_id: int):
+    while True:
+        message_id, raw_caption, size, enqueued_ts = await ingest_queue.get()
+        if _ingest_enqueue_times:
+            _ingest_enqueue_times.popleft()
+        try:
+            clean_title = await get_ai_clean_title(raw_caption)
+            if clean_title:
+                # quality usually only survives in the raw caption, the rest in the clean title
+                facets = parse_media_facets(raw_caption)
+                for k, v in parse_media_facets(clean_title).items():
+                    facets[k] = facets[k] or v
+                ingest_pending.append((clean_title, make_variant(message_id, facets, size), enqueued_ts))
+                if len(ingest_pending) >= INGEST_BATCH_SIZE:
+                    _ingest_wakeup.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            ingest_stats["failed"] += 1
+            print(f"â ï¸ ingest_worker {worker_id} failed on message {message_id}:", e)
+        finally:
+            ingest_queue.task_done()
+
+async def ingest_flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_ingest_wakeup.wait(), timeout=INGEST_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _ingest_wakeup.clear()
+        if not ingest_pending:
+            continue
+        try:
+            apply_ingest_pending()
+            # serialize a snapshot in a worker thread so searches keep running
+            snapshot = movie_records_snapshot()
+            await asyncio.get_running_loop().run_in_executor(None, save_json, MOVIES_DB_FILE, snapshot)
+        except Exception as e:
+            print("â ï¸ ingest_flusher error:", e)
+
+def apply_ingest_pending():
+    """Apply every normalized title waiting in ingest_pending to movies_db (no persistence)."""
+    if not ingest_pending:
+        return 0
+    batch = ingest_pending[:]
+    del ingest_pending[:]
+    now = time.time()
+    for clean_title, variant, _ in batch:
+        add_movie_variant(clean_title, variant)
+    lag = now - min(ts for _, _, ts in batch)
+    ingest_stats["indexed"] += len(batch)
+    ingest_stats["batches"] += 1
+    ingest_stats["last_batch_ts"] = now
+    ingest_stats["last_lag"] = lag
+    ingest_stats["max_lag"] = max(ingest_stats["max_lag"], lag)
+    print(f"ð¤ AI Auto-saved batch: {len(batch)} titles (lag {lag:.1f}s)")
+    return len(batch)
+
+async def aliases_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /aliases            - learned alias stats
+    # /aliases del <query> - forget an alias
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    args = context.args or []
+    if len(args) >= 2 and args[0] == "del":
+        q = normalize_title(" ".join(args[1:]))
+        if remove_alias(q):
+            save_json(ALIASES_FILE, aliases_snapshot())
+            await update.message.reply_text(f"â Alias '{q}' removed.")
+        else:
+            await update.message.reply_text("â Alias not found.")
+        return
+    total_hits = sum(alias_hits.values())
+    lines = [
+        "Learned aliases:\n",
+        f"Candidate queries: {len(alias_votes)}",
+        f"Promoted aliases: {len(alias_index)} (threshold {ALIAS_PROMOTE_THRESHOLD} votes, {int(ALIAS_MIN_SHARE * 100)}% share)",
+        f"Searches served by alias: {total_hits}",
+    ]
+    top = sorted(alias_index, key=lambda q: -alias_hits.get(q, 0))[:15]
+    if top:
+        lines.append("\nTop aliases:")
+        for q in top:
+            lines.append(f"{q} -> {movie_titles.get(alias_index[q], '?')} ({alias_hits.get(q, 0)} hits)")
+    await update.message.reply_text("\n".join(lines))
 
 async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.channel_post
@@ -1168,15 +4428,70 @@ async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE
             if not raw_caption and msg.document and getattr(msg.document, "file_name", None):
                 raw_caption = msg.document.file_name
 
-            clean_title = await get_ai_clean_title(raw_caption)
-            if clean_title:
-                key = clean_title.lower()
-                movies_db[key] = msg.message_id
-                save_json(MOVIES_DB_FILE, movies_db)
-                print(f"ð¤ AI Auto-saved: {clean_title} -> {msg.message_id}")
+            media = msg.video or msg.document or msg.audio
+            size = getattr(media, "file_size", 0) or 0
+
+            # only enqueue here; title normalization and persistence happen in the ingestion workers
+            enqueue_channel_post(msg.message_id, raw_caption, size)
     except Exception as e:
         print("â handle_channel_post error:", e)
+
+async def ingest_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /ingest - channel ingestion queue depth and lag (admin only)
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    now = time.time()
+    queued = ingest_queue.qsize() if ingest_queue else 0
+    queue_lag = now - _ingest_enqueue_times[0] if _ingest_enqueue_times else 0.0
+    pending_lag = now - min(ts for _, _, ts in ingest_pending) if ingest_pending else 0.0
+    last_batch = time.ctime(ingest_stats["last_batch_ts"]) if ingest_stats["last_batch_ts"] else "never"
+    await update.message.reply_text(
+        "Channel ingestion:\n\n"
+        f"Queued posts: {queued} (oldest waiting {queue_lag:.1f}s)\n"
+        f"Normalized, awaiting batch: {len(ingest_pending)} (oldest {pending_lag:.1f}s)\n"
+        f"Workers: {INGEST_WORKERS} | Batch size: {INGEST_BATCH_SIZE}\n\n"
+        f"Enqueued: {ingest_stats['enqueued']}\n"
+        f"Indexed: {ingest_stats['indexed']} in {ingest_stats['batches']} batches\n"
+        f"Failed: {ingest_stats['failed']}\n"
+        f"Last batch: {last_batch}\n"
+        f"Last batch lag: {ingest_stats['last_lag']:.1f}s | Max lag: {ingest_stats['max_lag']:.1f}s"
+    )
 # ------------------ MESSAGE (SEARCH) HANDLER ------------------
+async def credit_search(bot, user_id: str, query_raw: str):
+    """Coins, streak and rewards for one search (applied by the primary in multi-process mode)."""
+    # Referral reward on first search
+    for token, rec in referrals.items():
+        if user_id in rec.get("used_by", []):
+            owner = str(rec.get("owner"))
+            if rec.get("referral_completed", []) and user_id in rec["referral_completed"]:
+                break
+            owner_ledger = get_earn_ledger(owner)
+            rewarded = bool(owner_ledger) and owner_ledger.has_payload(EARN_REFERRAL, user_id)
+            if not rewarded:
+                add_coins(owner, 100, EARN_REFERRAL, user_id)
+                rec.setdefault("referral_completed", []).append(user_id)
+                referrals[token] = rec
+                save_json(REFERRALS_FILE, referrals)
+                try:
+                    await bot.send_message(int(owner), f"ð Your friend (ID: {user_id}) searched first movie! +100 coins added.")
+                except Exception:
+                    pass
+            break
+
+    # 1 coin per search
+    add_coins(user_id, 1, EARN_SEARCH, query_raw)
+
+    # daily and streak
+    streak = update_user_streak(user_id)
+    daily_given = check_and_give_daily_coins(user_id)
+    if daily_given:
+        try:
+            await bot.send_message(int(user_id), "ð You received +10 coins for today's first search!")
+        except Exception:
+            pass
+    check_jackpot_streak(user_id, streak)
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message is None:
         return
@@ -1185,7 +4500,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     user_id = str(update.effective_user.id)
     now = time.time()
-    expiry = user_access.get(user_id, 0)
+    state = get_user_state(user_id)
+    expiry = state.access_until if state else 0
     if expiry < now:
         kb = [
             [InlineKeyboardButton("Get Free 24h Access", url=FREE_ACCESS_URL)],
@@ -1194,97 +4510,70 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         await update.message.reply_text("â³ Your access expired. Get free 24h access or buy premium.", reply_markup=InlineKeyboardMarkup(kb))
         return
-    if user_id not in verified_users:
+    if not state.verified:
         kb = [
             [InlineKeyboardButton("ð° Join Channel", url=f"https://t.me/{CHANNEL_USERNAME}")],
             [InlineKeyboardButton("â Verify", callback_data="verify")]
         ]
         await update.message.reply_text("ð Join the channel and Verify to continue.", reply_markup=InlineKeyboardMarkup(kb))
         return
-    last = last_request_time.get(user_id, 0)
-    if now - last < USER_COOLDOWN:
-        await update.message.reply_text(f"â³ Please wait {int(USER_COOLDOWN - (now-last))}s before next request.")
+    wait = await backend_call(state_backend.take_cooldown, user_id, USER_COOLDOWN)
+    if wait > 0:
+        await update.message.reply_text(f"â³ Please wait {int(wait)}s before next request.")
         return
-    last_request_time[user_id] = now
     query_raw = (update.message.text or "").strip()
     query = normalize_title(query_raw)
     if not query:
         await update.message.reply_text("â Please type a movie name.")
         return
 
-    # Referral reward on first search
-    for token, rec in referrals.items():
-        if user_id in rec.get("used_by", []):
-            owner = str(rec.get("owner"))
-            if rec.get("referral_completed", []) and user_id in rec["referral_completed"]:
-                break
-            history_earn = user_history.get(owner, {}).get("earn", [])
-            rewarded = any(f"referral bonus to {user_id}" in e.get("reason", "") for e in history_earn)
-            if not rewarded:
-                add_coins(owner, 100, f"Referral bonus to {user_id}")
-                rec.setdefault("referral_completed", []).append(user_id)
-                referrals[token] = rec
-                save_json(REFERRALS_FILE, referrals)
-                try:
-                    await context.bot.send_message(int(owner), f"ð Your friend (ID: {user_id}) searched first movie! +100 coins added.")
-                except Exception:
-                    pass
-            break
-
-    # 1 coin per search
-    add_coins(user_id, 1, f"Movie search coin for '{query_raw}'")
+    # coins, streak and rewards are written by the primary only
+    if not send_to_primary("search_credit", user_id, query_raw):
+        await credit_search(context.bot, user_id, query_raw)
+
+    # exact match on the full title
+    inc("searches")
+    tid = movies_db.get(query)
+    text, facets = query_facet_keys(query)
+    if tid is None and not facets:
+        tid = movies_db.get(text)
+    if tid is not None:
+        inc("exact_hits")
+        await send_title_or_picker(context, update.effective_chat.id, user_id, tid, reply_to=update.message)
+        return
 
-    # daily and streak
-    streak = update_user_streak(user_id)
-    daily_given = check_and_give_daily_coins(user_id)
-    if daily_given:
-        try:
-            await context.bot.send_message(int(user_id), "ð You received +10 coins for today's first search!")
-        except Exception:
-            pass
-    check_jackpot_streak(user_id, streak)
+    # learned alias for a common misspelling (facets still narrow the picker)
+    tid = lookup_alias(text)
+    if tid is not None:
+        inc("alias_hits")
+        await send_title_or_picker(context, update.effective_chat.id, user_id, tid, reply_to=update.message, facets=facets)
+        return
 
-    # exact match
-    if query in movies_db:
-        msg_id = movies_db[query]
-        try:
-            try:
-                await context.bot.send_chat_action(update.effective_chat.id, "typing")
-            except Exception:
-                pass
-            sent = await context.bot.copy_message(chat_id=update.effective_chat.id, from_chat_id=CHANNEL_ID, message_id=msg_id)
-            if expiry > now:
-                record_sent_message_for_deletion(user_id, sent)
-                try:
-                    asyncio.create_task(delete_after(context, update.effective_chat.id, sent.message_id, user_id, delay=DELETE_DELAY))
-                except Exception as e:
-                    print("Failed to schedule delete:", e)
-                await context.bot.send_message(update.effective_chat.id, "â ï¸ This file will be deleted after 10 minutes. Forward to saved messages.")
-            else:
-                await context.bot.send_message(update.effective_chat.id, "ð You don't have active access. Use /start or get free access.")
-            return
-        except Exception as e:
-            print("Error copying exact-match:", e)
-            await update.message.reply_text("â Could not send file right now.")
+    # faceted query ("mirzapur s02 hindi"): narrow titles by intersecting facet posting sets
+    matches = []
+    if facets:
+        hits = faceted_title_hits(text, facets)
+        if len(hits) == 1:
+            inc("facet_hits")
+            await send_title_or_picker(context, update.effective_chat.id, user_id, hits[0], reply_to=update.message, facets=facets)
             return
+        matches = hits
+        if not matches:
+            facets = []
 
     # advanced hybrid search
-    matches = find_advanced_matches(query, movies_db.keys(), limit=25, score_cutoff=60)
+    if not matches:
+        matches = [movies_db[t] for t in find_advanced_matches(query, movies_db.keys(), limit=25, score_cutoff=60)]
+        if matches:
+            inc("fuzzy_hits")
+    elif matches:
+        inc("facet_hits")
     if matches:
         cleanup_search_sessions()
-        token = make_search_token()
-        search_sessions[token] = {"user_id": user_id, "suggestions": matches, "ts": now}
-        kb = []
-        # compress displayed text (shorten if too long)
-        for i, suggested in enumerate(matches[:25]):
-            text_display = suggested if len(suggested) < 60 else suggested[:57] + "..."
-            kb.append([InlineKeyboardButton(text_display, callback_data=f"confirm:{token}:{i}")])
-        kb.append([InlineKeyboardButton("ð Try Again", callback_data="try_again")])
-        # nicer premium-like message
-        await update.message.reply_text(
-            "ð Similar movies found:\n\nSelect one from below or try again:",
-            reply_markup=InlineKeyboardMarkup(kb)
-        )
+        token = create_search_session(user_id, text, facets, matches)
+        # nicer premium-like message, first page only; the rest is served from the session
+        msg_text, kb = build_suggestion_page(token, search_sessions[token], 0)
+        await update.message.reply_text(msg_text, reply_markup=kb)
     else:
         kb = [[InlineKeyboardButton("ð Try Again", callback_data="try_again")]]
         await update.message.reply_text(
@@ -1293,6 +4582,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "â³ If the movie name is correct but still not found, please wait a few minutes - it may be indexed soon.",
             reply_markup=InlineKeyboardMarkup(kb)
         )
+        inc("not_found")
         # notify admin about missing movie
         try:
             await context.bot.send_message(
@@ -1302,20 +4592,142 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             print("Failed to notify admin about missing movie:", e)
 
+# ------------------ EXPORTS ------------------
+# /export streams one dataset row by row from a generator through gzip into a
+# SpooledTemporaryFile (in memory up to EXPORT_SPOOL_BYTES, then an anonymous
+# temp file), so encoding stays flat however big the dataset is. The upload
+# itself is the compressed bytes (PTB holds a request body in memory anyway).
+# Only the key list is taken on the loop; rows are read and encoded in the
+# executor. The coin ledger is read from its append-only file up to the size
+# it had when the export started.
+EXPORT_COLUMNS = {
+    "movies": ("title", "title_id", "message_id", "quality", "size", "language", "season", "episode"),
+    "users": ("user_id", "wallet", "lifetime_earned", "lifetime_withdrawn", "withdrawn_rupees",
+              "access_until", "verified", "streak", "last_search_day"),
+    "ledger": ("seq", "ts", "kind", "debit", "credit", "amount", "memo"),
+    "codes": ("hint", "hours", "uses_left", "redeemed", "created_by", "created_at", "batch"),
+}
+EXPORT_FORMATS = ("csv", "jsonl")
+
+def _export_movie_rows(titles):
+    for key, tid in titles:
+        for v in list(movie_variants.get(tid, ())):
+            yield (key, tid) + tuple(v[:V_EPISODE + 1])
+
+def _export_user_rows(uids):
+    for uid in uids:
+        st = users.get(uid)
+        if st is None:
+            continue
+        yield (uid, st.wallet or 0, st.lifetime_earned, st.lifetime_withdrawn, st.withdrawn_rupees,
+               st.access_until, st.verified, st.streak, st.last_search_day)
+
+def _export_ledger_rows(size: int):
+    if not size:
+        return
+    with open(COIN_LEDGER_FILE, "rb") as f:
+        for line in f:
+            if f.tell() > size:
+                break  # appended after the export started
+            if line.strip():
+                yield tuple(json.loads(line))
+
+def _export_code_rows(items):
+    for _, entry in items:
+        yield (entry.get("hint", ""), entry.get("hours", 2), entry.get("uses_left", 0),
+               len(entry.get("redeemed_by") or ()), entry.get("created_by"),
+               entry.get("created_at", 0), entry.get("batch") or "")
+
+def export_rows(kind: str):
+    """Row generator for an export kind. Call on the loop: it captures the key set to export."""
+    if kind == "movies":
+        return _export_movie_rows(list(movies_db.items()))
+    if kind == "users":
+        return _export_user_rows(list(users))
+    if kind == "ledger":
+        try:
+            size = os.path.getsize(COIN_LEDGER_FILE)
+        except OSError:
+            size = 0
+        return _export_ledger_rows(size)
+    if kind == "codes":
+        return _export_code_rows(list(redeem_codes.items()))
+    raise ValueError(kind)
+
+def write_export(rows, columns, fmt: str):
+    """Encode rows into a gzip'd spooled buffer. Returns (buffer positioned at 0, row count)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    count = 0
+    # closing the wrapper closes the GzipFile (writing the trailer); a passed-in fileobj stays open
+    with io.TextIOWrapper(gzip.GzipFile(fileobj=spool, mode="wb"), encoding="utf-8", newline="") as out:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+                count += 1
+    spool.seek(0)
+    return spool, count
+
+async def send_export(message, kind: str, fmt: str = "csv", caption: str = ""):
+    rows = export_rows(kind)
+    spool, count = await asyncio.get_running_loop().run_in_executor(
+        _executor, write_export, rows, EXPORT_COLUMNS[kind], fmt)
+    name = f"{kind}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}.gz"
+    try:
+        # an in-memory spool has no .name, which PTB's InputFile needs for a file object
+        document = InputFile(spool.read(), filename=name)
+    finally:
+        spool.close()
+    await message.reply_document(document, caption=caption or f"{count} {kind} rows")
+    return count
+
+def short_listing(lines):
+    """Join lines into one message, or None once it would pass MESSAGE_TEXT_LIMIT (without building the rest)."""
+    out, size = [], 0
+    for line in lines:
+        size += len(line) + 1
+        if size > MESSAGE_TEXT_LIMIT:
+            return None
+        out.append(line)
+    return "\n".join(out)
+
+async def export_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    args = [a.lower() for a in context.args]
+    if not args or args[0] not in EXPORT_COLUMNS or (len(args) > 1 and args[1] not in EXPORT_FORMATS):
+        await update.message.reply_text(f"Usage: /export <{'|'.join(EXPORT_COLUMNS)}> [{'|'.join(EXPORT_FORMATS)}]")
+        return
+    try:
+        await send_export(update.message, args[0], args[1] if len(args) > 1 else "csv")
+    except Exception as e:
+        print("export error:", e)
+        await update.message.reply_text("â ï¸ Export failed.")
+
 # ------------------ ADMIN COMMANDS ------------------
+def format_catalog(catalog):
+    """Listing lines for /listmovies, generated lazily so short_listing() can stop early."""
+    yield "Indexed movies:\n"
+    if not catalog:
+        yield "(no movies indexed)"
+    for name, ids in catalog:
+        yield f"{name} -> {', '.join(map(str, ids))}"
+
 async def list_movies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
         await update.message.reply_text("â You are not allowed to use this command.")
         return
     try:
-        lines = [f"{name} -> {mid}" for name, mid in movies_db.items()]
-        text = "Indexed movies:\n\n" + ("\n".join(lines) if lines else "(no movies indexed)")
-        if len(text) > 4000:
-            path = "movies_list.txt"
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(text)
-            await update.message.reply_document(open(path, "rb"))
-            os.remove(path)
+        snap = await current_snapshot()
+        text = short_listing(format_catalog(snap.catalog))
+        if text is None:
+            await send_export(update.message, "movies", caption=f"{len(snap.catalog)} indexed movies")
         else:
             await update.message.reply_text(text)
     except Exception as e:
@@ -1330,9 +4742,8 @@ async def remove_movie(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /removemovie <name>")
         return
     name = normalize_title(" ".join(context.args))
-    if name in movies_db:
-        movies_db.pop(name, None)
-        save_json(MOVIES_DB_FILE, movies_db)
+    if remove_movie_title(name) or remove_movie_title(title_group_key(name)):
+        save_json(MOVIES_DB_FILE, movie_records_snapshot())
         await update.message.reply_text(f"â Removed '{name}' from index.")
     else:
         await update.message.reply_text("â Movie not found in index.")
@@ -1347,8 +4758,8 @@ async def index_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         mid = int(context.args[0])
         name = normalize_title(" ".join(context.args[1:]))
-        movies_db[name] = mid
-        save_json(MOVIES_DB_FILE, movies_db)
+        add_movie_variant(name, make_variant(mid, parse_media_facets(name)))
+        save_json(MOVIES_DB_FILE, movie_records_snapshot())
         await update.message.reply_text(f"â Indexed {name} -> {mid}")
     except Exception as e:
         print("index_message error:", e)
@@ -1412,10 +4823,23 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
         await update.message.reply_text("â You are not allowed to use this command.")
         return
-    total_users = len(user_access)
-    verified_count = len(verified_users)
-    total_movies = len(movies_db)
-    await update.message.reply_text(f"Users with access: {total_users}\nVerified users: {verified_count}\nIndexed movies: {total_movies}")
+    snap = await current_snapshot()
+    c = snap.counters
+    searches = c.get("searches", 0)
+    hits = sum(c.get(k, 0) for k in _HIT_COUNTERS)
+    hit_rate = f"{100 * hits / searches:.1f}%" if searches else "n/a"
+    hour_rate = f"{100 * snap.hits_hour / snap.searches_hour:.1f}%" if snap.searches_hour else "n/a"
+    await update.message.reply_text(
+        f"ð Stats ({snap.day}, snapshot {int(snap.age())}s old)\n\n"
+        f"Users: {snap.users_total} (active today: {snap.dau})\n"
+        f"Users with access: {snap.with_access}\nActive now: {snap.active_access}\nVerified users: {snap.verified}\n\n"
+        f"Searches last hour: {snap.searches_hour} (hit rate {hour_rate})\n"
+        f"Searches since start: {searches} (hit rate {hit_rate}, not found {c.get('not_found', 0)})\n\n"
+        f"Coins issued today: {snap.coins_today} ({snap.searchers_today} searchers)\n"
+        f"Coins in wallets: {format_coins_rupees(snap.wallet_total)}\n"
+        f"Pending withdrawals: {snap.pending_count} (â¹{snap.pending_rupees:.2f})\n\n"
+        f"Indexed movies: {len(snap.catalog)} ({snap.variants} files)"
+    )
 
 async def set_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Only admin can run this command
@@ -1438,10 +4862,11 @@ async def set_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Update or create the user's withdrawal record (stored in user_history)
     if user_id not in user_history:
-        user_history[user_id] = {"premium": [], "withdraw": [], "earn": []}
+        user_history[user_id] = {"premium": [], "withdraw": []}
 
     # Clear current withdrawal history and add a total record as a single entry
     user_history[user_id]["withdraw"] = [{"timestamp": time.time(), "amount": new_amount, "note": "Admin adjusted total withdrawal"}]
+    get_user_state(user_id, create=True).withdrawn_rupees = new_amount
 
     save_all()
 
@@ -1496,16 +4921,20 @@ async def chatbot(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Get message after /chatbot command
     args = context.args
+    everyone = bool(args) and args[0] == "--all"
+    if everyone:
+        args = args[1:]
     if not args:
-        await update.message.reply_text("Usage: /chatbot <message>")
+        await update.message.reply_text("Usage: /chatbot [--all] <message>\n(default: only users whose access is active; --all: every user with an access entry)")
         return
 
     message_text = " ".join(args)
     
-    # Send message to all users who have access
+    # Send message to users with active access (or every access entry with --all)
     sent_count = 0
     failed_count = 0
-    for user_id in user_access.keys():
+    targets = list(user_access.keys()) if everyone else active_access_users()
+    for user_id in targets:
         try:
             await context.bot.send_message(chat_id=int(user_id), text=message_text)
             sent_count += 1
@@ -1610,15 +5039,18 @@ async def dash_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def send_user_dash(user_id: str, context: ContextTypes.DEFAULT_TYPE, source):
     # Build dashboard text and keyboard
     wallet_balance = user_wallet.get(user_id, 0)
+    st = get_user_state(user_id)
     streak_info = user_streak.get(user_id, {"streak": 0})
     streak = streak_info.get("streak", 0)
-    history = get_user_history(user_id)
+    ledger = get_earn_ledger(user_id)
 
     text_lines = [
         f"ð Dashboard for user ID: {user_id}",
         f"ð° Wallet Balance: {wallet_balance} coins",
+        f"Lifetime Earned: {st.lifetime_earned if st else 0} coins",
+        f"Lifetime Withdrawn: {st.lifetime_withdrawn if st else 0} coins",
         f"ð¥ Current Streak: {streak} days",
-        f"ð History Records: {len(history.get('earn', []))}",
+        f"ð History Records: {len(ledger) if ledger else 0}",
     ]
     text = "\n".join(text_lines)
 
@@ -1637,14 +5069,60 @@ async def send_user_dash(user_id: str, context: ContextTypes.DEFAULT_TYPE, sourc
         if chat_id:
             await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=kb)
 
-# --- REDEEM CODES PERSISTENCE (add near top with other FILE constants) ---
+# ------------------ REDEEM CODES ------------------
+# Codes are stored by SHA-256 hash, never in plain text:
+# sha256(code) -> {"hint": "AB***", "hours": int, "uses_left": int, "created_by": str,
+#                  "created_at": ts, "batch": str | None, "redeemed_by": set(user_ids)}
+# redeemed_by is a set in memory (constant-time reuse check) and a list on disk.
+GENCODES_MAX = 10000      # codes per /gencodes call
+GENCODE_LENGTH = 10
+GENCODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # no 0/O/1/I
 
+def hash_code(code: str) -> str:
+    return hashlib.sha256(code.strip().encode("utf-8")).hexdigest()
 
-# Load redeem codes (structure: code -> {"hours": int, "uses_left": int, "created_by": str, "created_at": ts, "redeemed_by": [user_ids]})
+def code_hint(code: str) -> str:
+    return code[:2] + "***"
 
+def new_code_entry(code: str, hours: int, uses: int, created_by: str, batch=None) -> dict:
+    return {
+        "hint": code_hint(code),
+        "hours": hours,
+        "uses_left": uses,
+        "created_by": created_by,
+        "created_at": time.time(),
+        "batch": batch,
+        "redeemed_by": set(),
+    }
+
+def load_redeem_codes():
+    data = load_json(REDEEM_CODES_FILE, {})
+    if data.get("version") == 2:
+        for key, entry in data.get("codes", {}).items():
+            entry["redeemed_by"] = set(entry.get("redeemed_by", []))
+            redeem_codes[key] = entry
+        return
+    # Legacy file: plain code -> entry with redeemed_by as [{"user_id", "ts"}]
+    for code, entry in data.items():
+        entry["hint"] = code_hint(code)
+        entry["redeemed_by"] = {str(r.get("user_id")) if isinstance(r, dict) else str(r)
+                                for r in entry.get("redeemed_by", [])}
+        redeem_codes[hash_code(code)] = entry
+    if data:
+        print(f"â Migrated {len(data)} redeem codes to hashed storage.")
+        save_redeem_codes()
+
+def redeem_codes_snapshot():
+    return {
+        "version": 2,
+        "codes": {key: dict(entry, redeemed_by=sorted(entry["redeemed_by"]))
+                  for key, entry in redeem_codes.items()},
+    }
 
 def save_redeem_codes():
-    save_json(REDEEM_CODES_FILE, redeem_codes)
+    save_json(REDEEM_CODES_FILE, redeem_codes_snapshot())
+
+load_redeem_codes()
 
 # ------------------ /redeem command ------------------
 async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1661,18 +5139,13 @@ async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Usage: /redeem <code>")
         return
     code = args[0].strip()
-    entry = redeem_codes.get(code)
+    entry = redeem_codes.get(hash_code(code))
     if not entry:
         await update.message.reply_text("â Invalid code.")
         return
 
     # Check if user already used this code
-    already_used = False
-    for record in entry.get("redeemed_by", []):
-        if record.get("user_id") == user_id:
-            already_used = True
-            break
-    if already_used:
+    if user_id in entry["redeemed_by"]:
         await update.message.reply_text("â ï¸ Youâve already used this code.")
         return
 
@@ -1696,8 +5169,7 @@ async def redeem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Update code usage data
     entry["uses_left"] = max(0, uses_left - 1)
-    entry.setdefault("redeemed_by", []).append({"user_id": user_id, "ts": time.time()})
-    redeem_codes[code] = entry
+    entry["redeemed_by"].add(user_id)
 
     save_json(USER_ACCESS_FILE, user_access)
     save_redeem_codes()
@@ -1736,16 +5208,43 @@ async def addcode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             uses = int(context.args[2])
         except:
             uses = 1
-    redeem_codes[code] = {
-        "hours": hours,
-        "uses_left": uses,
-        "created_by": str(update.effective_user.id),
-        "created_at": time.time(),
-        "redeemed_by": []
-    }
+    redeem_codes[hash_code(code)] = new_code_entry(code, hours, uses, str(update.effective_user.id))
     save_redeem_codes()
     await update.message.reply_text(f"â Code '{code}' added: {hours} hour(s), uses={uses}.")
 
+async def gencodes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /gencodes <n> <hours> [uses]
+    if update.effective_user.id != ADMIN_USER_ID:
+        await update.message.reply_text("â Not allowed.")
+        return
+    try:
+        count = int(context.args[0])
+        hours = int(context.args[1])
+        uses = int(context.args[2]) if len(context.args) >= 3 else 1
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /gencodes <n> <hours> [uses]")
+        return
+    if not 1 <= count <= GENCODES_MAX or hours <= 0 or uses <= 0:
+        await update.message.reply_text(f"â n must be 1-{GENCODES_MAX}; hours and uses must be positive.")
+        return
+    batch = uuid.uuid4().hex[:8]
+    created_by = str(update.effective_user.id)
+    codes = []
+    while len(codes) < count:
+        code = "".join(secrets.choice(GENCODE_ALPHABET) for _ in range(GENCODE_LENGTH))
+        key = hash_code(code)
+        if key in redeem_codes:
+            continue
+        redeem_codes[key] = new_code_entry(code, hours, uses, created_by, batch)
+        codes.append(code)
+    save_redeem_codes()
+    # The plain codes only exist in this file
+    await update.message.reply_document(
+        ("\n".join(codes) + "\n").encode("utf-8"),
+        filename=f"codes_{batch}.txt",
+        caption=f"â {count} codes (batch {batch}): {hours} hour(s), uses={uses} each.",
+    )
+
 async def listcodes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
         await update.message.reply_text("â Not allowed.")
@@ -1753,17 +5252,15 @@ async def listcodes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not redeem_codes:
         await update.message.reply_text("(no redeem codes)")
         return
-    lines = []
-    for code, entry in redeem_codes.items():
-        lines.append(f"{code} â {entry.get('hours',2)}h | uses_left={entry.get('uses_left',0)} | created_by={entry.get('created_by')}")
+    lines = (
+        f"{entry.get('hint', key[:8])} â {entry.get('hours',2)}h | uses_left={entry.get('uses_left',0)} | created_by={entry.get('created_by')}"
+        + (f" | batch={entry['batch']}" if entry.get("batch") else "")
+        for key, entry in list(redeem_codes.items())
+    )
     # if too long, send as file
-    text = "\n".join(lines)
-    if len(text) > 4000:
-        path = "redeem_codes_list.txt"
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(text)
-        await update.message.reply_document(open(path, "rb"))
-        os.remove(path)
+    text = short_listing(lines)
+    if text is None:
+        await send_export(update.message, "codes", caption=f"{len(redeem_codes)} redeem codes")
     else:
         await update.message.reply_text(text)
 
@@ -1775,59 +5272,95 @@ async def removecode_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Usage: /removecode <code>")
         return
     code = context.args[0].strip()
-    if code in redeem_codes:
-        redeem_codes.pop(code, None)
+    key = hash_code(code)
+    if key in redeem_codes:
+        redeem_codes.pop(key, None)
         save_redeem_codes()
         await update.message.reply_text(f"â Removed code {code}.")
     else:
         await update.message.reply_text("â Code not found.")
 # ------------------ RUN BOT ------------------
+def build_application(updater: bool = True, bot=None):
+    """Application with every handler registered; updater=False for workers fed by the dispatcher.
+
+    bot replaces the Bot built from BOT_TOKEN (loadtest.py passes its stand-in).
+    """
+    builder = ApplicationBuilder().token(BOT_TOKEN) if bot is None else ApplicationBuilder().bot(bot)
+    if not updater:
+        builder = builder.updater(None)
+    app = builder.build()
+
+    # Register handlers
+    app.add_handler(TypeHandler(Update, rate_limit_gate), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("plans", plans))
+    app.add_handler(CommandHandler("grant", grant))
+    app.add_handler(CommandHandler("listmovies", list_movies))
+    app.add_handler(CommandHandler("removemovie", remove_movie))
+    app.add_handler(CommandHandler("index", index_message))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("history", history_command))
+    app.add_handler(CommandHandler("leaderboard", send_leaderboard))
+    app.add_handler(CommandHandler("dashboard", lambda u,c: send_user_dashboard(str(u.effective_user.id), c, None)))
+    app.add_handler(CommandHandler("wallet", wallet_admin))
+    app.add_handler(CommandHandler("activity", activity_admin))
+    app.add_handler(CommandHandler("withdraw", withdraw_approve))
+    app.add_handler(CommandHandler("pending", pending_admin))
+    app.add_handler(CommandHandler("approve", approve_admin))
+    app.add_handler(CommandHandler("reject", reject_admin))
+    app.add_handler(CommandHandler("dashboard", user_dashboard_admin))
+    app.add_handler(CommandHandler("setwithdrawal", set_withdrawal))
+    app.add_handler(CommandHandler("refer", refer))
+    app.add_handler(CommandHandler("chatbot", chatbot))
+    app.add_handler(CommandHandler("record", record_command))
+    app.add_handler(CommandHandler("userrecord", userrecord_command))
+    app.add_handler(CommandHandler("dash", dash_command))
+    app.add_handler(CommandHandler("redeem", redeem_command))
+    app.add_handler(CommandHandler("addcode", addcode_command))
+    app.add_handler(CommandHandler("listcodes", listcodes_command))
+    app.add_handler(CommandHandler("export", export_admin))
+    app.add_handler(CommandHandler("removecode", removecode_command))
+    app.add_handler(CommandHandler("gencodes", gencodes_command))
+    app.add_handler(CommandHandler("ingest", ingest_admin))
+    app.add_handler(CommandHandler("aliases", aliases_admin))
+    app.add_handler(CommandHandler("compact", compact_admin))
+    app.add_handler(CommandHandler("verifyledger", verifyledger_admin))
+    app.add_handler(CommandHandler("jobs", jobs_admin))
+    app.add_handler(CommandHandler("perf", perf_admin))
+    app.add_handler(CommandHandler("profile", profile_admin))
+    app.add_handler(CommandHandler("lag", lag_admin))
+    app.add_handler(CommandHandler("memstats", memstats_admin))
+    app.add_handler(CommandHandler("ratelimits", ratelimits_admin))
+
+    app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(InlineQueryHandler(inline_query))
+
+    # Channel posts (media) - index media posted in channel
+    app.add_handler(MessageHandler(filters.ALL & (filters.VIDEO | filters.Document.ALL | filters.PHOTO | filters.AUDIO), handle_channel_post))
+    # User messages (search)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    instrument_handlers(app)
+    return app
+
 async def run_bot():
     while True:
         try:
-            app = ApplicationBuilder().token(BOT_TOKEN).build()
-
-            # Register handlers
-            app.add_handler(CommandHandler("start", start))
-            app.add_handler(CommandHandler("plans", plans))
-            app.add_handler(CommandHandler("grant", grant))
-            app.add_handler(CommandHandler("listmovies", list_movies))
-            app.add_handler(CommandHandler("removemovie", remove_movie))
-            app.add_handler(CommandHandler("index", index_message))
-            app.add_handler(CommandHandler("help", help_command))
-            app.add_handler(CommandHandler("stats", stats))
-            app.add_handler(CommandHandler("history", history_command))
-            app.add_handler(CommandHandler("leaderboard", send_leaderboard))
-            app.add_handler(CommandHandler("dashboard", lambda u,c: send_user_dashboard(str(u.effective_user.id), c, None)))
-            app.add_handler(CommandHandler("wallet", wallet_admin))
-            app.add_handler(CommandHandler("activity", activity_admin))
-            app.add_handler(CommandHandler("withdraw", withdraw_approve))
-            app.add_handler(CommandHandler("dashboard", user_dashboard_admin))
-            app.add_handler(CommandHandler("setwithdrawal", set_withdrawal))
-            app.add_handler(CommandHandler("refer", refer))
-            app.add_handler(CommandHandler("chatbot", chatbot))
-            app.add_handler(CommandHandler("record", record_command))
-            app.add_handler(CommandHandler("userrecord", userrecord_command))
-            app.add_handler(CommandHandler("dash", dash_command))
-            app.add_handler(CommandHandler("redeem", redeem_command))
-            app.add_handler(CommandHandler("addcode", addcode_command))
-            app.add_handler(CommandHandler("listcodes", listcodes_command))
-            app.add_handler(CommandHandler("removecode", removecode_command))
-
-            app.add_handler(CallbackQueryHandler(button_handler))
-
-            # Channel posts (media) - index media posted in channel
-            app.add_handler(MessageHandler(filters.ALL & (filters.VIDEO | filters.Document.ALL | filters.PHOTO | filters.AUDIO), handle_channel_post))
-            # User messages (search)
-            app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+            app = build_application()
+            await start_metrics_server()
+            start_loop_monitor(app.bot)
 
             # Index channel history once (best-effort)
             await index_old_channel_messages(app)
 
-            # Start leaderboard scheduler
+            # Background channel ingestion (no-op if already running from a previous retry)
+            start_ingestion()
+            start_notification_sender(app.bot)
+
+            # Start the job scheduler (only the first attempt creates the task)
             try:
-                asyncio.create_task(schedule_daily_leaderboard_rewards(app))
-                print("â Leaderboard scheduler started.")
+                if start_scheduler(app):
+                    print(f"â Scheduler started ({len(jobs)} jobs).")
             except Exception as e:
                 print("â ï¸ Failed to start scheduler:", e)
 
@@ -1847,7 +5380,297 @@ async def run_bot():
             print("ð¥ Unknown error:", e)
             await asyncio.sleep(10)
 
-if __name__ == "__main__":
+# ------------------ WORKER PROCESSES ------------------
+# Multi-process mode: the dispatcher (main process) receives Telegram's webhook
+# POSTs and hands each update to one worker process through a bounded queue.
+# The read-mostly search path - plain-text searches, suggestion/picker buttons
+# and inline queries - is spread over every worker by user id, so one user's
+# searches always land on the same worker. Commands, other buttons, channel
+# posts, admin updates and users in the middle of a conversation (withdraw flow)
+# go to worker 0, the primary, which also runs ingestion and the scheduler and
+# is the single writer of all state (see SHARED STATE STORE).
+SEARCH_CALLBACK_PREFIXES = ("page:", "confirm:", "variant:", "facet:", "get:")
+SEARCH_CALLBACKS = ("try_again", "noop")
+_conversation_users = set()  # primary: users currently flagged as mid-conversation
+
+def route_update(data: dict, conversations: set, workers: int) -> int:
+    """Worker number for one raw webhook update; conversations holds the users mid-conversation on the primary."""
+    msg = data.get("message")
+    if msg is not None:
+        uid = (msg.get("from") or {}).get("id")
+        text = msg.get("text") or ""
+        if (uid and uid != ADMIN_USER_ID and (msg.get("chat") or {}).get("type") == "private"
+                and text and not text.startswith("/") and uid not in conversations):
+            return uid % workers
+        return 0
+    cq = data.get("callback_query")
+    if cq is not None:
+        cb = cq.get("data") or ""
+        uid = cq["from"]["id"]
+        if uid != ADMIN_USER_ID and (cb.startswith(SEARCH_CALLBACK_PREFIXES) or cb in SEARCH_CALLBACKS):
+            return uid % workers
+        return 0
+    iq = data.get("inline_query")
+    if iq is not None:
+        return iq["from"]["id"] % workers
+    return 0
+
+def sync_user_from_shared(user_id: int):
+    """Search workers: refresh a user's access/verification from the primary before handling their update."""
+    row = shared_store.read_user(user_id)
+    st = get_user_state(user_id, create=row is not None)
+    if row is not None:
+        st.access_until, st.verified = float(row[0] or 0), bool(row[1])
+
+def publish_all_users():
+    rows = [(uid, st.access_until, int(st.verified)) for uid, st in users.items() if st.access_until or st.verified]
+    shared_store.publish_users(rows)
+    return len(rows)
+
+def apply_catalog_change(op: str, key: str, value):
+    if op == "add":
+        add_movie_variant(key, value)
+    elif op == "remove":
+        remove_movie_title(key)
+    elif op == "alias" and value in movies_db:
+        alias_index[key] = movies_db[value]
+    elif op == "unalias":
+        alias_index.pop(key, None)
+
+async def apply_shared_op(bot, op: str, args: list):
+    if op == "search_credit":
+        await credit_search(bot, *args)
+    elif op == "popularity":
+        # title ids are per process; workers send the channel message id
+        if int(args[0]) in post_title:
+            bump_title_popularity(post_title[int(args[0])])
+    elif op == "alias_vote":
+        if args[1] in movies_db:
+            record_alias_vote(args[0], movies_db[args[1]])
+    else:
+        print(f"â ï¸ Unknown shared op {op!r}")
+
+async def shared_sync_loop(bot):
+    """Primary: apply ops sent by the search workers. Search workers: follow the catalog feed."""
+    catalog_seq = 0
+    last_prune = 0.0
+    while True:
+        await asyncio.sleep(SHARED_POLL_INTERVAL)
+        try:
+            if WORKER_ID:
+                for seq, op, key, value in shared_store.catalog_since(catalog_seq):
+                    apply_catalog_change(op, key, value)
+                    catalog_seq = seq
+                continue
+            # drain the queue; one save_all() per batch of ops instead of one per credited search
+            while True:
+                ops = shared_store.take_ops()
+                if not ops:
+                    break
+                with batched_saves():
+                    for op, args in ops:
+                        # taken ops are already deleted, so one failure must not drop the rest of the batch
+                        try:
+                            await apply_shared_op(bot, op, args)
+                        except Exception as e:
+                            print(f"â ï¸ Shared op {op} {args!r} failed:", e)
+                await asyncio.sleep(0)
+            now = time.time()
+            if now - last_prune > 3600:
+                # older changes are in MOVIES_DB_FILE, which workers load at start
+                shared_store.prune_catalog(now - CATALOG_FEED_RETENTION)
+                last_prune = now
+        except Exception as e:
+            print("â ï¸ Shared store sync failed:", e)
+
+async def publish_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Primary, after every update: flag users mid-withdraw so the dispatcher keeps their text here."""
+    user = update.effective_user
+    if user is None or context.user_data is None:
+        return
+    active = bool(context.user_data.get("withdraw"))
+    if active != (user.id in _conversation_users):
+        shared_store.set_conversation(user.id, active)
+        if active:
+            _conversation_users.add(user.id)
+        else:
+            _conversation_users.discard(user.id)
+
+async def run_worker(inbox):
+    global shared_store, METRICS_PORT
+    shared_store = SharedStore(SHARED_STATE_DB)
+    if METRICS_PORT:
+        METRICS_PORT += WORKER_ID
+    app = build_application(updater=False)
+    if not WORKER_ID:
+        app.add_handler(TypeHandler(Update, publish_conversation), group=1)
+    await app.initialize()
+    await app.start()
+    await start_metrics_server()
+    start_loop_monitor(app.bot)
+    start_notification_sender(app.bot)
+    if not WORKER_ID:
+        shared_store.clear_conversations()
+        print(f"â Published access for {publish_all_users()} users.")
+        await index_old_channel_messages(app)
+        start_ingestion()
+        if start_scheduler(app):
+            print(f"â Scheduler started ({len(jobs)} jobs).")
+    asyncio.create_task(shared_sync_loop(app.bot))
+    print(f"â Worker {WORKER_ID}/{WORKER_COUNT} running (pid {os.getpid()}).")
+
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, inbox.get)
+        if data is None:
+            break
+        try:
+            update = Update.de_json(data, app.bot)
+        except Exception as e:
+            print("â ï¸ Bad update from dispatcher:", e)
+            continue
+        if WORKER_ID and update.effective_user:
+            sync_user_from_shared(update.effective_user.id)
+        await app.update_queue.put(update)
+    await app.stop()
+    await app.shutdown()
+
+def worker_main(inbox):
+    """Entry point of a worker process; its number comes from BOT_WORKER_ID."""
+    try:
+        asyncio.run(run_worker(inbox))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if not WORKER_ID:
+            print("â¹ï¸ Primary stopping, saving data...")
+            apply_ingest_pending()
+            save_all()
+
+async def _serve_webhook(reader, writer, path: str, secret: str, inboxes: list, conversations: set):
+    try:
+        while True:
+            request_line = (await asyncio.wait_for(reader.readline(), 75)).decode("latin-1")
+            if not request_line.strip():
+                break
+            headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), 5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            method, _, rest = request_line.partition(" ")
+            try:
+                length = int(headers.get("content-length", 0) or 0)
+            except ValueError:
+                length = -1
+            # everything is checked before the body is read; a refused body is never
+            # read, so those answers close the connection
+            if method != "POST" or rest.split(" ")[0] != path:
+                status = "404 Not Found"
+            elif not secrets.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), secret):
+                status = "403 Forbidden"
+            elif length < 0:
+                status = "400 Bad Request"
+            elif length > WEBHOOK_MAX_BODY:
+                status = "413 Payload Too Large"
+            else:
+                status = None
+            if status is not None:
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode("latin-1"))
+                await writer.drain()
+                break
+            body = await reader.readexactly(length) if length else b""
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise ValueError("update is not an object")
+            except ValueError:
+                status = "400 Bad Request"
+            else:
+                worker = route_update(data, conversations, len(inboxes))
+                try:
+                    inboxes[worker].put_nowait(data)
+                    status = "200 OK"
+                except queue.Full:
+                    # Telegram redelivers on non-2xx, which is the backpressure we want
+                    status = "503 Service Unavailable"
+                    print(f"â ï¸ Worker {worker} queue full; update {data.get('update_id')} deferred.")
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    except Exception as e:
+        print("webhook request failed:", e)
+    finally:
+        writer.close()
+
+def run_dispatcher():
+    """Multi-process mode: spawn WORKER_PROCESSES workers and feed them from the webhook."""
+    mp = multiprocessing.get_context("spawn")
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    inboxes = [mp.Queue(DISPATCH_QUEUE_SIZE) for _ in range(WORKER_PROCESSES)]
+    procs = [None] * WORKER_PROCESSES
+
+    def spawn(i: int):
+        # the worker's number must be known while it imports this file (load-time saves)
+        os.environ["BOT_WORKER_ID"], os.environ["BOT_WORKER_COUNT"] = str(i), str(WORKER_PROCESSES)
+        try:
+            procs[i] = mp.Process(target=worker_main, args=(inboxes[i],), name=f"bot-worker-{i}", daemon=True)
+            procs[i].start()
+        finally:
+            del os.environ["BOT_WORKER_ID"], os.environ["BOT_WORKER_COUNT"]
+
+    async def follow_conversations(store: SharedStore, conversations: set):
+        # routing reads this set; only the (indexed) flagged rows are fetched
+        while True:
+            await asyncio.sleep(SHARED_POLL_INTERVAL)
+            try:
+                current = store.conversation_users()
+            except sqlite3.Error as e:
+                print("â ï¸ Conversation refresh failed:", e)
+                continue
+            conversations.intersection_update(current)
+            conversations.update(current)
+
+    async def serve():
+        store = SharedStore(SHARED_STATE_DB)
+        conversations = store.conversation_users()
+        asyncio.create_task(follow_conversations(store, conversations))
+        path = urlsplit(WEBHOOK_URL).path or "/"
+        handler = functools.partial(_serve_webhook, path=path, secret=secret, inboxes=inboxes, conversations=conversations)
+        await asyncio.start_server(handler, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        while True:
+            try:
+                async with Bot(BOT_TOKEN) as tg:
+                    await tg.set_webhook(WEBHOOK_URL, secret_token=secret, max_connections=WEBHOOK_MAX_CONNECTIONS,
+                                         allowed_updates=Update.ALL_TYPES)
+                break
+            except TelegramError as e:
+                print("â ï¸ setWebhook failed, retrying in 10s:", e)
+                await asyncio.sleep(10)
+        print(f"â Dispatcher on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{path} -> {WORKER_PROCESSES} workers")
+        while True:
+            await asyncio.sleep(5)
+            for i, p in enumerate(procs):
+                if not p.is_alive():
+                    print(f"â ï¸ Worker {i} exited with code {p.exitcode}; restarting.")
+                    spawn(i)
+
+    for i in range(WORKER_PROCESSES):
+        spawn(i)
+    try:
+        asyncio.run(serve())
+    finally:
+        for box in inboxes:
+            box.put(None)
+        for p in procs:
+            p.join(10)
+
+if __name__ == "__main__" and WEBHOOK_URL and WORKER_PROCESSES > 1:
+    run_dispatcher()
+elif __name__ == "__main__":
     try:
         import nest_asyncio
         nest_asyncio.apply()
@@ -1858,4 +5681,5 @@ if __name__ == "__main__":
         loop.run_forever()
     except KeyboardInterrupt:
         print("⏹️ Stopping bot, saving data...")
+        apply_ingest_pending()
         save_all()
@@ -0,0 +1,541 @@
+# loadtest.py
+# Offline load test for bot.py: feeds synthetic Updates (searches, result
+# pages, picks and channel posts) to the bot's real Application - the same
+# handlers, rate-limit gate and one-at-a-time processing as in production -
+# with a stand-in Bot that records every API call, simulates network latency
+# and answers with RetryAfter when its flood limit is exceeded (or at random).
+# No Telegram or Gemini traffic is made. --direct instead calls the handlers
+# directly, one task per update, to measure the handlers without the pipeline.
+#
+#   python loadtest.py --rate 2000 --duration 20
+#   python loadtest.py --rate 500 --duration 60 --api-limit 30 --latency-ms 80
+#
+# bot.py loads and saves its JSON state in the working directory, so the test
+# runs in a scratch directory (--data-dir, default a fresh temp dir).
+# --state-backend resp points the bot's state backend at FakeRespServer.
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram import Chat, CallbackQuery, Document, Message, Update, User
+from telegram.error import RetryAfter
+
+WORDS = ("dark", "night", "king", "river", "shadow", "city", "love", "war", "storm", "ghost",
+         "empire", "secret", "last", "blood", "ocean", "fire", "star", "lost", "iron", "silent")
+QUALITIES = ("480p", "720p", "1080p")
+LANGUAGES = ("hindi", "english", "tamil")
+
+bot = None   # bot.py, imported by main() once the scratch directory is in place
+
+
+# ------------------ STAND-IN BOT API ------------------
+class LoadTestBot:
+    """
+    Accepts any Bot API method. Each call sleeps for a simulated round trip and
+    is counted; calls beyond api_limit per second (or a random retry_rate share
+    of them) raise RetryAfter like Telegram's flood control does.
+    """
+    defaults = None   # read by Message.reply_text() like ExtBot.defaults
+
+    def __init__(self, latency_ms: float, retry_rate: float, api_limit: int, retry_after: int):
+        self.latency = latency_ms / 1000.0
+        self.retry_rate = retry_rate
+        self.api_limit = api_limit
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.retries = Counter()
+        self.deliveries = 0
+        self._window = 0
+        self._window_calls = 0
+        self._next_id = 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        async def call(*args, **kwargs):
+            return await self._call(method, kwargs)
+        return call
+
+    def _flooded(self) -> bool:
+        now = int(time.monotonic())
+        if now != self._window:
+            self._window, self._window_calls = now, 0
+        self._window_calls += 1
+        if self.api_limit and self._window_calls > self.api_limit:
+            return True
+        return self.retry_rate > 0 and random.random() < self.retry_rate
+
+    async def _call(self, method: str, kwargs: dict):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(random.expovariate(1.0 / self.latency))
+        if self._flooded():
+            self.retries[method] += 1
+            raise RetryAfter(self.retry_after)
+        self._next_id += 1
+        if method == "copy_message":
+            self.deliveries += 1
+        if method == "get_chat_member":
+            return SimpleNamespace(status="member")
+        return SimpleNamespace(message_id=self._next_id, chat=SimpleNamespace(id=kwargs.get("chat_id")))
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+# ------------------ STAND-IN REDIS ------------------
+class FakeRespServer(socketserver.ThreadingTCPServer):
+    """
+    In-process Redis-protocol server with just the commands RespStateBackend
+    uses, so --state-backend resp runs without a real server.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRespHandler)
+        self.data = {}      # key -> str | dict | {member: score} (sorted sets)
+        self.expires = {}   # key -> monotonic deadline
+        self.lock = threading.Lock()
+        self.commands = Counter()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def _live(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def run(self, args: list):
+        """Execute one command; args are the raw bulk strings."""
+        cmd = args[0].decode().upper()
+        self.commands[cmd] += 1
+        with self.lock:
+            if cmd in ("PING", "AUTH", "SELECT"):
+                return "+PONG" if cmd == "PING" else "+OK"
+            key = args[1] if len(args) > 1 else b""
+            value = self._live(key)
+            if cmd == "SET":
+                opts = [a.upper() for a in args[3:]]
+                if b"NX" in opts and value is not None:
+                    return None
+                self.data[key] = args[2]
+                self.expires.pop(key, None)
+                for unit, scale in ((b"PX", 0.001), (b"EX", 1)):
+                    if unit in opts:
+                        self.expires[key] = time.monotonic() + int(args[3 + opts.index(unit) + 1]) * scale
+                return "+OK"
+            if cmd == "GET":
+                return value
+            if cmd == "EXISTS":
+                return int(value is not None)
+            if cmd == "PTTL":
+                if value is None:
+                    return -2
+                deadline = self.expires.get(key)
+                return -1 if deadline is None else int((deadline - time.monotonic()) * 1000)
+            if cmd == "EXPIRE":
+                if value is None:
+                    return 0
+                self.expires[key] = time.monotonic() + int(args[2])
+                return 1
+            if cmd == "INCRBY":
+                total = int(value or 0) + int(args[2])
+                self.data[key] = str(total).encode()
+                return total
+            if cmd == "HSET":
+                h = self.data.setdefault(key, {}) if value is None else value
+                new = sum(1 for f in args[2::2] if f not in h)
+                h.update(zip(args[2::2], args[3::2]))
+                return new
+            if cmd == "HGETALL":
+                return [x for kv in (value or {}).items() for x in kv]
+            if cmd == "ZINCRBY":
+                z = self.data.setdefault(key, {}) if value is None else value
+                z[args[3]] = z.get(args[3], 0) + float(args[2])
+                return repr(z[args[3]]).encode()
+            if cmd == "ZREVRANGE":
+                ranked = sorted((value or {}).items(), key=lambda kv: -kv[1])
+                stop = int(args[3])
+                ranked = ranked[int(args[2]):None if stop == -1 else stop + 1]
+                if len(args) > 4:
+                    return [x for m, score in ranked for x in (m, repr(score).encode())]
+                return [m for m, _ in ranked]
+            return f"-ERR unknown command '{cmd}'"
+
+
+class FakeRespHandler(socketserver.StreamRequestHandler):
+    def _reply(self, value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, str):
+            return (value + "\r\n").encode()
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(self._reply(v) for v in value)
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                n = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(n + 2)[:-2])
+            self.wfile.write(self._reply(self.server.run(args)))
+
+
+# ------------------ SYNTHETIC UPDATES ------------------
+class UpdateFactory:
+    def __init__(self, api: LoadTestBot, users: list, titles: list):
+        self.api = api
+        self.users = users
+        self.titles = titles
+        self.update_id = 0
+        self.channel_msg_id = 10_000_000
+        self.user_data = {}
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def context(self, uid: int):
+        return SimpleNamespace(bot=self.api, args=[], user_data=self.user_data.setdefault(uid, {}))
+
+    def _user_message(self, uid: int, text: str):
+        user = User(id=uid, first_name=f"load{uid}", is_bot=False)
+        chat = Chat(id=uid, type=Chat.PRIVATE)
+        msg = Message(message_id=self._next(), date=datetime.now(timezone.utc), chat=chat, from_user=user, text=text)
+        msg.set_bot(self.api)
+        return user, msg
+
+    def search(self):
+        uid = random.choice(self.users)
+        roll = random.random()
+        if roll < 0.5:
+            text = random.choice(self.titles)                        # exact title
+        elif roll < 0.8:
+            text = random.choice(self.titles)[:-2]                   # truncated / misspelt -> fuzzy
+        elif roll < 0.9:
+            text = random.choice(self.titles) + " " + random.choice(QUALITIES)
+        else:
+            text = " ".join(random.sample(WORDS, 2)) + " zz"         # miss
+        _, msg = self._user_message(uid, text)
+        update = Update(update_id=self.update_id, message=msg)
+        return bot.handle_message, update, self.context(uid)
+
+    def callback(self, kind: str):
+        if not bot.search_sessions:
+            return self.search()
+        token = random.choice(list(bot.search_sessions.keys())[-200:])
+        session = bot.search_sessions[token]
+        if kind == "page":
+            data = f"page:{token}:{random.randint(0, max(0, (len(session.ids) - 1) // bot.SUGGESTIONS_PER_PAGE))}"
+        else:
+            data = f"confirm:{token}:{random.randrange(len(session.ids))}"
+        uid = session.user_id if random.random() < 0.8 else random.choice(self.users)
+        user, msg = self._user_message(uid, "suggestions")
+        query = CallbackQuery(id=str(self._next()), from_user=user, chat_instance="load", data=data, message=msg)
+        query.set_bot(self.api)
+        update = Update(update_id=self.update_id, callback_query=query)
+        return bot.button_handler, update, self.context(uid)
+
+    def channel_post(self):
+        self.channel_msg_id += 1
+        title = random.choice(self.titles) if random.random() < 0.5 else " ".join(random.sample(WORDS, 3))
+        name = f"{title.title().replace(' ', '.')}.{random.choice(QUALITIES)}.{random.choice(LANGUAGES)}.mkv"
+        chat = Chat(id=bot.CHANNEL_ID, type=Chat.CHANNEL)
+        doc = Document(file_id=f"f{self.channel_msg_id}", file_unique_id=f"u{self.channel_msg_id}",
+                       file_name=name, file_size=random.randint(200, 2000) * 1024 * 1024)
+        msg = Message(message_id=self.channel_msg_id, date=datetime.now(timezone.utc), chat=chat,
+                      document=doc, caption=name)
+        msg.set_bot(self.api)
+        update = Update(update_id=self._next(), channel_post=msg)
+        return bot.handle_channel_post, update, self.context(0)
+
+
+def seed_catalog(n_titles: int, n_users: int, variants: int):
+    """Fill the index with synthetic titles and give every synthetic user verified access."""
+    titles = set()
+    while len(titles) < n_titles:
+        titles.add(" ".join(random.sample(WORDS, 3)) + f" {random.randint(1970, 2025)}")
+    titles = sorted(titles)
+    msg_id = 1
+    for title in titles:
+        for _ in range(random.randint(1, variants)):
+            facets = {"quality": random.choice(QUALITIES), "language": random.choice(LANGUAGES)}
+            bot.add_movie_variant(title, bot.make_variant(msg_id, facets, random.randint(200, 2000) * 1024 * 1024))
+            msg_id += 1
+    users = [900_000_000 + i for i in range(n_users)]
+    until = time.time() + 30 * 24 * 3600
+    for uid in users:
+        bot.user_access[str(uid)] = until
+        bot.verified_users.add(str(uid))
+    return titles, users
+
+
+# ------------------ DRIVER ------------------
+def parse_mix(spec: str) -> list:
+    kinds, weights = [], []
+    for part in spec.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in ("search", "page", "confirm", "channel"):
+            raise SystemExit(f"unknown update kind in --mix: {kind}")
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    return [kinds, weights]
+
+
+def percentile(ordered: list, q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_load(args, api: LoadTestBot, factory: UpdateFactory):
+    kinds, weights = parse_mix(args.mix)
+    latencies = {k: [] for k in kinds}
+    errors = Counter()
+    first_errors = {}
+    inflight = set()
+    peak_inflight = 0
+
+    closed = False  # set at the drain deadline; work finishing later is not counted
+
+    def record_error(e: BaseException):
+        if closed:
+            return
+        name = type(e).__name__
+        errors[name] += 1
+        if name not in first_errors:
+            first_errors[name] = "".join(traceback.format_exception(type(e), e, e.__traceback__))
+
+    async def one(kind, handler, update, ctx):
+        start = time.perf_counter()
+        try:
+            await handler(update, ctx)
+        except Exception as e:
+            record_error(e)
+        if not closed:
+            latencies[kind].append(time.perf_counter() - start)
+
+    # production pipeline: latency is measured from enqueue to the end of processing
+    app = None
+    enqueued = {}  # update_id -> (kind, enqueue time)
+    if not args.direct:
+        app = bot.build_application(updater=False, bot=api)
+        process_update = app.process_update
+
+        async def timed_process_update(update):
+            kind, start = enqueued.pop(update.update_id)
+            try:
+                await process_update(update)
+            finally:
+                if not closed:
+                    latencies[kind].append(time.perf_counter() - start)
+        app.process_update = timed_process_update
+
+        async def on_error(update, context):
+            record_error(context.error)
+        app.add_error_handler(on_error)
+        await app.initialize()
+        await app.start()
+
+    bot.start_loop_monitor(api)
+    tick = 0.01
+    sent = 0
+    started = time.perf_counter()
+    deadline = started + args.duration
+    while (now := time.perf_counter()) < deadline:
+        # open loop on the wall clock: if the event loop stalls, the missed
+        # updates arrive together afterwards, as they would from Telegram
+        due = int(args.rate * (now - started))
+        for _ in range(due - sent):
+            kind = random.choices(kinds, weights)[0]
+            if kind == "search":
+                handler, update, ctx = factory.search()
+            elif kind == "channel":
+                handler, update, ctx = factory.channel_post()
+            else:
+                handler, update, ctx = factory.callback(kind)
+            if app is not None:
+                enqueued[update.update_id] = (kind, time.perf_counter())
+                app.update_queue.put_nowait(update)
+            else:
+                task = asyncio.create_task(one(kind, handler, update, ctx))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+            sent += 1
+        peak_inflight = max(peak_inflight, app.update_queue.qsize() if app is not None else len(inflight))
+        await asyncio.sleep(tick)
+    if app is not None:
+        drain_until = time.perf_counter() + args.drain
+        while sum(map(len, latencies.values())) < sent and time.perf_counter() < drain_until:
+            await asyncio.sleep(tick)
+    elif inflight:
+        await asyncio.wait(list(inflight), timeout=args.drain)
+    closed = True
+    elapsed = time.perf_counter() - started
+    done = sum(len(v) for v in latencies.values())
+    if app is not None:
+        # stop() would process whatever is still queued first
+        while not app.update_queue.empty():
+            app.update_queue.get_nowait()
+            app.update_queue.task_done()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+    else:
+        for task in inflight:
+            task.cancel()
+    return SimpleNamespace(sent=sent, elapsed=elapsed, latencies=latencies, errors=errors, first_errors=first_errors,
+                           peak_inflight=peak_inflight, done=done, unfinished=sent - done)
+
+
+def report(args, api: LoadTestBot, result) -> str:
+    done = result.done
+    peak = "peak in flight" if args.direct else "peak queue depth"
+    lines = [
+        f"Load test: {args.duration:.0f}s at {args.rate}/s target, "
+        f"{args.titles} titles, {args.users} users, API latency {args.latency_ms:.0f}ms, "
+        + ("handlers called directly" if args.direct else "through the Application"),
+        f"Updates: {result.sent} sent, {done} completed, {result.unfinished} unfinished, "
+        f"{peak} {result.peak_inflight}",
+        f"Throughput: {done / result.elapsed:.0f} updates/s over {result.elapsed:.1f}s",
+        "",
+        ("Handler" if args.direct else "Enqueue-to-done") + " latency (ms):     count     p50     p90     p99     max",
+    ]
+    for kind, values in result.latencies.items():
+        ordered = sorted(values)
+        lines.append(
+            f"  {kind:<20} {len(ordered):>8} {percentile(ordered, 0.5) * 1000:>7.1f} "
+            f"{percentile(ordered, 0.9) * 1000:>7.1f} {percentile(ordered, 0.99) * 1000:>7.1f} "
+            f"{(ordered[-1] if ordered else 0) * 1000:>7.1f}"
+        )
+    lines.append("")
+    lines.append(f"Bot API calls: {api.total_calls} ({api.total_calls / result.elapsed:.0f}/s), "
+                 f"RetryAfter: {sum(api.retries.values())}")
+    for method, n in api.calls.most_common():
+        retried = f" ({api.retries[method]} RetryAfter)" if api.retries[method] else ""
+        lines.append(f"  {method}: {n}{retried}")
+    per_delivery = f"{api.total_calls / api.deliveries:.2f}" if api.deliveries else "n/a"
+    lines.append(f"Successful deliveries: {api.deliveries} | API calls per delivery: {per_delivery}")
+    lines.append(f"Handler exceptions: {dict(result.errors) if result.errors else 'none'}")
+    if not args.direct:
+        lines.append(f"Rate limiter: {bot.counters['throttled']} throttled, {bot.counters['shed']} shed")
+    for name, tb in result.first_errors.items():
+        lines.append(f"  first {name}:\n" + tb.rstrip())
+    lines.append(f"Channel posts: {bot.ingest_stats['enqueued']} enqueued, {bot.ingest_stats['indexed']} indexed")
+    lines.append(f"Event loop lag: p99 {bot.loop_lag_percentile(0.99) * 1000:.0f}ms, "
+                 f"max {bot._lag_state['max'] * 1000:.0f}ms")
+    for site, n in sorted(bot.stall_sites.items(), key=lambda kv: -kv[1])[:5]:
+        lines.append(f"  stalled {n}x in {site}")
+    return "\n".join(lines)
+
+
+
+async def main_async(args):
+    random.seed(args.seed)
+    # Gemini is never called; the regex fallback cleaner runs after a simulated round trip
+    ai_delay = args.ai_latency_ms / 1000.0
+
+    def fake_gemini(prompt_text: str) -> str:
+        time.sleep(ai_delay)
+        return ""
+    bot.call_gemini_direct = fake_gemini
+    bot.USER_COOLDOWN = args.cooldown
+    resp_server = None
+    if args.state_backend == "resp":
+        resp_server = FakeRespServer()
+        threading.Thread(target=resp_server.serve_forever, name="fake-resp", daemon=True).start()
+        bot.state_backend = bot.RespStateBackend(bot.RespClient("127.0.0.1", resp_server.port), "loadtest:")
+
+    api = LoadTestBot(args.latency_ms, args.retry_rate, args.api_limit, args.retry_after)
+    titles, users = seed_catalog(args.titles, args.users, args.variants)
+    factory = UpdateFactory(api, users, titles)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+        result = await run_load(args, api, factory)
+    print(report(args, api, result))
+    if resp_server is not None:
+        print(f"State backend (fake RESP) commands: {dict(resp_server.commands.most_common())}")
+
+    # auto-delete timers and background workers are not part of the measurement
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the bot's update handlers.")
+    parser.add_argument("--rate", type=int, default=1000, help="target updates per second")
+    parser.add_argument("--duration", type=float, default=15, help="seconds to generate load")
+    parser.add_argument("--drain", type=float, default=30, help="seconds to wait for in-flight updates afterwards")
+    parser.add_argument("--mix", default="search=60,page=10,confirm=20,channel=10",
+                        help="update mix as kind=weight (kinds: search, page, confirm, channel)")
+    parser.add_argument("--titles", type=int, default=5000, help="synthetic titles to index")
+    parser.add_argument("--variants", type=int, default=3, help="max versions per title")
+    parser.add_argument("--users", type=int, default=2000, help="synthetic users")
+    parser.add_argument("--latency-ms", type=float, default=50, help="mean simulated Bot API round trip")
+    parser.add_argument("--ai-latency-ms", type=float, default=0, help="simulated Gemini round trip per channel post")
+    parser.add_argument("--api-limit", type=int, default=0, help="Bot API calls per second before RetryAfter (0 = no limit)")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="share of API calls answered with RetryAfter")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after seconds reported by RetryAfter")
+    parser.add_argument("--cooldown", type=float, default=0, help="per-user search cooldown (bot default is 20s)")
+    parser.add_argument("--state-backend", choices=("local", "resp"), default="local",
+                        help="hot state backend; resp runs against an in-process fake Redis server")
+    parser.add_argument("--data-dir", default=None, help="working directory for the bot's JSON files (default: temp dir)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    parser.add_argument("--direct", action="store_true",
+                        help="call the handlers directly, one task per update (no Application, rate limiter "
+                             "or sequential processing)")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="botload-")
+    os.makedirs(data_dir, exist_ok=True)
+    os.chdir(data_dir)
+    sys.path.insert(0, here)
+    global bot
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+        import bot as bot_module
+    bot = bot_module
+    print(f"Bot state directory: {data_dir}")
+    try:
+        asyncio.run(main_async(args))
+    except asyncio.CancelledError:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def bot(tmp_path_factory):
+    # bot.py loads and saves its state files in the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("state"))
+    sys.path.insert(0, ROOT)
+    try:
+        yield importlib.import_module("bot")
+    finally:
+        sys.path.remove(ROOT)
+        os.chdir(cwd)
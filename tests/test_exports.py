@@ -0,0 +1,39 @@
+import asyncio
+import csv
+import gzip
+import io
+
+import pytest
+from telegram import Document, InputFile
+from telegram._utils.files import parse_file_input
+
+
+class UploadMessage:
+    """Stands in for Message.reply_document: builds the upload the way Bot.send_document does."""
+
+    def __init__(self):
+        self.uploads = []
+
+    async def reply_document(self, document, filename=None, caption=None, **kwargs):
+        upload = parse_file_input(document, tg_type=Document, filename=filename)
+        assert isinstance(upload, InputFile)
+        self.uploads.append((upload, caption))
+
+
+def read_upload(upload):
+    return list(csv.reader(io.StringIO(gzip.decompress(upload.input_file_content).decode("utf-8"))))
+
+
+@pytest.mark.parametrize("spool_bytes", [8 * 1024 * 1024, 1])  # kept in memory, rolled over to disk
+def test_send_export_uploads_through_input_file(bot, monkeypatch, spool_bytes):
+    monkeypatch.setattr(bot, "EXPORT_SPOOL_BYTES", spool_bytes)
+    for uid in range(900001, 900051):
+        bot.get_user_state(uid, create=True)
+    message = UploadMessage()
+    count = asyncio.run(bot.send_export(message, "users"))
+    (upload, caption), = message.uploads
+    assert upload.filename.startswith("users-") and upload.filename.endswith(".csv.gz")
+    assert caption == f"{count} users rows"
+    rows = read_upload(upload)
+    assert rows[0] == list(bot.EXPORT_COLUMNS["users"])
+    assert len(rows) == count + 1 >= 51
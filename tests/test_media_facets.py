@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.mark.parametrize("title, key, season, episode", [
+    ("Ocean's 11 2001", "ocean's 11 2001", 0, 0),
+    ("Ocean's 12", "ocean's 12", 0, 0),
+    ("Ocean’s 13", "ocean’s 13", 0, 0),
+    ("Dragon's 2", "dragon's 2", 0, 0),
+    ("Friends s 1", "friends s 1", 0, 0),
+    ("Mission Impossible 2 720p", "mission impossible 2", 0, 0),
+    ("Breaking.Bad.S01E02.720p.mkv", "breaking bad", 1, 2),
+    ("Dark Season 2 Hindi", "dark", 2, 0),
+    ("Dark S02", "dark", 2, 0),
+    ("Dark E05", "dark", 0, 5),
+    ("Dark Season 1 Episode 5", "dark", 1, 5),
+    ("Mirzapur S2 E3", "mirzapur", 2, 3),
+    ("Money Heist S3E1", "money heist", 3, 1),
+    ("Dark S2", "dark", 2, 0),
+    ("Show ep3", "show", 0, 3),
+    ("Show Ep 4 720p", "show", 0, 4),
+    ("Ocean\u2019s01 x", "ocean\u2019s01 x", 0, 0),
+])
+def test_season_episode_markers(bot, title, key, season, episode):
+    facets = bot.parse_media_facets(title)
+    assert (facets["season"], facets["episode"]) == (season, episode)
+    assert bot.title_group_key(title.replace(".", " ")) == key
+
+
+def test_possessive_titles_stay_separate(bot):
+    keys = {bot.title_group_key(t) for t in ("Ocean's 11", "Ocean's 12", "Ocean's 13")}
+    assert len(keys) == 3
+
+
+def test_curly_apostrophe_is_not_a_marker(bot):
+    assert bot.parse_media_facets("Ocean\u2019s01 x")["season"] == 0
+    assert bot.parse_media_facets("Ocean\u2019s E05")["episode"] == 5